@@ -53,6 +53,12 @@ def generate_go_upstream_config(config_module, env_vars, api_key_env_var):
         "use_reasoning_as_fallback": False
     })
 
+    # 限额配置：优先使用 config.py 中声明的 LIMIT（rpm/tpm/daily）
+    limit = getattr(config_module, "LIMIT", {}) or {}
+    daily_limit = limit.get("daily") or 5000
+    hourly_limit = limit.get("hourly") or (limit.get("rpm") * 60 if limit.get("rpm") else 1000)
+    monthly_limit = limit.get("monthly") or daily_limit * 30
+
     # 生成 YAML 配置
     yaml_content = f"""name: "{config_module.__name__.replace('upstream_config_', '')}"
 address: "{base_url}"
@@ -62,9 +68,9 @@ default_weight: {default_weight}
 
 # 限额配置（根据实际情况调整）
 limit:
-  hourly: 1000
-  daily: 5000
-  monthly: 100000
+  hourly: {hourly_limit}
+  daily: {daily_limit}
+  monthly: {monthly_limit}
 
 # 阈值配置
 thresholds:
@@ -13,16 +13,25 @@ from datetime import datetime
 from typing import Dict, List, Tuple, Any
 import subprocess
 import os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 配置
 BASE_URL = "http://localhost:5000"
 TEST_TIMEOUT = 10
 API_TIMEOUT = 30
+# 并发执行：线程池大小、每个分类默认的最大并发数、整轮测试的截止时间（秒）
+MAX_WORKERS = 8
+CATEGORY_CONCURRENCY = 4
+TEST_DEADLINE = 300
 
 # 测试计划
 TEST_PLAN = {
     "1. 服务启动测试": {
         "description": "测试服务是否正常启动",
+        # serial: 分类内按顺序执行，且在并发阶段之前完成（其他测试依赖服务已启动）
+        "serial": True,
         "tests": [
             {"name": "健康检查", "endpoint": "/health", "method": "GET", "expected": 200},
             {"name": "服务状态", "endpoint": "/health", "method": "GET", "expected_fields": ["status", "available_count"]},
@@ -30,6 +39,7 @@ TEST_PLAN = {
     },
     "2. 调试端点测试": {
         "description": "测试调试相关端点",
+        "concurrency": 3,
         "tests": [
             {"name": "统计信息", "endpoint": "/debug/stats", "method": "GET", "expected": 200},
             {"name": "API 列表", "endpoint": "/debug/apis", "method": "GET", "expected": 200, "timeout": 15},
@@ -38,6 +48,8 @@ TEST_PLAN = {
     },
     "3. 代理转发测试": {
         "description": "测试代理转发功能",
+        # 转发会占用上游配额，限制同时进行的数量
+        "concurrency": 1,
         "tests": [
             {
                 "name": "简单聊天",
@@ -63,7 +75,12 @@ TEST_PLAN = {
 }
 
 class TestRunner:
-    def __init__(self):
+    def __init__(self, max_workers: int = MAX_WORKERS, deadline: float = TEST_DEADLINE):
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.deadline_at = None
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
         self.test_results = []
         self.start_time = None
         self.end_time = None
@@ -74,16 +91,19 @@ class TestRunner:
 
     def log(self, message: str, level: str = "INFO"):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] [{level}] {message}")
+        with self._log_lock:
+            print(f"[{timestamp}] [{level}] {message}")
 
     def run_test(self, test_case: Dict[str, Any], category: str) -> Dict[str, Any]:
-        """运行单个测试"""
-        self.total_tests += 1
+        """运行单个测试（只返回结果，计数由 _record 统一处理）"""
         test_name = test_case["name"]
         endpoint = test_case["endpoint"]
         method = test_case["method"]
         expected = test_case.get("expected", None)
         timeout = test_case.get("timeout", TEST_TIMEOUT)
+        if self.deadline_at is not None:
+            # 请求超时不超过整轮测试剩余时间
+            timeout = max(1, min(timeout, self.deadline_at - time.time()))
         data = test_case.get("data", None)
         expected_fields = test_case.get("expected_fields", None)
 
@@ -96,6 +116,8 @@ class TestRunner:
             "status": "PENDING",
             "message": "",
             "response_time": 0,
+            "started_at": 0,
+            "wall_time": 0,
             "response_code": None,
             "response_body": None
         }
@@ -126,8 +148,7 @@ class TestRunner:
             if expected is not None and response.status_code != expected:
                 result["status"] = "FAILED"
                 result["message"] = f"状态码不匹配: 期望 {expected}, 实际 {response.status_code}"
-                self.failed_tests += 1
-                self.log(f"  ✗ 失败: {result['message']}", "ERROR")
+                self.log(f"  ✗ {test_name} 失败: {result['message']}", "ERROR")
                 return result
 
             # 检查响应字段
@@ -135,73 +156,144 @@ class TestRunner:
                 if not isinstance(result["response_body"], dict):
                     result["status"] = "FAILED"
                     result["message"] = "响应不是 JSON 对象"
-                    self.failed_tests += 1
-                    self.log(f"  ✗ 失败: {result['message']}", "ERROR")
+                    self.log(f"  ✗ {test_name} 失败: {result['message']}", "ERROR")
                     return result
 
                 missing_fields = [f for f in expected_fields if f not in result["response_body"]]
                 if missing_fields:
                     result["status"] = "FAILED"
                     result["message"] = f"缺少字段: {', '.join(missing_fields)}"
-                    self.failed_tests += 1
-                    self.log(f"  ✗ 失败: {result['message']}", "ERROR")
+                    self.log(f"  ✗ {test_name} 失败: {result['message']}", "ERROR")
                     return result
 
             # 测试通过
             result["status"] = "PASSED"
             result["message"] = "测试通过"
-            self.passed_tests += 1
-            self.log(f"  ✓ 通过 (状态码: {response.status_code}, 耗时: {result['response_time']}s)")
+            self.log(f"  ✓ {test_name} 通过 (状态码: {response.status_code}, 耗时: {result['response_time']}s)")
             return result
 
         except requests.exceptions.Timeout:
             result["status"] = "FAILED"
             result["message"] = f"请求超时 (超过 {timeout}s)"
-            self.failed_tests += 1
-            self.log(f"  ✗ 失败: {result['message']}", "ERROR")
+            self.log(f"  ✗ {test_name} 失败: {result['message']}", "ERROR")
             return result
 
         except requests.exceptions.ConnectionError:
             result["status"] = "FAILED"
             result["message"] = "连接失败，服务可能未启动"
-            self.failed_tests += 1
-            self.log(f"  ✗ 失败: {result['message']}", "ERROR")
+            self.log(f"  ✗ {test_name} 失败: {result['message']}", "ERROR")
             return result
 
         except Exception as e:
             result["status"] = "FAILED"
             result["message"] = f"异常: {str(e)}"
-            self.failed_tests += 1
-            self.log(f"  ✗ 失败: {result['message']}", "ERROR")
+            self.log(f"  ✗ {test_name} 失败: {result['message']}", "ERROR")
             return result
 
+    def _record(self, result: Dict[str, Any]):
+        """统计测试结果（并发执行时由多个线程调用）"""
+        with self._lock:
+            self.total_tests += 1
+            if result["status"] == "PASSED":
+                self.passed_tests += 1
+            elif result["status"] == "SKIPPED":
+                self.skipped_tests += 1
+            else:
+                self.failed_tests += 1
+
+    def _execute(self, test_case: Dict[str, Any], category: str) -> Dict[str, Any]:
+        """执行单个测试并记录开始偏移和实际耗时；超过整轮截止时间的测试标记为跳过"""
+        started = time.time()
+        if started >= self.deadline_at:
+            result = {
+                "name": test_case["name"],
+                "category": category,
+                "endpoint": test_case["endpoint"],
+                "method": test_case["method"],
+                "expected": test_case.get("expected"),
+                "status": "SKIPPED",
+                "message": f"超过整轮测试截止时间 ({self.deadline}s)，未执行",
+                "response_time": 0,
+                "response_code": None,
+                "response_body": None,
+            }
+            self.log(f"  - {test_case['name']} 跳过: {result['message']}", "WARN")
+        else:
+            result = self.run_test(test_case, category)
+        result["started_at"] = round(started - self.start_time, 3)
+        result["wall_time"] = round(time.time() - started, 3)
+        self._record(result)
+        return result
+
     def run_all_tests(self):
-        """运行所有测试"""
+        """运行所有测试
+
+        serial 分类按计划顺序逐个执行并先于其他分类完成；其余分类的测试提交到线程池，
+        每个分类的同时执行数受 concurrency（默认 CATEGORY_CONCURRENCY）限制
+        """
         self.log("=" * 80)
         self.log("开始测试 Go 版 API 代理服务")
         self.log(f"测试目标: {BASE_URL}")
         self.log(f"开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        self.log(f"线程池: {self.max_workers}，截止时间: {self.deadline}s")
         self.log("=" * 80)
 
         self.start_time = time.time()
+        self.deadline_at = self.start_time + self.deadline
 
+        # 结果按计划中的顺序保存，报告顺序不受执行先后影响
+        ordered = []
+        serial_tasks = []
+        concurrent_tasks = []
         for category, info in TEST_PLAN.items():
-            self.log(f"\n{category}: {info['description']}")
-            self.log("-" * 80)
-
             for test_case in info["tests"]:
-                result = self.run_test(test_case, category)
-                self.test_results.append(result)
+                task = (len(ordered), category, test_case)
+                ordered.append(None)
+                if info.get("serial") or self.max_workers <= 1:
+                    serial_tasks.append(task)
+                else:
+                    concurrent_tasks.append(task)
+
+        current_category = None
+        for index, category, test_case in serial_tasks:
+            if category != current_category:
+                current_category = category
+                self.log(f"\n{category}: {TEST_PLAN[category]['description']} (顺序执行)")
+                self.log("-" * 80)
+            ordered[index] = self._execute(test_case, category)
+
+        if concurrent_tasks:
+            limits = {
+                category: threading.Semaphore(info.get("concurrency", CATEGORY_CONCURRENCY))
+                for category, info in TEST_PLAN.items()
+            }
+
+            def run_limited(task):
+                index, category, test_case = task
+                with limits[category]:
+                    ordered[index] = self._execute(test_case, category)
 
+            categories = list(dict.fromkeys(task[1] for task in concurrent_tasks))
+            self.log(f"\n并发执行 {len(concurrent_tasks)} 个测试: {', '.join(categories)}")
+            self.log("-" * 80)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for future in [pool.submit(run_limited, task) for task in concurrent_tasks]:
+                    future.result()
+
+        self.test_results = ordered
         self.end_time = time.time()
         total_time = round(self.end_time - self.start_time, 2)
 
         self.log("\n" + "=" * 80)
         self.log("测试完成")
         self.log(f"结束时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        self.log(f"总耗时: {total_time}s")
+        self.log(f"总耗时: {total_time}s (顺序执行预计 {self.serial_time()}s)")
         self.log("=" * 80)
 
+    def serial_time(self) -> float:
+        """各测试耗时之和，即逐个执行时的预计总耗时"""
+        return round(sum(r["wall_time"] for r in self.test_results), 2)
+
     def generate_report(self):
         """生成测试报告"""
         report_lines = [
@@ -238,12 +330,13 @@ class TestRunner:
 
             category_results = [r for r in self.test_results if r["category"] == category]
             for result in category_results:
-                status_icon = "✓" if result["status"] == "PASSED" else "✗"
+                status_icon = {"PASSED": "✓", "SKIPPED": "-"}.get(result["status"], "✗")
                 report_lines.append(f"#### {status_icon} {result['name']}")
                 report_lines.append("")
                 report_lines.append(f"- **状态**: {result['status']}")
                 report_lines.append(f"- **端点**: {result['method']} {result['endpoint']}")
                 report_lines.append(f"- **响应时间**: {result['response_time']}s")
+                report_lines.append(f"- **开始于**: +{result['started_at']}s，耗时 {result['wall_time']}s")
                 report_lines.append(f"- **响应码**: {result['response_code']}")
                 report_lines.append(f"- **消息**: {result['message']}")
 
@@ -268,6 +361,25 @@ class TestRunner:
         report_lines.append(f"| 通过率 | {round(self.passed_tests / self.total_tests * 100, 2) if self.total_tests > 0 else 0}% |")
         report_lines.append("")
 
+        # 执行耗时
+        if self.start_time and self.end_time:
+            wall_time = round(self.end_time - self.start_time, 2)
+            serial_time = self.serial_time()
+            report_lines.append("### 执行耗时")
+            report_lines.append("")
+            report_lines.append(f"- **实际总耗时**: {wall_time}s (线程池 {self.max_workers}，截止时间 {self.deadline}s)")
+            report_lines.append(f"- **顺序执行预计**: {serial_time}s")
+            report_lines.append(f"- **节省时间**: {round(max(0, serial_time - wall_time), 2)}s")
+            report_lines.append("")
+            report_lines.append("| 测试 | 分类 | 开始于 | 耗时 | 状态 |")
+            report_lines.append("|------|------|--------|------|------|")
+            for result in sorted(self.test_results, key=lambda r: r["wall_time"], reverse=True):
+                report_lines.append(
+                    f"| {result['name']} | {result['category']} | +{result['started_at']}s | "
+                    f"{result['wall_time']}s | {result['status']} |"
+                )
+            report_lines.append("")
+
         # 失败的测试
         if self.failed_tests > 0:
             report_lines.append("### 失败的测试")
@@ -351,6 +463,11 @@ def start_service():
     time.sleep(5)
 
 def main():
+    parser = argparse.ArgumentParser(description="Go 版 API 代理服务 - 自动化测试工具")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="并发线程数，1 表示全部顺序执行")
+    parser.add_argument("--deadline", type=float, default=TEST_DEADLINE, help="整轮测试截止时间（秒）")
+    args = parser.parse_args()
+
     print("=" * 80)
     print("Go 版 API 代理服务 - 自动化测试工具")
     print("=" * 80)
@@ -370,7 +487,7 @@ def main():
     print("服务已启动，开始测试...\n")
 
     # 创建测试运行器
-    runner = TestRunner()
+    runner = TestRunner(max_workers=args.workers, deadline=args.deadline)
 
     # 运行测试
     runner.run_all_tests()
@@ -386,7 +503,7 @@ def main():
     # 输出最终结果
     print("\n" + "=" * 80)
     print("测试完成")
-    print(f"总计: {runner.total_tests} | 通过: {runner.passed_tests} | 失败: {runner.failed_tests}")
+    print(f"总计: {runner.total_tests} | 通过: {runner.passed_tests} | 失败: {runner.failed_tests} | 跳过: {runner.skipped_tests}")
     print(f"通过率: {round(runner.passed_tests / runner.total_tests * 100, 2) if runner.total_tests > 0 else 0}%")
     print(f"报告文件: {report_file}")
     print("=" * 80)
@@ -1,37 +1,233 @@
 import os
 import sys
+import json
 import time
+import gzip
+import glob
+import base64
+import shutil
 import signal
+import socket
 import subprocess
+import queue
 import threading
+import urllib.request
 from datetime import datetime
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-MAIN_SCRIPT = os.path.join(SCRIPT_DIR, "local_api_proxy.py")
+# 守护的主程序，默认为多 Free API 代理；也可通过 DAEMON_MAIN_SCRIPT 指向
+# free_api_test/free8 或 free11 的 local_api_proxy.py（这些入口都通过 daemon_child.serve_app 提供服务，/health 返回 pid）
+MAIN_SCRIPT = os.path.abspath(os.getenv(
+    "DAEMON_MAIN_SCRIPT",
+    os.path.join(SCRIPT_DIR, "multi_free_api_proxy", "multi_free_api_proxy_v3_optimized.py")
+))
 
 # 读取 CACHE_DIR 环境变量，如果未设置则使用 SCRIPT_DIR
 CACHE_DIR = os.getenv("CACHE_DIR", SCRIPT_DIR)
 LOG_FILE = os.path.join(CACHE_DIR, "daemon.log")
 PID_FILE = os.path.join(CACHE_DIR, "daemon.pid")
 
+# 日志轮转：超过大小或时长即切换新文件，旧文件 gzip 压缩后保留 LOG_BACKUP_COUNT 个
+LOG_MAX_BYTES = int(float(os.getenv("DAEMON_LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_ROTATE_SECONDS = float(os.getenv("DAEMON_LOG_ROTATE_HOURS", "24")) * 3600
+LOG_BACKUP_COUNT = int(os.getenv("DAEMON_LOG_BACKUPS", "5"))
+LOG_QUEUE_SIZE = 10000  # 日志队列上限，写入跟不上时丢弃/采样子进程输出
+LOG_SAMPLE_WATERMARK = 0.8  # 队列超过此比例后，子进程普通输出只保留 1/LOG_SAMPLE_RATE
+LOG_SAMPLE_RATE = 10
+# 采样时仍然保留的重要输出
+LOG_KEEP_KEYWORDS = ("错误", "失败", "异常", "ERROR", "Error", "Traceback", "WARN")
+
 MAX_RESTART_DELAY = 5
 MAX_RESTART_COUNT = 10
 RESTART_WINDOW = 60
 
+# 守护进程持有的监听地址（子进程通过 daemon_child.serve_app 继承）
+LISTEN_HOST = os.getenv("DAEMON_HOST", "localhost")
+LISTEN_PORT = int(os.getenv("DAEMON_PORT", "5000"))
+READY_TIMEOUT = 60  # 新子进程通过 /health 就绪检查的最长等待时间（秒）
+DRAIN_TIMEOUT = 30  # 旧子进程完成进行中请求的最长等待时间（秒）
+
+# 卡死检测：/health 连续 HANG_FAILURES 次超时或延迟超过 HANG_LATENCY 时重启子进程
+HEALTH_CHECK_INTERVAL = int(os.getenv("DAEMON_HEALTH_INTERVAL", "15"))  # 0 表示禁用
+HEALTH_TIMEOUT = 5
+HANG_LATENCY = 3.0
+HANG_FAILURES = 3
+
 
 def is_process_running(pid):
-    """Check if process is running (cross-platform)"""
+    """Check if process is running (cross-platform, no subprocess)"""
+    if sys.platform == "win32":
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+                return False
+            return exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    
     try:
-        process = subprocess.Popen(
-            ['tasklist', '/FI', f'PID eq {pid}'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        output, _ = process.communicate()
-        return str(pid) in output
-    except Exception:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # 进程存在但属于其他用户
+    except OSError:
         return False
+    return True
+
+
+class LogRelay:
+    """缓冲日志中继
+    
+    守护进程自身日志和子进程输出都先进入有界队列，由单独的写线程批量输出到控制台和日志文件，
+    读取子进程输出的线程永远不会因为控制台/磁盘慢而阻塞（否则管道写满会卡住子进程的请求线程）。
+    队列积压时对子进程普通输出采样，队列满时丢弃，并定期记录丢弃数量。
+    当前日志文件的开始时间记录在 <日志文件>.started 中，重启后按它计算轮转时长
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.started_path = path + ".started"
+        self.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        # 计数器由多个读取线程和写线程修改，统一加锁
+        self.stats = {"written": 0, "dropped": 0, "sampled_out": 0, "rotations": 0}
+        self._stats_lock = threading.Lock()
+        self._reported_loss = 0
+        self._sample_counter = 0
+        self._file = None
+        self._opened_at = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._writer_loop, name="log-relay", daemon=True)
+        self._thread.start()
+    
+    def submit(self, line, important=True):
+        """提交一行日志（不阻塞）；important=False 的行在积压时可被采样丢弃"""
+        if not important and self.queue.qsize() >= LOG_QUEUE_SIZE * LOG_SAMPLE_WATERMARK:
+            if not any(keyword in line for keyword in LOG_KEEP_KEYWORDS):
+                with self._stats_lock:
+                    self._sample_counter += 1
+                    if self._sample_counter % LOG_SAMPLE_RATE:
+                        self.stats["sampled_out"] += 1
+                        return
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self._count("dropped")
+    
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+    
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+    
+    def _open(self):
+        self._file = open(self.path, "a", encoding="utf-8", buffering=64 * 1024)
+        self._opened_at = time.time()
+        if self._file.tell() > 0:
+            # 沿用已有文件时使用记录的开始时间（文件修改时间只反映最后一次写入）
+            try:
+                with open(self.started_path, "r", encoding="utf-8") as f:
+                    self._opened_at = float(f.read().strip())
+                return
+            except (OSError, ValueError):
+                pass
+        try:
+            with open(self.started_path, "w", encoding="utf-8") as f:
+                f.write(str(self._opened_at))
+        except OSError:
+            pass
+    
+    def _rotate(self):
+        """切换日志文件，压缩旧文件并清理超出数量的备份"""
+        self._file.close()
+        self._file = None
+        base, ext = os.path.splitext(self.path)
+        self._count("rotations")
+        rotated = f"{base}.{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.get_stats()['rotations']:04d}{ext}"
+        try:
+            os.replace(self.path, rotated)
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+            backups = sorted(glob.glob(f"{base}.*{ext}.gz"))
+            for old in backups[:-LOG_BACKUP_COUNT] if LOG_BACKUP_COUNT > 0 else backups:
+                os.remove(old)
+        except OSError as e:
+            print(f"[log-relay] rotate failed: {e}")
+        self._open()
+    
+    def _write_batch(self, lines):
+        text = "\n".join(lines) + "\n"
+        try:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
+        
+        try:
+            if self._file is None:
+                self._open()
+            elif (self._file.tell() >= LOG_MAX_BYTES
+                  or (LOG_ROTATE_SECONDS and time.time() - self._opened_at >= LOG_ROTATE_SECONDS)):
+                self._rotate()
+            self._file.write(text)
+            self._file.flush()
+            self._count("written", len(lines))
+        except OSError:
+            pass
+    
+    def _writer_loop(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            try:
+                lines = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(lines) < 1000:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stats = self.get_stats()
+            lost = stats["dropped"] + stats["sampled_out"]
+            if lost > self._reported_loss:
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                lines.append(f"[{timestamp}] [log-relay] output backlog: "
+                             f"{stats['dropped']} dropped, {stats['sampled_out']} sampled out so far")
+                self._reported_loss = lost
+            self._write_batch(lines)
+    
+    def close(self, timeout=5):
+        """写出队列中剩余的日志并关闭文件"""
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def create_listen_socket():
+    """创建可被子进程继承的监听 socket，端口被占用时返回 None"""
+    try:
+        family = socket.AF_INET6 if ":" in LISTEN_HOST else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if sys.platform != "win32":
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((LISTEN_HOST, LISTEN_PORT))
+        sock.listen(128)
+        sock.set_inheritable(True)
+        return sock
+    except OSError:
+        return None
 
 
 class Daemon:
@@ -40,10 +236,20 @@ class Daemon:
         self.restart_count = 0
         self.restart_times = []
         self.running = True
+        self.listen_socket = None
+        self.process_started_at = 0
+        # 子进程退出、卡死、reload 请求都作为事件投递，主循环阻塞等待，空闲时不占用 CPU
+        self.events = queue.Queue()
+        self.stop_event = threading.Event()
+        self.health = {"last_latency_ms": None, "consecutive_failures": 0, "hang_restarts": 0}
+        self.log_relay = None
     
     def log(self, message):
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         log_message = f"[{timestamp}] {message}"
+        if self.log_relay:
+            self.log_relay.submit(log_message)
+            return
         print(log_message)
         try:
             with open(LOG_FILE, "a", encoding="utf-8") as f:
@@ -65,9 +271,14 @@ class Daemon:
         except Exception:
             pass
     
+    def reload_handler(self, signum, frame):
+        self.log(f"Received signal {signum}, graceful reload requested")
+        self.events.put(("reload", None, None))
+    
     def signal_handler(self, signum, frame):
         self.log(f"Received signal {signum}, stopping daemon...")
         self.running = False
+        self.stop_event.set()
         if self.process:
             self.process.terminate()
             try:
@@ -75,6 +286,8 @@ class Daemon:
             except subprocess.TimeoutExpired:
                 self.process.kill()
         self.delete_pid()
+        if self.log_relay:
+            self.log_relay.close()
         sys.exit(0)
     
     def check_restart_limit(self):
@@ -87,44 +300,190 @@ class Daemon:
         
         return True
     
-    def start_process(self):
-        self.log("Starting main program...")
-        
+    def spawn_process(self):
+        """启动一个子进程（有监听 socket 时传给子进程）"""
         env = os.environ.copy()
         env["PYTHONUNBUFFERED"] = "1"
         env["DAEMON_CHILD"] = "1"
         
-        self.process = subprocess.Popen(
+        kwargs = {}
+        if self.listen_socket and sys.platform == "win32":
+            # Windows 不能继承 socket 句柄，启动后通过 stdin 传递 socket.share() 数据
+            env["LISTEN_SHARE"] = "1"
+            kwargs["stdin"] = subprocess.PIPE
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        elif self.listen_socket:
+            env["LISTEN_FD"] = str(self.listen_socket.fileno())
+            kwargs["pass_fds"] = (self.listen_socket.fileno(),)
+        
+        process = subprocess.Popen(
             [sys.executable, MAIN_SCRIPT],
-            cwd=SCRIPT_DIR,
+            cwd=os.path.dirname(MAIN_SCRIPT),
             env=env,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
-            bufsize=1
+            bufsize=1,
+            **kwargs
         )
         
-        self.output_thread = threading.Thread(target=self.read_output, daemon=True)
-        self.output_thread.start()
+        if self.listen_socket and sys.platform == "win32":
+            share = self.listen_socket.share(process.pid)
+            process.stdin.write(base64.b64encode(share).decode("ascii") + "\n")
+            process.stdin.flush()
+            process.stdin.close()
         
+        threading.Thread(target=self.read_output, args=(process,), daemon=True).start()
+        threading.Thread(target=self.watch_process, args=(process,), daemon=True).start()
+        return process
+    
+    def start_process(self):
+        self.log("Starting main program...")
+        self.process = self.spawn_process()
+        self.process_started_at = time.time()
         self.log(f"Main program started (PID: {self.process.pid})")
         return self.process
     
-    def read_output(self):
-        if self.process and self.process.stdout:
-            for line in self.process.stdout:
-                if line:
+    def watch_process(self, process):
+        """阻塞等待子进程退出，并投递退出事件"""
+        exit_code = process.wait()
+        self.events.put(("exit", process, exit_code))
+    
+    def check_health(self):
+        """请求 /health，返回延迟秒数，失败返回 None"""
+        url = f"http://{LISTEN_HOST}:{LISTEN_PORT}/health"
+        start = time.time()
+        try:
+            with urllib.request.urlopen(url, timeout=HEALTH_TIMEOUT) as response:
+                response.read()
+                if response.status != 200:
+                    return None
+        except (OSError, ValueError):
+            return None
+        return time.time() - start
+    
+    def health_loop(self):
+        """定期检查 /health，检测进程存活但不再响应（卡死）的情况"""
+        while not self.stop_event.wait(HEALTH_CHECK_INTERVAL):
+            process = self.process
+            # 启动探测期间不检查
+            if not process or process.poll() is not None or time.time() - self.process_started_at < READY_TIMEOUT:
+                self.health["consecutive_failures"] = 0
+                continue
+            
+            latency = self.check_health()
+            if latency is not None:
+                self.health["last_latency_ms"] = round(latency * 1000, 1)
+            if latency is not None and latency <= HANG_LATENCY:
+                self.health["consecutive_failures"] = 0
+                continue
+            
+            self.health["consecutive_failures"] += 1
+            detail = "no response" if latency is None else f"{latency:.1f}s"
+            self.log(f"Health check slow/failed ({detail}), "
+                     f"{self.health['consecutive_failures']}/{HANG_FAILURES}")
+            if self.health["consecutive_failures"] >= HANG_FAILURES:
+                self.health["consecutive_failures"] = 0
+                self.events.put(("hung", process, latency))
+    
+    def next_event(self):
+        # Windows 上阻塞的 Queue.get 不响应 Ctrl+C，需要定期返回让信号处理函数执行
+        try:
+            return self.events.get(timeout=1 if sys.platform == "win32" else None)
+        except queue.Empty:
+            return None
+    
+    def read_output(self, process):
+        if process and process.stdout:
+            for line in process.stdout:
+                if not line:
+                    continue
+                if self.log_relay:
+                    self.log_relay.submit(f"[API] {line.rstrip()}", important=False)
+                else:
                     print(f"[API] {line.rstrip()}")
     
+    def wait_ready(self, process, timeout=READY_TIMEOUT):
+        """等待子进程通过 /health 就绪检查
+        
+        新旧子进程共享同一个监听 socket，/health 可能由旧子进程应答，
+        只有返回的 pid 与新子进程一致才算就绪（不返回 pid 的响应一律不算）
+        """
+        url = f"http://{LISTEN_HOST}:{LISTEN_PORT}/health"
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if process.poll() is not None:
+                return False
+            try:
+                with urllib.request.urlopen(url, timeout=2) as response:
+                    body = json.loads(response.read().decode("utf-8") or "{}")
+                    if response.status == 200 and body.get("pid") == process.pid:
+                        return True
+            except (OSError, ValueError):
+                pass
+            time.sleep(0.2)
+        return False
+    
+    def drain_process(self, process, timeout=DRAIN_TIMEOUT):
+        """通知旧子进程停止接受新连接并完成进行中的请求，超时后强制结束"""
+        try:
+            if sys.platform == "win32":
+                os.kill(process.pid, signal.CTRL_BREAK_EVENT)
+            else:
+                process.terminate()
+            process.wait(timeout=timeout)
+            self.log(f"Old program drained (PID: {process.pid})")
+        except subprocess.TimeoutExpired:
+            self.log(f"Old program did not exit in {timeout}s, killing (PID: {process.pid})")
+            process.kill()
+        except OSError:
+            pass
+    
+    def graceful_reload(self):
+        """热备切换：新子进程就绪后再让旧子进程退出，期间监听 socket 始终可用"""
+        if not self.listen_socket:
+            self.log("Graceful reload needs the daemon-owned socket, restarting instead")
+            old = self.process
+            self.drain_process(old)
+            self.start_process()
+            return
+        
+        self.log("Starting standby program for graceful reload...")
+        standby = self.spawn_process()
+        if not self.wait_ready(standby):
+            self.log(f"Standby program not ready (PID: {standby.pid}), keeping current program")
+            if standby.poll() is None:
+                standby.kill()
+            return
+        
+        old, self.process = self.process, standby
+        self.log(f"Standby program ready (PID: {standby.pid}), draining old program (PID: {old.pid})")
+        threading.Thread(target=self.drain_process, args=(old,), daemon=True).start()
+    
     def monitor(self):
         self.start_process()
+        if HEALTH_CHECK_INTERVAL > 0:
+            threading.Thread(target=self.health_loop, daemon=True).start()
         
         while self.running:
-            time.sleep(1)
+            event = self.next_event()
+            if event is None:
+                continue
+            kind, process, exit_code = event
             
-            if self.process.poll() is not None:
-                exit_code = self.process.returncode
-                
+            if kind == "reload":
+                self.graceful_reload()
+                continue
+            
+            if kind == "hung":
+                if process is self.process and process.poll() is None:
+                    self.health["hang_restarts"] += 1
+                    self.log(f"Main program not responding (PID: {process.pid}), killing")
+                    process.kill()  # 退出事件随后到达，按崩溃处理重启
+                continue
+            
+            # 热备切换后旧子进程、未就绪的备用子进程退出，无需处理
+            if kind == "exit" and process is self.process:
                 if exit_code == 0:
                     self.log("Main program exited normally")
                     break
@@ -148,6 +507,8 @@ class Daemon:
         
         self.delete_pid()
         self.log("Daemon stopped")
+        if self.log_relay:
+            self.log_relay.close()
     
     def run(self):
         # 确保 CACHE_DIR 目录存在
@@ -169,10 +530,24 @@ class Daemon:
             except (ValueError, ProcessLookupError, PermissionError):
                 self.delete_pid()
         
+        if not os.path.exists(MAIN_SCRIPT):
+            print(f"Main script not found: {MAIN_SCRIPT} (set DAEMON_MAIN_SCRIPT)")
+            sys.exit(1)
+        
         self.write_pid()
+        self.log_relay = LogRelay(LOG_FILE)
+        
+        # 监听 socket 由守护进程持有：子进程崩溃重启期间连接在 backlog 中排队，而不是被拒绝
+        self.listen_socket = create_listen_socket()
+        if self.listen_socket:
+            self.log(f"Listening socket held by daemon: {LISTEN_HOST}:{LISTEN_PORT}")
+        else:
+            self.log(f"Cannot bind {LISTEN_HOST}:{LISTEN_PORT}, child will bind the port itself")
         
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self.reload_handler)
         
         if sys.platform == "win32":
             signal.signal(signal.SIGBREAK, self.signal_handler)
@@ -208,12 +583,34 @@ def status():
         return False
 
 
+def reload():
+    """请求守护进程热备切换（POSIX 发送 SIGHUP）"""
+    if not os.path.exists(PID_FILE):
+        print("Daemon not running")
+        return False
+    if not hasattr(signal, "SIGHUP"):
+        print("Graceful reload is not supported on this platform, use restart")
+        return False
+    try:
+        with open(PID_FILE, "r") as f:
+            pid = int(f.read().strip())
+        os.kill(pid, signal.SIGHUP)
+        print(f"Reload requested (PID: {pid})")
+        return True
+    except Exception as e:
+        print(f"Reload failed: {e}")
+        return False
+
+
 def stop():
     if os.path.exists(PID_FILE):
         try:
             with open(PID_FILE, "r") as f:
                 pid = int(f.read().strip())
-            subprocess.run(['taskkill', '/PID', str(pid), '/T', '/F'], check=True)
+            if sys.platform == "win32":
+                subprocess.run(['taskkill', '/PID', str(pid), '/T', '/F'], check=True)
+            else:
+                os.kill(pid, signal.SIGTERM)
             print(f"Daemon stopped (PID: {pid})")
             return True
         except Exception as e:
@@ -234,13 +631,15 @@ if __name__ == "__main__":
             stop()
         elif command == "status":
             status()
+        elif command == "reload":
+            reload()
         elif command == "restart":
             if stop():
                 time.sleep(2)
                 daemon = Daemon()
                 daemon.run()
         else:
-            print("Usage: python daemon.py [start|stop|status|restart]")
+            print("Usage: python daemon.py [start|stop|status|reload|restart]")
     else:
         daemon = Daemon()
         daemon.run()
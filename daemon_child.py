@@ -0,0 +1,132 @@
+"""
+守护进程子进程辅助（配合 daemon.py 的无中断重启）
+daemon.py 持有监听 socket 并传给子进程：
+- POSIX：通过 pass_fds 继承，文件描述符号放在环境变量 LISTEN_FD
+- Windows：环境变量 LISTEN_SHARE=1，daemon 把 socket.share() 的数据写到子进程 stdin
+
+子进程调用 serve_app() 代替 app.run()：有继承的 socket 时在其上提供服务，
+收到停止信号（SIGTERM / Windows CTRL_BREAK）后停止接受新连接，等待进行中的请求完成再退出；
+直接运行（没有守护进程）时等同于 app.run()
+"""
+import base64
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+DRAIN_TIMEOUT = float(os.getenv("DAEMON_DRAIN_TIMEOUT", "30"))
+
+# Windows 上 fromshare 得到的 socket 对象需要保持引用，否则句柄会被关闭
+_shared_socket = None
+
+
+def inherited_listen_fd():
+    """返回守护进程传入的监听 socket 描述符，没有则返回 None"""
+    global _shared_socket
+    if os.getenv("LISTEN_FD"):
+        return int(os.environ["LISTEN_FD"])
+
+    if os.getenv("LISTEN_SHARE") == "1" and hasattr(socket, "fromshare"):
+        line = sys.stdin.buffer.readline().strip()
+        if not line:
+            return None
+        _shared_socket = socket.fromshare(base64.b64decode(line))
+        return _shared_socket.fileno()
+    return None
+
+
+def has_inherited_socket() -> bool:
+    """是否由守护进程传入了监听 socket（只检查环境变量，不读取 stdin）"""
+    return bool(os.getenv("LISTEN_FD")) or (os.getenv("LISTEN_SHARE") == "1" and hasattr(socket, "fromshare"))
+
+
+class InFlightTracker:
+    """WSGI 中间件：统计进行中的请求数（流式响应在迭代器关闭时才算结束）"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def _done(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            self.active += 1
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return _ClosingIterator(result, self._done)
+
+    def wait_idle(self, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.active > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+class _ClosingIterator:
+    def __init__(self, iterable, on_close):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._iterable, "close"):
+                self._iterable.close()
+        finally:
+            self._on_close()
+
+
+def serve_app(app, host: str, port: int):
+    """启动 Flask 应用；由守护进程管理时在继承的 socket 上服务并支持优雅退出"""
+    fd = inherited_listen_fd()
+    if fd is None:
+        app.run(host=host, port=port, debug=False, use_reloader=False)
+        return
+
+    from werkzeug.serving import make_server
+
+    tracker = InFlightTracker(app.wsgi_app)
+    app.wsgi_app = tracker
+    server = make_server(host, port, app, threaded=True, fd=fd)
+
+    def drain(signum, frame):
+        print(f"[守护] 收到停止信号 {signum}，停止接受新连接并等待进行中的请求...")
+        # shutdown 会等待 serve_forever 退出，不能在信号处理函数所在的主线程中直接调用
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    if sys.platform == "win32":
+        signal.signal(signal.SIGBREAK, drain)
+
+    print(f"[守护] 使用守护进程提供的监听 socket (PID: {os.getpid()})")
+    server.serve_forever()
+
+    if tracker.wait_idle(DRAIN_TIMEOUT):
+        print("[守护] 进行中的请求已全部完成，退出")
+    else:
+        print(f"[守护] 等待超时，仍有 {tracker.active} 个请求未完成，强制退出")
+    server.server_close()
@@ -32,6 +32,10 @@ USE_SDK = False
 # 最大生成 token 数
 MAX_TOKENS = 2000
 
+# 模型上下文窗口（token 数，可选）
+# multi_free_api_proxy 会跳过放不下 prompt + max_tokens 的上游；不填则按模型名匹配内置表，未知模型不限制
+CONTEXT_WINDOW = 0
+
 # ============ 权重配置 ============
 # 默认权重（越高被选中概率越大，multi_free_api_proxy 使用）
 # 建议范围：10-200
@@ -40,6 +44,17 @@ MAX_TOKENS = 2000
 # - 100-200: 高频使用/优先使用
 DEFAULT_WEIGHT = 10
 
+# ============ 限流配置 ============
+# 上游免费额度（multi_free_api_proxy 在发送前按令牌桶限流，0 或不填表示不限制）
+# - rpm: 每分钟请求数
+# - tpm: 每分钟 token 数（按 prompt 估算 + max_tokens 预留）
+# - daily: 每天请求数
+LIMIT = {
+    "rpm": 0,
+    "tpm": 0,
+    "daily": 0
+}
+
 # ============ 响应格式配置 ============
 # 定义如何从 API 响应中提取内容（multi_free_api_proxy 使用）
 RESPONSE_FORMAT = {
@@ -54,7 +69,10 @@ RESPONSE_FORMAT = {
     "field_separator": "\n\n---\n\n",
     
     # 是否在 content 为空时使用 reasoning_content 作为回退
-    "use_reasoning_as_fallback": False
+    "use_reasoning_as_fallback": False,
+
+    # 归一化后从响应中移除的字段（可选，如 ["reasoning_content"]）
+    "strip_fields": []
 }
 
 # ============ 可选配置 ============
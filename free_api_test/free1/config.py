@@ -21,3 +21,10 @@ RESPONSE_FORMAT = {
     "merge_fields": False,
     "use_reasoning_as_fallback": False
 }
+
+# 限流配置（OpenRouter 免费额度）
+LIMIT = {
+    "rpm": 20,
+    "tpm": 0,
+    "daily": 50
+}
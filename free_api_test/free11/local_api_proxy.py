@@ -15,6 +15,11 @@ from urllib3.util.retry import Retry
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# 共享的调试消息捕获模块位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from message_capture import get_capture
+from daemon_child import serve_app
+
 app = Flask(__name__)
 
 # 配置 requests 会话，使用连接池和重试策略
@@ -88,30 +93,13 @@ def check_debug_mode():
     return Path('DEBUG_MODE.txt').exists()
 
 def save_message_cache(message_type, message_id, data):
-    """保存消息到缓存目录"""
+    """保存消息到调试捕获（JSONL 分段）"""
     if not DEBUG_MODE or not CACHE_DIR:
         return
     
     try:
-        # 创建缓存目录
-        cache_path = Path(CACHE_DIR)
-        cache_path.mkdir(parents=True, exist_ok=True)
-        
-        # 生成文件名: 时间戳_收发标志_消息id.json
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-        filename = f"{timestamp}_{message_type}_{message_id}.json"
-        filepath = cache_path / filename
-        
-        # 保存消息
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump({
-                'timestamp': datetime.now().isoformat(),
-                'type': message_type,
-                'message_id': message_id,
-                'data': data
-            }, f, indent=2, ensure_ascii=False)
-        
-        print(f"[缓存] 已保存 {message_type} 消息: {filename}")
+        # 追加到 JSONL 分段（后台线程批量写入，按 CAPTURE_* 环境变量采样/轮转/压缩）
+        get_capture(CACHE_DIR).capture(message_type, message_id, data)
         
         # 更新每日调用计数
         if message_type == "RESPONSE":
@@ -439,8 +427,8 @@ def list_models():
 
 @app.route('/health', methods=['GET'])
 def health():
-    """健康检查"""
-    return jsonify({"status": "ok"})
+    """健康检查（pid 供守护进程热备切换时确认新进程已就绪）"""
+    return jsonify({"status": "ok", "pid": os.getpid()})
 
 @app.route('/health/upstream', methods=['GET'])
 def health_upstream():
@@ -719,6 +707,22 @@ def debug_stats():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/debug/message/<message_id>', methods=['GET'])
+def debug_message(message_id):
+    """按消息 ID 查找已捕获的请求/响应"""
+    if not check_debug_mode():
+        return jsonify({"error": "Debug mode not enabled"}), 403
+    
+    cache_dir = os.getenv("CACHE_DIR")
+    if not cache_dir:
+        return jsonify({"error": "Cache directory not configured"}), 400
+    
+    capture = get_capture(cache_dir)
+    records = capture.lookup(message_id)
+    if not records:
+        return jsonify({"error": f"Message {message_id} not found"}), 404
+    return jsonify({"message_id": message_id, "records": records, "capture": capture.get_stats()})
+
 @app.route('/debug/concurrency', methods=['GET'])
 def debug_concurrency():
     """获取并发状态和调用历史"""
@@ -1300,7 +1304,7 @@ if __name__ == '__main__':
     observer = start_file_watcher()
     
     try:
-        app.run(host='localhost', port=5000, debug=False, use_reloader=False)
+        serve_app(app, host='localhost', port=5000)
     except KeyboardInterrupt:
         print("\n[关闭] 正在关闭服务...")
     except Exception as e:
@@ -22,3 +22,10 @@ RESPONSE_FORMAT = {
     "merge_fields": False,
     "use_reasoning_as_fallback": False
 }
+
+# 限流配置（Groq 免费额度）
+LIMIT = {
+    "rpm": 30,
+    "tpm": 12000,
+    "daily": 1000
+}
@@ -22,3 +22,10 @@ RESPONSE_FORMAT = {
     "merge_fields": False,
     "use_reasoning_as_fallback": False
 }
+
+# 限流配置（Cerebras 免费额度）
+LIMIT = {
+    "rpm": 30,
+    "tpm": 60000,
+    "daily": 14400
+}
@@ -15,6 +15,10 @@ from urllib3.util.retry import Retry
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# 守护进程子进程辅助模块位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from daemon_child import serve_app
+
 app = Flask(__name__)
 
 # 配置 requests 会话，使用连接池和重试策略
@@ -426,8 +430,8 @@ def list_models():
 
 @app.route('/health', methods=['GET'])
 def health():
-    """健康检查"""
-    return jsonify({"status": "ok"})
+    """健康检查（pid 供守护进程热备切换时确认新进程已就绪）"""
+    return jsonify({"status": "ok", "pid": os.getpid()})
 
 @app.route('/health/upstream', methods=['GET'])
 def health_upstream():
@@ -1279,7 +1283,7 @@ if __name__ == '__main__':
     observer = start_file_watcher()
     
     try:
-        app.run(host='localhost', port=5000, debug=False, use_reloader=False)
+        serve_app(app, host='localhost', port=5000)
     except KeyboardInterrupt:
         print("\n[关闭] 正在关闭服务...")
     except Exception as e:
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+网络路径延迟矩阵
+对每个已配置的上游，分别直连和经 HTTP_PROXY（CONNECT 隧道）测量：
+DNS 解析、TCP 连接、TLS 握手、TTFB（首字节）和总耗时。每条路径重复采样，所有采样并发执行。
+
+根据结果为每个上游决定是否使用代理，写入 network_matrix.json 的 use_proxy 字段；
+代理启动时设置 NETWORK_MATRIX_FILE=network_matrix.json 即按该结果设置 USE_PROXY
+（free13/test_multi_angle.py 的单上游、顺序版本的通用化）
+
+    python network_matrix.py
+    python network_matrix.py --only free1,free13 --samples 8 --parallel 16
+"""
+
+import argparse
+import json
+import os
+import socket
+import ssl
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from smoke_test_all import SCRIPT_DIR, discover_providers, models_url
+
+PHASES = ("dns", "connect", "tls", "ttfb", "total")
+# 代理路径的中位总耗时低于直连的该比例时才改用代理（避免抖动导致来回切换）
+PROXY_GAIN_RATIO = 0.7
+# 成功率低于该值的路径视为不可用
+MIN_SUCCESS_RATE = 0.5
+
+
+def measure_path(url: str, proxy: Optional[str], timeout: float) -> Dict:
+    """测量一次请求各阶段耗时（毫秒）
+
+    经代理时目标域名由代理解析：dns 为代理地址的解析时间，connect 包含建立 CONNECT 隧道的时间
+    """
+    target = urlparse(url)
+    host = target.hostname
+    port = target.port or (443 if target.scheme == "https" else 80)
+    path = (target.path or "/") + (f"?{target.query}" if target.query else "")
+    sample = {"ok": False, "error": None}
+    for phase in PHASES:
+        sample[phase] = None
+
+    start = time.perf_counter()
+    sock = None
+    try:
+        if proxy:
+            proxy_url = urlparse(proxy)
+            connect_host, connect_port = proxy_url.hostname, proxy_url.port or 80
+        else:
+            connect_host, connect_port = host, port
+
+        addrinfo = socket.getaddrinfo(connect_host, connect_port, type=socket.SOCK_STREAM)
+        mark = time.perf_counter()
+        sample["dns"] = (mark - start) * 1000
+
+        family, socktype, proto, _, address = addrinfo[0]
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        if proxy:
+            sock.sendall(f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode("ascii"))
+            reply = b""
+            while b"\r\n\r\n" not in reply:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise ConnectionError("代理关闭了连接")
+                reply += chunk
+            status_line = reply.split(b"\r\n", 1)[0].decode("latin-1")
+            if " 200" not in status_line:
+                raise ConnectionError(f"CONNECT 失败: {status_line}")
+        now = time.perf_counter()
+        sample["connect"] = (now - mark) * 1000
+        mark = now
+
+        if target.scheme == "https":
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            now = time.perf_counter()
+            sample["tls"] = (now - mark) * 1000
+            mark = now
+
+        sock.sendall(
+            f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: network-matrix\r\n"
+            f"Accept: */*\r\nConnection: close\r\n\r\n".encode("ascii")
+        )
+        first = sock.recv(4096)
+        if not first.startswith(b"HTTP/"):
+            raise ConnectionError("响应不是 HTTP")
+        sample["ttfb"] = (time.perf_counter() - mark) * 1000
+        sample["status"] = int(first.split(b" ", 2)[1])
+        # 读完响应（最多 256KB），总耗时包含传输时间
+        received = len(first)
+        while received < 256 * 1024:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+        sample["total"] = (time.perf_counter() - start) * 1000
+        sample["ok"] = True
+    except (OSError, ValueError, ssl.SSLError) as e:
+        sample["error"] = f"{type(e).__name__}: {e}"[:200]
+    finally:
+        if sock is not None:
+            sock.close()
+
+    for phase in PHASES:
+        if sample[phase] is not None:
+            sample[phase] = round(sample[phase], 1)
+    return sample
+
+
+def summarize_path(samples: List[Dict]) -> Dict:
+    """汇总一条路径的采样：成功率和各阶段中位数"""
+    ok = [s for s in samples if s["ok"]]
+    summary = {
+        "samples": len(samples),
+        "success_rate": round(len(ok) / len(samples), 2) if samples else 0.0,
+        "errors": sorted({s["error"] for s in samples if s["error"]}),
+    }
+    for phase in PHASES:
+        values = [s[phase] for s in ok if s[phase] is not None]
+        summary[f"{phase}_ms"] = round(statistics.median(values), 1) if values else None
+    return summary
+
+
+def decide_proxy(direct: Dict, proxy: Optional[Dict], configured: bool) -> Dict:
+    """根据两条路径的测量结果决定是否使用代理"""
+    if proxy is None:
+        return {"use_proxy": configured, "reason": "未配置 HTTP_PROXY，保持配置文件中的 USE_PROXY"}
+
+    direct_ok = direct["success_rate"] >= MIN_SUCCESS_RATE
+    proxy_ok = proxy["success_rate"] >= MIN_SUCCESS_RATE
+    if direct_ok and not proxy_ok:
+        return {"use_proxy": False, "reason": "代理路径不可用"}
+    if proxy_ok and not direct_ok:
+        return {"use_proxy": True, "reason": "直连不可用，代理可用"}
+    if not direct_ok and not proxy_ok:
+        return {"use_proxy": configured, "reason": "两条路径均不可用，保持配置文件中的 USE_PROXY"}
+
+    if proxy["total_ms"] < direct["total_ms"] * PROXY_GAIN_RATIO:
+        return {"use_proxy": True, "reason": f"代理更快 ({proxy['total_ms']}ms < 直连 {direct['total_ms']}ms)"}
+    return {"use_proxy": False, "reason": f"直连足够快 ({direct['total_ms']}ms，代理 {proxy['total_ms']}ms)"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="网络路径延迟矩阵")
+    parser.add_argument("--only", help="只测试指定上游，逗号分隔（如 free1,free13）")
+    parser.add_argument("--samples", type=int, default=5, help="每条路径的采样次数")
+    parser.add_argument("--parallel", type=int, default=16, help="同时进行的采样数")
+    parser.add_argument("--timeout", type=float, default=15, help="单次采样超时（秒）")
+    parser.add_argument("--proxy", default=os.getenv("HTTP_PROXY"), help="代理地址，默认使用 HTTP_PROXY")
+    parser.add_argument("--output", default=str(SCRIPT_DIR / "network_matrix.json"))
+    args = parser.parse_args()
+
+    only = [name.strip() for name in args.only.split(",")] if args.only else None
+    providers = [p for p in discover_providers(only) if p["base_url"]]
+    proxy = args.proxy if args.proxy and args.proxy.startswith("http://") else None
+    if args.proxy and not proxy:
+        print(f"[网络矩阵] 只支持 http:// 代理，忽略: {args.proxy}")
+    paths = [("direct", None)] + ([("proxy", proxy)] if proxy else [])
+    print(f"[网络矩阵] {len(providers)} 个上游，路径: {[name for name, _ in paths]}，每条路径 {args.samples} 次采样")
+
+    jobs = []
+    for provider in providers:
+        url = models_url(provider) or provider["base_url"] + "/"
+        for path_name, proxy_url in paths:
+            for _ in range(args.samples):
+                jobs.append((provider["name"], path_name, url, proxy_url))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+        samples = list(pool.map(lambda job: measure_path(job[2], job[3], args.timeout), jobs))
+
+    grouped: Dict[str, Dict[str, List[Dict]]] = {}
+    for (name, path_name, _, _), sample in zip(jobs, samples):
+        grouped.setdefault(name, {}).setdefault(path_name, []).append(sample)
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "wall_time": round(time.time() - start, 2),
+        "proxy": proxy,
+        "providers": {},
+        "use_proxy": {},
+    }
+    for provider in providers:
+        name = provider["name"]
+        direct = summarize_path(grouped[name]["direct"])
+        via_proxy = summarize_path(grouped[name]["proxy"]) if proxy else None
+        decision = decide_proxy(direct, via_proxy, bool(provider["use_proxy"]))
+        report["providers"][name] = {
+            "base_url": provider["base_url"],
+            "configured_use_proxy": bool(provider["use_proxy"]),
+            "direct": direct,
+            "proxy": via_proxy,
+            **decision,
+        }
+        report["use_proxy"][name] = decision["use_proxy"]
+
+        def fmt(summary):
+            if summary is None:
+                return "-"
+            if summary["total_ms"] is None:
+                return f"不可用 ({summary['errors'][0] if summary['errors'] else '无采样'})"
+            return (f"{summary['total_ms']}ms (dns {summary['dns_ms']} / tcp {summary['connect_ms']} / "
+                    f"tls {summary['tls_ms']} / ttfb {summary['ttfb_ms']}, 成功率 {summary['success_rate']})")
+        print(f"[网络矩阵] {name}: 直连 {fmt(direct)}")
+        if proxy:
+            print(f"[网络矩阵] {name}: 代理 {fmt(via_proxy)}")
+        print(f"[网络矩阵] {name}: USE_PROXY={decision['use_proxy']} - {decision['reason']}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"[网络矩阵] 完成，耗时 {report['wall_time']}s，结果已保存: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
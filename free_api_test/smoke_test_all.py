@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+全部上游冒烟测试
+自动发现 free_api_test/freeN/config.py，并发执行每个上游的模型列表和聊天测试
+（并发数有上限，每个上游有整体超时），生成延迟/可用性矩阵：
+- smoke_matrix.json：每个上游的测试结果，以及建议的初始权重（weights）
+- smoke_matrix.html：可直接在浏览器中查看的矩阵表格
+
+代理启动时设置 SEED_WEIGHTS_FILE=smoke_matrix.json 即可用 weights 作为初始权重
+
+    python smoke_test_all.py
+    python smoke_test_all.py --only free2,free4 --parallel 4 --timeout 45
+"""
+
+import argparse
+import html
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+SCRIPT_DIR = Path(__file__).parent
+DEFAULT_PROMPT = "Reply with the single word OK."
+# 代理中权重大于此值的上游会被优先选中，建议权重不超过该值（配置中本来就超过的除外）
+SPECIAL_WEIGHT_THRESHOLD = 100
+
+load_dotenv(SCRIPT_DIR / ".env")
+
+
+def discover_providers(only: Optional[List[str]] = None) -> List[Dict]:
+    """扫描 freeN/config.py，返回上游配置列表（缺少密钥的也保留，测试结果标记为跳过）"""
+    providers = []
+    for api_dir in sorted(SCRIPT_DIR.glob("free*"), key=lambda d: (len(d.name), d.name)):
+        config_file = api_dir / "config.py"
+        if not api_dir.is_dir() or not config_file.exists():
+            continue
+        if only and api_dir.name not in only:
+            continue
+        try:
+            spec = importlib.util.spec_from_file_location(f"config_{api_dir.name}", str(config_file))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except Exception as e:
+            print(f"[跳过] {api_dir.name}: 加载 config.py 失败 - {e}")
+            continue
+
+        providers.append({
+            "name": api_dir.name,
+            "title": getattr(module, "TITLE_NAME", api_dir.name),
+            "api_key": os.getenv(f"{api_dir.name.upper()}_API_KEY") or getattr(module, "API_KEY", None),
+            "base_url": (getattr(module, "BASE_URL", "") or "").rstrip("/"),
+            "model": getattr(module, "MODEL_NAME", None),
+            "endpoint": getattr(module, "ENDPOINT", "/v1/chat/completions"),
+            "use_proxy": getattr(module, "USE_PROXY", False),
+            "default_weight": getattr(module, "DEFAULT_WEIGHT", 10),
+        })
+    return providers
+
+
+def models_url(provider: Dict) -> Optional[str]:
+    """由聊天端点推导模型列表端点（非 OpenAI 风格的端点不测试模型列表）"""
+    endpoint = provider["endpoint"]
+    if not endpoint.endswith("chat/completions"):
+        return None
+    return provider["base_url"] + endpoint[:-len("chat/completions")] + "models"
+
+
+def timed_request(method: str, url: str, deadline: float, timeout: float, **kwargs) -> Dict:
+    """发送请求并记录耗时；超时取单次超时和上游剩余时间中较小者"""
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return {"ok": False, "status": None, "latency_ms": None, "error": "上游整体超时，未执行"}
+
+    start = time.time()
+    try:
+        response = requests.request(method, url, timeout=min(timeout, remaining), **kwargs)
+    except requests.exceptions.Timeout:
+        return {"ok": False, "status": None, "latency_ms": None, "error": "请求超时"}
+    except requests.exceptions.RequestException as e:
+        return {"ok": False, "status": None, "latency_ms": None, "error": type(e).__name__}
+
+    result = {
+        "ok": response.status_code == 200,
+        "status": response.status_code,
+        "latency_ms": round((time.time() - start) * 1000),
+        "error": None if response.status_code == 200 else response.text[:200],
+    }
+    if result["ok"]:
+        try:
+            result["body"] = response.json()
+        except ValueError:
+            result["ok"] = False
+            result["error"] = "响应不是 JSON"
+    return result
+
+
+def test_provider(provider: Dict, prompt: str, timeout: float, provider_timeout: float) -> Dict:
+    """测试单个上游：模型列表 + 聊天"""
+    name = provider["name"]
+    row = {
+        "name": name,
+        "title": provider["title"],
+        "model": provider["model"],
+        "use_proxy": provider["use_proxy"],
+        "default_weight": provider["default_weight"],
+        "models": None,
+        "chat": None,
+        "available": False,
+    }
+    if not provider["api_key"] or not provider["base_url"] or not provider["model"]:
+        row["skipped"] = f"{name.upper()}_API_KEY 未配置" if not provider["api_key"] else "配置不完整"
+        print(f"[跳过] {name}: {row['skipped']}")
+        return row
+
+    headers = {"Authorization": f"Bearer {provider['api_key']}", "Content-Type": "application/json"}
+    proxy = os.getenv("HTTP_PROXY")
+    proxies = {"http": proxy, "https": proxy} if provider["use_proxy"] and proxy else None
+    deadline = time.time() + provider_timeout
+
+    url = models_url(provider)
+    if url:
+        result = timed_request("GET", url, deadline, timeout, headers=headers, proxies=proxies)
+        body = result.pop("body", None)
+        if isinstance(body, dict) and isinstance(body.get("data"), list):
+            result["count"] = len(body["data"])
+        row["models"] = result
+
+    payload = {
+        "model": provider["model"],
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 16,
+    }
+    result = timed_request("POST", provider["base_url"] + provider["endpoint"], deadline, timeout,
+                           headers=headers, json=payload, proxies=proxies)
+    body = result.pop("body", None)
+    if result["ok"]:
+        try:
+            result["reply"] = (body["choices"][0]["message"].get("content") or "")[:80]
+        except (KeyError, IndexError, TypeError):
+            result["ok"] = False
+            result["error"] = "响应缺少 choices"
+    row["chat"] = result
+    row["available"] = result["ok"]
+
+    status = f"可用 {result['latency_ms']}ms" if result["ok"] else f"不可用 ({result['status']}: {result['error']})"
+    print(f"[测试] {name}: {status}")
+    return row
+
+
+def suggest_weights(rows: List[Dict]) -> Dict[str, int]:
+    """按聊天延迟建议初始权重：以可用上游的中位延迟为基准在默认权重的 0.5~2 倍之间缩放，
+    不可用的上游降到默认权重的 1/4（至少为 1），仍保留被重新探测到的机会"""
+    latencies = [r["chat"]["latency_ms"] for r in rows if r["available"] and r["chat"]["latency_ms"]]
+    median = statistics.median(latencies) if latencies else None
+
+    weights = {}
+    for row in rows:
+        default = row["default_weight"]
+        if row.get("skipped"):
+            continue
+        if not row["available"]:
+            weights[row["name"]] = max(1, default // 4)
+            continue
+        factor = 1.0
+        if median and row["chat"]["latency_ms"]:
+            factor = min(2.0, max(0.5, median / row["chat"]["latency_ms"]))
+        weight = max(1, round(default * factor))
+        if default <= SPECIAL_WEIGHT_THRESHOLD:
+            weight = min(weight, SPECIAL_WEIGHT_THRESHOLD)
+        weights[row["name"]] = weight
+    return weights
+
+
+def _cell(result: Optional[Dict]) -> str:
+    if result is None:
+        return '<td class="na">-</td>'
+    if result["ok"]:
+        extra = f" / {result['count']} 个" if "count" in result else ""
+        return f'<td class="ok">{result["latency_ms"]}ms{extra}</td>'
+    detail = html.escape(str(result["error"] or ""))[:120]
+    return f'<td class="fail" title="{detail}">{result["status"] or "ERR"}</td>'
+
+
+def write_html(path: Path, report: Dict):
+    rows = []
+    for row in report["providers"]:
+        if row.get("skipped"):
+            cells = f'<td class="na" colspan="2">{html.escape(row["skipped"])}</td>'
+        else:
+            cells = _cell(row["models"]) + _cell(row["chat"])
+        rows.append(
+            f"<tr><td>{row['name']}</td><td>{html.escape(str(row['title']))}</td>"
+            f"<td>{html.escape(str(row['model']))}</td>{cells}"
+            f"<td>{row['default_weight']}</td><td>{report['weights'].get(row['name'], '-')}</td></tr>"
+        )
+    content = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>上游冒烟测试矩阵</title>
+<style>
+body {{ font-family: sans-serif; margin: 20px; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 10px; text-align: left; }}
+.ok {{ background: #d9f2d9; }} .fail {{ background: #f7d4d4; }} .na {{ color: #888; }}
+</style></head><body>
+<h2>上游冒烟测试矩阵</h2>
+<p>生成时间: {report['generated_at']}，耗时 {report['wall_time']}s，
+可用 {report['available_count']}/{len(report['providers'])}</p>
+<table>
+<tr><th>上游</th><th>名称</th><th>模型</th><th>模型列表</th><th>聊天</th><th>默认权重</th><th>建议权重</th></tr>
+{chr(10).join(rows)}
+</table></body></html>
+"""
+    path.write_text(content, encoding="utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全部上游冒烟测试")
+    parser.add_argument("--only", help="只测试指定上游，逗号分隔（如 free2,free4）")
+    parser.add_argument("--parallel", type=int, default=6, help="同时测试的上游数")
+    parser.add_argument("--timeout", type=float, default=30, help="单次请求超时（秒）")
+    parser.add_argument("--provider-timeout", type=float, default=60, help="每个上游的整体超时（秒）")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--output", default=str(SCRIPT_DIR / "smoke_matrix.json"), help="JSON 输出路径，HTML 写在同名 .html")
+    args = parser.parse_args()
+
+    only = [name.strip() for name in args.only.split(",")] if args.only else None
+    providers = discover_providers(only)
+    print(f"[冒烟测试] 发现 {len(providers)} 个上游，并发 {args.parallel}")
+
+    start = time.time()
+    rows = []
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+        futures = [pool.submit(test_provider, p, args.prompt, args.timeout, args.provider_timeout) for p in providers]
+        for future in as_completed(futures):
+            rows.append(future.result())
+    rows.sort(key=lambda r: (len(r["name"]), r["name"]))
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "wall_time": round(time.time() - start, 2),
+        "available_count": sum(1 for r in rows if r["available"]),
+        "providers": rows,
+        "weights": suggest_weights(rows),
+    }
+
+    output = Path(args.output)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    write_html(output.with_suffix(".html"), report)
+
+    print(f"[冒烟测试] 完成: 可用 {report['available_count']}/{len(rows)}，耗时 {report['wall_time']}s")
+    print(f"[冒烟测试] 建议权重: {report['weights']}")
+    print(f"[冒烟测试] 结果已保存: {output} / {output.with_suffix('.html')}")
+    return 0 if report["available_count"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+调试消息捕获（多个代理脚本共用）
+替代"每条 REQUEST/RESPONSE/ERROR 一个格式化 JSON 文件"的做法：
+- 后台写线程批量追加到 JSONL 分段文件，请求线程只做一次入队
+- 分段按大小轮转，关闭的分段可选 gzip 压缩，超过数量上限的旧分段自动删除
+- 按 message_id 采样（同一消息的请求和响应同时保留或丢弃），ERROR 始终保留
+- 每个分段带 .idx 索引（message_id / 类型 / 偏移 / 长度），按 id 查找无需扫描全文
+
+环境变量：
+- CAPTURE_SAMPLE_RATE   采样率 0~1（默认 1.0）
+- CAPTURE_SEGMENT_MB    单个分段大小上限（默认 16）
+- CAPTURE_MAX_SEGMENTS  保留分段数（默认 20）
+- CAPTURE_COMPRESS      是否压缩已关闭的分段（默认 true）
+"""
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class MessageCapture:
+    """JSONL 分段消息捕获器"""
+
+    def __init__(self, cache_dir, prefix: str = "capture", max_segment_bytes: int = 16 * 1024 * 1024,
+                 max_segments: int = 20, compress: bool = True, sample_rate: float = 1.0,
+                 queue_size: int = 10000, recent_index_size: int = 10000):
+        self.cache_dir = Path(cache_dir)
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.compress = compress
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._segment_path: Optional[Path] = None
+        self._segment_file = None
+        self._index_file = None
+        self._segment_size = 0
+        self._segment_seq = 0
+
+        # 最近消息的内存索引：message_id -> [(分段名, 类型, 偏移, 长度)]
+        self._recent = OrderedDict()
+        self._recent_size = recent_index_size
+        self._recent_lock = threading.Lock()
+
+        # 请求线程和写线程都会更新计数
+        self.stats = {"captured": 0, "sampled_out": 0, "dropped": 0, "written": 0, "segments_rotated": 0}
+        self._stats_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._writer_loop, name=f"{prefix}-writer", daemon=True)
+        self._thread.start()
+
+    # ==================== 写入 ====================
+
+    def _sampled(self, message_type: str, message_id: str) -> bool:
+        if message_type == "ERROR" or self.sample_rate >= 1.0:
+            return True
+        bucket = zlib.crc32(str(message_id).encode("utf-8")) % 10000
+        return bucket < self.sample_rate * 10000
+
+    def capture(self, message_type: str, message_id: str, data, **extra) -> bool:
+        """记录一条消息（非阻塞，队列满时丢弃），返回是否已入队"""
+        if not self._sampled(message_type, message_id):
+            self._count("sampled_out")
+            return False
+
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "type": message_type,
+            "message_id": message_id,
+        }
+        record.update(extra)
+        record["data"] = data
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("captured")
+        return True
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _open_segment(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._segment_seq += 1
+        name = f"{self.prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._segment_seq:04d}.jsonl"
+        self._segment_path = self.cache_dir / name
+        self._segment_file = open(self._segment_path, "ab")
+        self._index_file = open(self._segment_path.with_suffix(".idx"), "a", encoding="utf-8")
+        self._segment_size = self._segment_path.stat().st_size
+
+    def _close_segment(self):
+        if not self._segment_file:
+            return
+        self._segment_file.close()
+        self._index_file.close()
+        closed = self._segment_path
+        self._segment_file = self._index_file = self._segment_path = None
+
+        if self.compress and closed.exists():
+            gz_path = closed.with_name(closed.name + ".gz")
+            with open(closed, "rb") as src, gzip.open(gz_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            closed.unlink()
+        self._count("segments_rotated")
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        """只保留最新的 max_segments 个分段"""
+        indexes = sorted(self.cache_dir.glob(f"{self.prefix}_*.idx"))
+        for index_path in indexes[:-self.max_segments] if self.max_segments else []:
+            base = index_path.with_suffix(".jsonl")
+            for path in (index_path, base, base.with_name(base.name + ".gz")):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _write_batch(self, records: List[Dict]):
+        if self._segment_file is None:
+            self._open_segment()
+
+        for record in records:
+            line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+            offset = self._segment_size
+            self._segment_file.write(line)
+            self._segment_size += len(line)
+
+            segment_name = self._segment_path.stem
+            self._index_file.write(f"{record['message_id']}\t{record['type']}\t{offset}\t{len(line)}\n")
+            with self._recent_lock:
+                self._recent.setdefault(str(record["message_id"]), []).append(
+                    (segment_name, record["type"], offset, len(line))
+                )
+                self._recent.move_to_end(str(record["message_id"]))
+                while len(self._recent) > self._recent_size:
+                    self._recent.popitem(last=False)
+
+            if self._segment_size >= self.max_segment_bytes:
+                self._segment_file.flush()
+                self._index_file.flush()
+                self._close_segment()
+                self._open_segment()
+
+        self._segment_file.flush()
+        self._index_file.flush()
+        self._count("written", len(records))
+
+    def _writer_loop(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                records = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # 一次取出队列中已积压的消息，批量写入
+            while len(records) < 500:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(records)
+            except Exception as e:
+                print(f"[捕获错误] 写入失败: {e}")
+
+    def close(self, timeout: float = 5.0):
+        """停止写线程，当前分段与轮转出的分段一样关闭、压缩并执行保留数量限制"""
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # 写线程仍在写入当前分段，不能在这里关闭
+            print(f"[捕获错误] 写线程 {timeout} 秒内未结束，当前分段未压缩")
+            return
+        self._close_segment()
+
+    # ==================== 查找 ====================
+
+    def _read_record(self, segment_name: str, offset: int, length: int) -> Optional[Dict]:
+        plain = self.cache_dir / f"{segment_name}.jsonl"
+        compressed = self.cache_dir / f"{segment_name}.jsonl.gz"
+        try:
+            if plain.exists():
+                with open(plain, "rb") as f:
+                    f.seek(offset)
+                    raw = f.read(length)
+            elif compressed.exists():
+                with gzip.open(compressed, "rb") as f:
+                    f.seek(offset)
+                    raw = f.read(length)
+            else:
+                return None
+            return json.loads(raw.decode("utf-8"))
+        except (OSError, ValueError):
+            # 分段可能正在被压缩或已被清理
+            return None
+
+    def lookup(self, message_id: str) -> List[Dict]:
+        """按 message_id 查找消息（先查内存索引，再按 .idx 从新到旧查找）"""
+        message_id = str(message_id)
+        with self._recent_lock:
+            locations = list(self._recent.get(message_id, []))
+
+        if not locations:
+            for index_path in sorted(self.cache_dir.glob(f"{self.prefix}_*.idx"), reverse=True):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        parts = line.rstrip("\n").split("\t")
+                        if len(parts) == 4 and parts[0] == message_id:
+                            locations.append((index_path.stem, parts[1], int(parts[2]), int(parts[3])))
+                if locations:
+                    break
+
+        records = []
+        for segment_name, _, offset, length in locations:
+            record = self._read_record(segment_name, offset, length)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, queue_size=self._queue.qsize(), sample_rate=self.sample_rate,
+                    current_segment=self._segment_path.name if self._segment_path else None)
+
+
+_captures: Dict[str, MessageCapture] = {}
+_captures_lock = threading.Lock()
+
+
+def get_capture(cache_dir, prefix: str = "capture") -> MessageCapture:
+    """获取（或按环境变量创建）指定缓存目录的捕获器，同一目录复用同一实例"""
+    key = f"{Path(cache_dir).resolve()}|{prefix}"
+    with _captures_lock:
+        capture = _captures.get(key)
+        if capture is None:
+            capture = MessageCapture(
+                cache_dir,
+                prefix=prefix,
+                max_segment_bytes=int(float(os.getenv("CAPTURE_SEGMENT_MB", "16")) * 1024 * 1024),
+                max_segments=int(os.getenv("CAPTURE_MAX_SEGMENTS", "20")),
+                compress=os.getenv("CAPTURE_COMPRESS", "true").lower() in ("1", "true", "yes"),
+                sample_rate=float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0")),
+            )
+            _captures[key] = capture
+        return capture
+
+
+@atexit.register
+def _close_all():
+    """进程退出时刷新所有未写入的消息"""
+    with _captures_lock:
+        for capture in _captures.values():
+            capture.close()
@@ -0,0 +1,312 @@
+"""
+准入控制：优先级类别 + 加权公平排队
+- 每个请求按客户端密钥映射或请求头（X-Priority）归入一个类别，每个类别有权重、预留并发名额和排队上限
+- 预留名额只供本类别使用；其余名额按加权公平排队分配：排队请求的虚拟完成时间
+  = max(全局虚拟时间, 该租户上一次的完成时间) + 1 / 类别权重，空出名额时放行完成时间最小的请求，
+  同一类别内各租户（客户端密钥或 IP）轮流放行，批量提交的租户不会挤占其他租户
+- 排队已满、租户超过公平份额、或预计等待时间超过最长等待时间时立即拒绝（LoadShedError，返回 429），
+  不必等到超时；排队已满时若有租户超出公平份额，改为拒绝该租户最新排队的请求，给新租户让出位置
+"""
+import hashlib
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from errors import ConcurrentLimitError, LoadShedError
+
+# 服务时间（名额占用时长）的指数平均系数，用于估算排队等待时间
+SERVICE_TIME_ALPHA = 0.2
+
+
+class PriorityClass:
+    """一个优先级类别"""
+
+    __slots__ = ("name", "weight", "reserved", "queue_limit")
+
+    def __init__(self, name: str, weight: float, reserved: int, queue_limit: int):
+        self.name = name
+        self.weight = max(0.01, float(weight))
+        self.reserved = max(0, int(reserved))
+        self.queue_limit = max(0, int(queue_limit))
+
+
+def parse_classes(spec: str) -> Dict[str, PriorityClass]:
+    """解析类别配置，格式: 名称:权重:预留名额:排队上限，逗号分隔（如 interactive:4:1:20,batch:1:0:10）"""
+    classes = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(":")
+        if len(parts) != 4:
+            raise ValueError(f"无效的准入类别配置: {item}（格式: 名称:权重:预留名额:排队上限）")
+        name, weight, reserved, queue_limit = parts
+        classes[name.strip()] = PriorityClass(name.strip(), float(weight), int(reserved), int(queue_limit))
+    if not classes:
+        raise ValueError("至少需要配置一个准入类别")
+    return classes
+
+
+def parse_client_classes(spec: str) -> Dict[str, str]:
+    """解析客户端密钥到类别的映射，格式: 密钥=类别，逗号分隔"""
+    mapping = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            key, name = item.split("=", 1)
+            mapping[key.strip()] = name.strip()
+    return mapping
+
+
+def client_identity(authorization: Optional[str], remote_addr: Optional[str]) -> Tuple[Optional[str], str]:
+    """从请求中提取 (客户端密钥, 租户标识)；没有密钥时按 IP 区分租户，标识中不保存密钥原文"""
+    key = None
+    if authorization and authorization.lower().startswith("bearer "):
+        key = authorization[7:].strip() or None
+    if key:
+        return key, "key:" + hashlib.blake2b(key.encode("utf-8"), digest_size=6).hexdigest()
+    return None, f"ip:{remote_addr or 'unknown'}"
+
+
+class Ticket:
+    """一个请求的准入凭据"""
+
+    __slots__ = ("priority_class", "tenant", "finish_tag", "enqueued_at", "admitted_at", "granted", "holding",
+                 "shed_reason")
+
+    def __init__(self, priority_class: str, tenant: str, finish_tag: float = 0.0):
+        self.priority_class = priority_class
+        self.tenant = tenant
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.time()
+        self.admitted_at = None
+        self.granted = False
+        self.holding = False  # 当前是否占用并发名额
+        self.shed_reason = None  # 排队中被其他请求挤出时的原因
+
+
+class AdmissionController:
+    """按类别预留名额、加权公平排队的准入控制器（线程安全）"""
+
+    def __init__(self, limit: int, classes: Dict[str, PriorityClass], default_class: str,
+                 client_classes: Optional[Dict[str, str]] = None, max_wait: float = 120):
+        if default_class not in classes:
+            raise ValueError(f"默认准入类别不存在: {default_class}")
+        self.limit = max(1, int(limit))
+        self.classes = classes
+        self.default_class = default_class
+        self.client_classes = client_classes or {}
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._waiting: List[Ticket] = []
+        self._virtual_time = 0.0
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._active = {name: 0 for name in classes}
+        self._tenant_load: Dict[Tuple[str, str], int] = {}  # (类别, 租户) -> 占用 + 排队
+        self._service_time = 1.0
+        self.stats = {
+            name: {"admitted": 0, "queued": 0, "timeouts": 0, "wait_sum": 0.0,
+                   "shed": {"queue_full": 0, "fair_share": 0, "expected_wait": 0}}
+            for name in classes
+        }
+
+    def classify(self, client_key: Optional[str], requested: Optional[str]) -> str:
+        """确定请求的类别：客户端密钥映射优先（客户端不能自行提升），其次请求头，最后默认类别"""
+        if client_key and client_key in self.client_classes and self.client_classes[client_key] in self.classes:
+            return self.client_classes[client_key]
+        if requested and requested.strip().lower() in self.classes:
+            return requested.strip().lower()
+        return self.default_class
+
+    def set_limit(self, limit: int):
+        """调整并发上限；上限增大时立即放行排队请求"""
+        with self._cond:
+            self.limit = max(1, int(limit))
+            self._dispatch()
+
+    def in_use(self) -> int:
+        """当前占用的并发名额数"""
+        with self._cond:
+            return sum(self._active.values())
+
+    # 以下方法需在持有 self._cond 时调用
+
+    def _reserved(self, name: str) -> int:
+        """类别的有效预留名额（预留总数超过上限时按比例缩减，保证至少有一个共享名额）"""
+        total = sum(c.reserved for c in self.classes.values())
+        reserved = self.classes[name].reserved
+        if total >= self.limit:
+            reserved = (reserved * (self.limit - 1)) // total
+        return reserved
+
+    def _can_admit(self, name: str) -> bool:
+        total = sum(self._active.values())
+        if total >= self.limit:
+            return False
+        if self._active[name] < self._reserved(name):
+            return True
+        # 其他类别尚未用满的预留名额不能占用
+        held_back = sum(max(0, self._reserved(other) - self._active[other]) for other in self.classes if other != name)
+        return total + held_back < self.limit
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted = True
+        ticket.holding = True
+        ticket.admitted_at = time.time()
+        self._active[ticket.priority_class] += 1
+        self._virtual_time = max(self._virtual_time, ticket.finish_tag)
+        stats = self.stats[ticket.priority_class]
+        stats["admitted"] += 1
+        stats["wait_sum"] += ticket.admitted_at - ticket.enqueued_at
+
+    def _dispatch(self):
+        """按虚拟完成时间从小到大放行排队请求，跳过暂时没有可用名额的类别"""
+        granted = False
+        for ticket in sorted(self._waiting, key=lambda t: t.finish_tag):
+            if self._can_admit(ticket.priority_class):
+                self._waiting.remove(ticket)
+                self._grant(ticket)
+                granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _tenant_add(self, ticket: Ticket, delta: int):
+        key = (ticket.priority_class, ticket.tenant)
+        load = self._tenant_load.get(key, 0) + delta
+        if load > 0:
+            self._tenant_load[key] = load
+        else:
+            self._tenant_load.pop(key, None)
+            if not any(t.tenant == ticket.tenant and t.priority_class == ticket.priority_class for t in self._waiting):
+                self._last_finish.pop(key, None)
+
+    def _shed_reason(self, cls: PriorityClass, tenant: str) -> Optional[str]:
+        # 公平份额：该类别可用的名额和排队位置按当前租户数平分
+        tenants = {t for (name, t) in self._tenant_load if name == cls.name} | {tenant}
+        share = math.ceil((self.limit + cls.queue_limit) / len(tenants))
+        if len(tenants) > 1 and self._tenant_load.get((cls.name, tenant), 0) >= share:
+            return "fair_share"
+
+        queued = [t for t in self._waiting if t.priority_class == cls.name]
+        if len(queued) >= cls.queue_limit:
+            # 挤出超出份额最多的租户最新排队的请求
+            heaviest = max(tenants - {tenant}, key=lambda t: self._tenant_load.get((cls.name, t), 0), default=None)
+            victims = [t for t in queued if t.tenant == heaviest]
+            if not victims or self._tenant_load.get((cls.name, heaviest), 0) <= share:
+                return "queue_full"
+            victim = max(victims, key=lambda t: t.enqueued_at)
+            victim.shed_reason = "fair_share"
+            self._waiting.remove(victim)
+            self._tenant_add(victim, -1)
+            self.stats[cls.name]["shed"]["fair_share"] += 1
+            self._cond.notify_all()
+
+        if self._expected_wait(len(self._waiting) + 1) > self.max_wait:
+            return "expected_wait"
+        return None
+
+    def _expected_wait(self, position: int) -> float:
+        return self._service_time * position / self.limit
+
+    def acquire(self, priority_class: str, tenant: str, max_wait: Optional[float] = None) -> Ticket:
+        """获取并发名额；排队超时抛出 ConcurrentLimitError，提前拒绝抛出 LoadShedError"""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        cls = self.classes[priority_class]
+        with self._cond:
+            # 没有排队请求时直接放行，不进入排队
+            if not self._waiting and self._can_admit(cls.name):
+                ticket = Ticket(cls.name, tenant, self._virtual_time)
+                self._grant(ticket)
+                self._tenant_add(ticket, 1)
+                return ticket
+
+            # 本类别当前有可用名额时只是排在更早的请求之后，不做提前拒绝
+            reason = None if self._can_admit(cls.name) else self._shed_reason(cls, tenant)
+            if reason:
+                self.stats[cls.name]["shed"][reason] += 1
+                retry_after = max(1.0, self._expected_wait(len(self._waiting) + 1))
+                raise LoadShedError(
+                    f"Request shed ({reason}) for class {cls.name}",
+                    reason=reason, priority_class=cls.name, retry_after=retry_after
+                )
+
+            key = (cls.name, tenant)
+            finish_tag = max(self._virtual_time, self._last_finish.get(key, 0.0)) + 1.0 / cls.weight
+            self._last_finish[key] = finish_tag
+            ticket = Ticket(cls.name, tenant, finish_tag)
+            self._waiting.append(ticket)
+            self._tenant_add(ticket, 1)
+            self.stats[cls.name]["queued"] += 1
+            self._dispatch()
+
+            deadline = ticket.enqueued_at + max_wait
+            while not ticket.granted:
+                if ticket.shed_reason:
+                    raise LoadShedError(
+                        f"Request shed ({ticket.shed_reason}) for class {cls.name}",
+                        reason=ticket.shed_reason, priority_class=cls.name,
+                        retry_after=max(1.0, self._expected_wait(len(self._waiting) + 1))
+                    )
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    self._tenant_add(ticket, -1)
+                    self.stats[cls.name]["timeouts"] += 1
+                    raise ConcurrentLimitError(
+                        f"Concurrent limit exceeded: waited {max_wait:.0f}s in class {cls.name}"
+                    )
+                self._cond.wait(remaining)
+            return ticket
+
+    def release(self, ticket: Ticket):
+        """请求结束，归还名额并放行下一个排队请求"""
+        with self._cond:
+            if ticket.holding:
+                ticket.holding = False
+                self._active[ticket.priority_class] -= 1
+                elapsed = time.time() - ticket.admitted_at
+                self._service_time += SERVICE_TIME_ALPHA * (elapsed - self._service_time)
+            self._tenant_add(ticket, -1)
+            self._dispatch()
+
+    def pause(self, ticket: Ticket):
+        """暂时让出名额（如等待合并请求的结果），不结束请求"""
+        with self._cond:
+            if ticket.holding:
+                ticket.holding = False
+                self._active[ticket.priority_class] -= 1
+                self._dispatch()
+
+    def resume(self, ticket: Ticket) -> bool:
+        """重新占用名额（不排队，结果已就绪，只需短暂占用）；已达上限时不占用，返回是否占用了名额"""
+        with self._cond:
+            if not ticket.holding and sum(self._active.values()) < self.limit:
+                ticket.holding = True
+                self._active[ticket.priority_class] += 1
+            return ticket.holding
+
+    def get_stats(self) -> Dict:
+        with self._cond:
+            classes = {}
+            for name, cls in self.classes.items():
+                stats = self.stats[name]
+                classes[name] = {
+                    "weight": cls.weight,
+                    "reserved": self._reserved(name),
+                    "queue_limit": cls.queue_limit,
+                    "active": self._active[name],
+                    "waiting": sum(1 for t in self._waiting if t.priority_class == name),
+                    "tenants": sum(1 for (c, _) in self._tenant_load if c == name),
+                    "admitted": stats["admitted"],
+                    "timeouts": stats["timeouts"],
+                    "shed": dict(stats["shed"]),
+                    "avg_wait_ms": round(stats["wait_sum"] / stats["admitted"] * 1000, 1) if stats["admitted"] else 0.0,
+                }
+            return {
+                "limit": self.limit,
+                "active": sum(self._active.values()),
+                "waiting": len(self._waiting),
+                "avg_service_time": round(self._service_time, 3),
+                "default_class": self.default_class,
+                "classes": classes,
+            }
@@ -2,11 +2,18 @@
 应用状态管理
 集中管理所有全局状态，避免散落的全局变量
 """
+import hashlib
 import threading
+import time
 from collections import deque
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from rate_limiter import RateLimitRegistry
+from token_estimator import TokenEstimator
+from prompt_compactor import PromptCompactor
+from response_normalizer import ResponseNormalizer
+
 class AppState:
     """应用全局状态管理"""
     
@@ -52,6 +59,29 @@ class AppState:
         self._failed_apis_lock = threading.Lock()
         self.failed_api_blacklist_duration = 60  # 黑名单持续时间（秒）
 
+        # 上游限流（RPM/TPM/每日限额 + Retry-After 冷却）
+        self.rate_limits = RateLimitRegistry()
+
+        # token 估算（按消息哈希缓存）
+        self.token_estimator = TokenEstimator(config.TOKEN_ESTIMATOR_CACHE_SIZE)
+
+        # 对话历史压缩（按历史哈希缓存压缩结果）
+        self.prompt_compactor = PromptCompactor(self.token_estimator, config.COMPACT_KEEP_RECENT)
+
+        # 响应归一化器（API名称 -> 按 RESPONSE_FORMAT 编译的归一化器）
+        self.response_normalizers = {}
+        self._default_normalizer = ResponseNormalizer()
+
+        # 上游延迟 EWMA（API名称 -> 秒）与最近一次成功的时间戳
+        self.api_latency = {}
+        self.last_success_at = {}
+        self._health_lock = threading.Lock()
+
+        # 故障转移决策统计（决策类型 -> 次数，API名称 -> {决策类型 -> 次数}）
+        self.failover_stats = {}
+        self.failover_stats_by_api = {}
+        self._failover_lock = threading.Lock()
+
     # ==================== 并发控制 ====================
     
     def increment_active_requests(self):
@@ -240,3 +270,136 @@ class AppState:
             for api_name in expired_apis:
                 del self.failed_apis[api_name]
                 print(f"[黑名单] 清理过期的失败 API: {api_name}")
+
+    # ==================== 响应归一化 ====================
+
+    def set_response_normalizer(self, api_name: str, normalizer: ResponseNormalizer):
+        """设置 API 的响应归一化器"""
+        with self._api_lock:
+            self.response_normalizers[api_name] = normalizer
+
+    def get_response_normalizer(self, api_name: str) -> ResponseNormalizer:
+        """获取 API 的响应归一化器（未配置时返回默认归一化器）"""
+        with self._api_lock:
+            return self.response_normalizers.get(api_name, self._default_normalizer)
+
+    # ==================== 故障转移统计 ====================
+
+    def record_failover(self, api_name: str, decision: str):
+        """记录一次故障转移决策"""
+        with self._failover_lock:
+            self.failover_stats[decision] = self.failover_stats.get(decision, 0) + 1
+            api_stats = self.failover_stats_by_api.setdefault(api_name, {})
+            api_stats[decision] = api_stats.get(decision, 0) + 1
+
+    def get_failover_stats(self) -> Dict:
+        """获取故障转移统计"""
+        with self._failover_lock:
+            return {
+                "total": dict(self.failover_stats),
+                "by_api": {name: dict(stats) for name, stats in self.failover_stats_by_api.items()}
+            }
+
+    # ==================== 上游健康 ====================
+
+    def record_api_latency(self, api_name: str, seconds: float, alpha: float = 0.3):
+        """记录一次成功调用的耗时（指数加权移动平均）"""
+        with self._health_lock:
+            previous = self.api_latency.get(api_name)
+            self.api_latency[api_name] = seconds if previous is None else previous + alpha * (seconds - previous)
+            self.last_success_at[api_name] = time.time()
+
+    def get_health_stats(self) -> Dict:
+        """获取各上游的延迟 EWMA 和最近成功时间"""
+        with self._health_lock:
+            return {
+                name: {
+                    "latency_ewma_ms": round(self.api_latency[name] * 1000, 1) if name in self.api_latency else None,
+                    "last_success_at": self.last_success_at.get(name)
+                }
+                for name in set(self.api_latency) | set(self.last_success_at)
+            }
+
+    # ==================== 状态快照 ====================
+
+    @staticmethod
+    def _key_fingerprint(api_key: Optional[str]) -> str:
+        """密钥指纹：用于判断重启后密钥是否已更换（快照中不保存密钥本身）"""
+        return hashlib.blake2b((api_key or "").encode("utf-8"), digest_size=8).hexdigest()
+
+    def export_snapshot(self) -> Dict:
+        """导出权重、熔断状态、延迟 EWMA 和限流用量"""
+        apis = {}
+        available = set(self.get_available_apis())
+        weights = self.get_all_weights()
+        with self._health_lock:
+            latency = dict(self.api_latency)
+            last_success = dict(self.last_success_at)
+        with self._failed_apis_lock:
+            failed = dict(self.failed_apis)
+
+        for api_name, api_config in self.get_all_apis().items():
+            apis[api_name] = {
+                "key": self._key_fingerprint(api_config.get("api_key")),
+                "default_weight": api_config.get("default_weight"),
+                "weight": weights.get(api_name),
+                "penalty_base_weight": api_config.get("penalty_base_weight"),
+                "available": api_name in available,
+                "last_test_result": api_config.get("last_test_result"),
+                "consecutive_failures": api_config.get("consecutive_failures", 0),
+                "success_count": api_config.get("success_count", 0),
+                "failure_count": api_config.get("failure_count", 0),
+                "failed_at": failed.get(api_name),
+                "latency_ewma": latency.get(api_name),
+                "last_success_at": last_success.get(api_name),
+            }
+
+        return {
+            "saved_at": time.time(),
+            "apis": apis,
+            "rate_limits": self.rate_limits.export_all(),
+        }
+
+    def restore_snapshot(self, snapshot: Dict, trust_seconds: float) -> List[str]:
+        """从快照恢复状态，返回最近 trust_seconds 内确认健康、可跳过启动探测的 API
+
+        只恢复当前仍然存在且密钥未更换的上游；配置中的默认权重变化时不恢复旧权重
+        """
+        trusted = []
+        now = time.time()
+        for api_name, saved in (snapshot.get("apis") or {}).items():
+            api_config = self.get_api(api_name)
+            if not api_config or saved.get("key") != self._key_fingerprint(api_config.get("api_key")):
+                continue
+
+            if saved.get("weight") is not None and saved.get("default_weight") == api_config.get("default_weight"):
+                self.set_weight(api_name, saved["weight"])
+                # 故障惩罚前的权重，成功后逐步恢复到该值
+                if saved.get("penalty_base_weight") is not None:
+                    api_config["penalty_base_weight"] = saved["penalty_base_weight"]
+                else:
+                    api_config.pop("penalty_base_weight", None)
+
+            api_config["consecutive_failures"] = saved.get("consecutive_failures", 0)
+            api_config["success_count"] = saved.get("success_count", 0)
+            api_config["failure_count"] = saved.get("failure_count", 0)
+
+            failed_at = saved.get("failed_at")
+            if failed_at and now - failed_at <= self.failed_api_blacklist_duration:
+                with self._failed_apis_lock:
+                    self.failed_apis[api_name] = failed_at
+
+            with self._health_lock:
+                if saved.get("latency_ewma") is not None:
+                    self.api_latency[api_name] = saved["latency_ewma"]
+                if saved.get("last_success_at"):
+                    self.last_success_at[api_name] = saved["last_success_at"]
+
+            last_success = saved.get("last_success_at") or 0
+            if saved.get("available") and now - last_success <= trust_seconds:
+                api_config["available"] = True
+                api_config["last_test_result"] = "restored from snapshot"
+                trusted.append(api_name)
+
+        self.rate_limits.restore_all(snapshot.get("rate_limits"))
+        return trusted
@@ -0,0 +1,295 @@
+"""
+代理压测工具
+两种负载模式：
+- 闭环（--concurrency）：固定并发数，每个工作线程收到响应后立即发下一个请求
+- 开环（--rate）：按泊松到达发送请求，延迟从计划发送时间算起（排队时间计入延迟，避免协同遗漏）
+
+记录 p50/p95/p99/p99.9 延迟、TTFB（首字节时间）、吞吐量和错误分布，输出 JSON，
+并可与保存的基线比较，超出容忍度时以退出码 1 结束：
+
+    python benchmark.py --concurrency 8 --duration 30 --output run.json
+    python benchmark.py --rate 5 --duration 60 --stream --baseline baseline.json
+    python benchmark.py --concurrency 8 --duration 30 --save-baseline baseline.json
+
+配合 mock_upstream.py 可离线复现压测结果
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """最近秩法求百分位（输入需已排序）"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-p * len(sorted_values) // 100)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class BenchmarkClient:
+    """每个线程一个 HTTP 长连接"""
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.path = parsed.path or "/v1/chat/completions"
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = cls(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def send(self, payload: bytes, stream: bool, scheduled_at: float) -> Dict:
+        """发送一个请求，返回 {status, latency, ttfb, error, bytes}"""
+        result = {"status": None, "latency": None, "ttfb": None, "error": None, "bytes": 0}
+        try:
+            conn = self._connection()
+            conn.request("POST", self.path, body=payload, headers={
+                "Content-Type": "application/json",
+                "Authorization": "Bearer benchmark",
+            })
+            response = conn.getresponse()
+            headers_at = time.perf_counter()
+            result["status"] = response.status
+
+            if stream:
+                # 流式：首个数据块到达即为 TTFB
+                first = response.read1(65536) if hasattr(response, "read1") else response.read(1)
+                result["ttfb"] = time.perf_counter() - scheduled_at
+                total = len(first)
+                while True:
+                    chunk = response.read1(65536) if hasattr(response, "read1") else response.read(65536)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                result["bytes"] = total
+            else:
+                # 非流式：响应头到达即为 TTFB，读取响应体的时间只计入总延迟
+                result["ttfb"] = headers_at - scheduled_at
+                body = response.read()
+                result["bytes"] = len(body)
+
+            result["latency"] = time.perf_counter() - scheduled_at
+            if response.will_close:
+                self._reset()
+            if response.status >= 400:
+                result["error"] = f"http_{response.status}"
+        except (OSError, http.client.HTTPException) as e:
+            result["latency"] = time.perf_counter() - scheduled_at
+            result["error"] = type(e).__name__
+            self._reset()
+        return result
+
+
+def build_payload(args, stream: bool) -> bytes:
+    return json.dumps({
+        "model": args.model,
+        "messages": [{"role": "user", "content": args.prompt}],
+        "max_tokens": args.max_tokens,
+        "stream": stream,
+    }).encode("utf-8")
+
+
+def run_closed_loop(client: BenchmarkClient, args) -> List[Dict]:
+    """闭环：固定并发，持续 duration 秒"""
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    rng = random.Random(args.seed)
+
+    def worker(seed):
+        local_rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            stream = local_rng.random() < args.stream_ratio
+            result = client.send(build_payload(args, stream), stream, time.perf_counter())
+            result["stream"] = stream
+            with lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=worker, args=(rng.random(),)) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def run_open_loop(client: BenchmarkClient, args) -> List[Dict]:
+    """开环：泊松到达，到达率 rate 个/秒"""
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    schedule = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(args.rate)
+        if t >= args.duration:
+            break
+        schedule.append((start + t, rng.random() < args.stream_ratio))
+
+    def fire(item):
+        scheduled_at, stream = item
+        result = client.send(build_payload(args, stream), stream, scheduled_at)
+        result["stream"] = stream
+        return result
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=args.max_workers) as pool:
+        for item in schedule:
+            delay = item[0] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(fire, item))
+        return [f.result() for f in futures]
+
+
+def summarize(results: List[Dict], elapsed: float, args) -> Dict:
+    """汇总延迟分位数、TTFB、吞吐量和错误分布"""
+    def stats(values):
+        values = sorted(v for v in values if v is not None)
+        summary = {f"p{p:g}": round(percentile(values, p) * 1000, 1) if values else None for p in PERCENTILES}
+        summary["mean"] = round(sum(values) / len(values) * 1000, 1) if values else None
+        summary["max"] = round(values[-1] * 1000, 1) if values else None
+        return summary
+
+    ok = [r for r in results if not r["error"]]
+    errors = {}
+    for r in results:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+
+    def group(items):
+        return {
+            "count": len(items),
+            "latency_ms": stats(r["latency"] for r in items if not r["error"]),
+            "ttfb_ms": stats(r["ttfb"] for r in items if not r["error"]),
+        }
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "url": args.url,
+        "mode": "open" if args.rate else "closed",
+        "concurrency": None if args.rate else args.concurrency,
+        "rate": args.rate,
+        "duration": round(elapsed, 2),
+        "requests": len(results),
+        "success": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": stats(r["latency"] for r in ok),
+        "ttfb_ms": stats(r["ttfb"] for r in ok),
+        "errors": errors,
+        "non_stream": group([r for r in results if not r["stream"]]),
+        "stream": group([r for r in results if r["stream"]]),
+    }
+
+
+def compare_with_baseline(summary: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """与基线比较，返回回归项列表"""
+    regressions = []
+    for metric in ("latency_ms", "ttfb_ms"):
+        for key in ("p50", "p95", "p99"):
+            current = (summary.get(metric) or {}).get(key)
+            base = (baseline.get(metric) or {}).get(key)
+            if current is not None and base and current > base * (1 + tolerance):
+                regressions.append(f"{metric}.{key}: {base} -> {current} (+{(current / base - 1) * 100:.1f}%)")
+
+    base_rps = baseline.get("throughput_rps")
+    if base_rps and summary["throughput_rps"] < base_rps * (1 - tolerance):
+        regressions.append(f"throughput_rps: {base_rps} -> {summary['throughput_rps']}")
+
+    base_errors = baseline.get("error_rate", 0.0)
+    if summary["error_rate"] > base_errors + 0.01:
+        regressions.append(f"error_rate: {base_errors} -> {summary['error_rate']}")
+    return regressions
+
+
+def print_summary(summary: Dict):
+    print("=" * 60)
+    print(f"模式: {summary['mode']}  请求数: {summary['requests']}  成功: {summary['success']}  "
+          f"错误率: {summary['error_rate'] * 100:.2f}%")
+    print(f"吞吐量: {summary['throughput_rps']} req/s  持续时间: {summary['duration']}s")
+    for metric, label in (("latency_ms", "延迟"), ("ttfb_ms", "TTFB")):
+        values = summary[metric]
+        print(f"{label}(ms): " + "  ".join(f"{k}={values[k]}" for k in ("p50", "p95", "p99", "p99.9", "max")))
+    if summary["errors"]:
+        print(f"错误分布: {summary['errors']}")
+    print("=" * 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="代理压测工具")
+    parser.add_argument("--url", default="http://localhost:5000/v1/chat/completions")
+    parser.add_argument("--concurrency", type=int, default=4, help="闭环模式并发数")
+    parser.add_argument("--rate", type=float, default=0, help="开环模式到达率（请求/秒），设置后使用开环模式")
+    parser.add_argument("--max-workers", type=int, default=64, help="开环模式最大在途请求数")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument("--stream", action="store_true", help="全部使用流式请求")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="流式请求比例（0~1）")
+    parser.add_argument("--model", default="auto")
+    parser.add_argument("--prompt", default="Say hello in one short sentence.")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果 JSON 输出路径")
+    parser.add_argument("--baseline", help="与基线 JSON 比较，回归时退出码为 1")
+    parser.add_argument("--save-baseline", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="基线比较容忍度（默认 10%%）")
+    args = parser.parse_args()
+    if args.stream:
+        args.stream_ratio = 1.0
+
+    client = BenchmarkClient(args.url, args.timeout)
+    mode = f"开环 {args.rate} req/s" if args.rate else f"闭环 并发 {args.concurrency}"
+    print(f"[压测] {args.url}  {mode}  时长 {args.duration}s  流式比例 {args.stream_ratio}")
+
+    start = time.perf_counter()
+    results = run_open_loop(client, args) if args.rate else run_closed_loop(client, args)
+    summary = summarize(results, time.perf_counter() - start, args)
+    print_summary(summary)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2, ensure_ascii=False)
+            print(f"[压测] 结果已保存: {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in ("mode", "concurrency", "rate"):
+            if baseline.get(key) != summary[key]:
+                print(f"[压测] 警告: 基线的 {key}={baseline.get(key)} 与本次 {summary[key]} 不同，比较结果仅供参考")
+        regressions = compare_with_baseline(summary, baseline, args.tolerance)
+        if regressions:
+            print(f"[回归] 相对基线超出容忍度 {args.tolerance * 100:.0f}%:")
+            for item in regressions:
+                print(f"  - {item}")
+            sys.exit(1)
+        print("[压测] 与基线比较: 无回归")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+自适应并发上限（梯度算法，参考 TCP Vegas 和 Netflix concurrency-limits 的 Gradient）
+- 每 window 个上游请求计算一次短期延迟（中位数），与基线延迟（低负载时的延迟）比较：
+  负载不足一半上限的窗口直接用其中位数作为基线；满载时取各窗口中位数的最小值，
+  每个窗口缓慢上浮 BASELINE_DRIFT，上游整体变慢后基线也能逐渐跟上
+  gradient = clamp(tolerance * 基线延迟 / 短期延迟, 0.5, 1)，
+  新上限 = 上限 * gradient + sqrt(上限)（sqrt 为允许的排队余量），再与旧上限平滑
+- 延迟稳定时上限逐步增大；上游变慢时短期延迟升高，上限随之收缩
+- 超时、连接失败和 5xx（过载信号）按 AIMD 乘性减小（每个窗口最多一次）；实际并发不到上限一半时不增大上限（负载不足，延迟说明不了容量）
+- 上限始终在 [min_limit, max_limit] 之间
+"""
+import math
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+# 基线延迟每个窗口的上浮比例
+BASELINE_DRIFT = 0.0002
+# 超时时的乘性减小系数
+DROP_BACKOFF = 0.9
+# 记录的上限变化条数
+HISTORY_SIZE = 30
+
+
+class GradientLimiter:
+    """按观测延迟和超时调整并发上限（线程安全）"""
+
+    def __init__(self, initial_limit: int, min_limit: int = 2, max_limit: int = 50,
+                 tolerance: float = 1.5, smoothing: float = 0.2, window: int = 10):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.window = max(1, window)
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self._samples: List[float] = []
+        self._window_dropped = False
+        self._window_max_in_flight = 0
+        self._baseline_rtt: Optional[float] = None
+        self._short_rtt: Optional[float] = None
+        self._gradient = 1.0
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._lock = threading.Lock()
+        self.stats = {"samples": 0, "drops": 0, "increases": 0, "decreases": 0}
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def _set(self, new_limit: float, reason: str):
+        new_limit = min(self.max_limit, max(self.min_limit, new_limit))
+        old = int(self._limit)
+        self._limit = new_limit
+        if int(new_limit) != old:
+            self.stats["increases" if int(new_limit) > old else "decreases"] += 1
+            self._history.append({
+                "time": time.strftime("%H:%M:%S"),
+                "from": old,
+                "to": int(new_limit),
+                "reason": reason,
+            })
+
+    def record(self, latency: float, dropped: bool = False, in_flight: int = 0) -> int:
+        """记录一次上游调用的耗时（秒，不含重试等待）和是否过载失败，返回调整后的上限"""
+        with self._lock:
+            self.stats["samples"] += 1
+            self._window_max_in_flight = max(self._window_max_in_flight, in_flight)
+            if dropped:
+                self.stats["drops"] += 1
+                if not self._window_dropped:
+                    self._window_dropped = True
+                    self._set(self._limit * DROP_BACKOFF, "drop")
+            else:
+                self._samples.append(latency)
+
+            if len(self._samples) + (1 if self._window_dropped else 0) >= self.window:
+                self._update()
+            return self.limit
+
+    def _update(self):
+        """一个窗口结束，按梯度调整上限（需持有锁）"""
+        samples, dropped, max_in_flight = self._samples, self._window_dropped, self._window_max_in_flight
+        self._samples, self._window_dropped, self._window_max_in_flight = [], False, 0
+        if not samples:
+            return
+
+        short_rtt = statistics.median(samples)
+        self._short_rtt = short_rtt
+        low_load = max_in_flight < self._limit / 2
+        if self._baseline_rtt is None or low_load:
+            self._baseline_rtt = short_rtt
+        else:
+            self._baseline_rtt = min(self._baseline_rtt * (1 + BASELINE_DRIFT), short_rtt)
+
+        self._gradient = max(0.5, min(1.0, self.tolerance * self._baseline_rtt / short_rtt))
+        # 超时的窗口已经减小过，负载不足的窗口不增大
+        if dropped or (self._gradient >= 1.0 and low_load):
+            return
+
+        new_limit = self._limit * self._gradient + math.sqrt(self._limit)
+        new_limit = self._limit * (1 - self.smoothing) + new_limit * self.smoothing
+        reason = "latency_stable" if self._gradient >= 1.0 else f"latency_rising (gradient {self._gradient:.2f})"
+        self._set(new_limit, reason)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "tolerance": self.tolerance,
+                "window": self.window,
+                "short_rtt_ms": round(self._short_rtt * 1000, 1) if self._short_rtt is not None else None,
+                "baseline_rtt_ms": round(self._baseline_rtt * 1000, 1) if self._baseline_rtt is not None else None,
+                "gradient": round(self._gradient, 3),
+                **self.stats,
+                "history": list(self._history),
+            }
@@ -47,8 +47,63 @@ class Config:
     # 代理配置
     HTTP_PROXY = os.getenv("HTTP_PROXY")
     
+    # 上游连接缓存（DNS 解析缓存 + TLS 会话复用）
+    UPSTREAM_CONNECTION_CACHE = os.getenv("UPSTREAM_CONNECTION_CACHE", "true").lower() in ("1", "true", "yes")
+    UPSTREAM_POOL_MAXSIZE = int(os.getenv("UPSTREAM_POOL_MAXSIZE", "10"))  # 每个上游连接池的最大连接数
+    DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", "300"))  # 系统解析器拿不到 TTL 时使用的缓存时间（秒）
+    DNS_CACHE_MIN_TTL = float(os.getenv("DNS_CACHE_MIN_TTL", "10"))  # 记录 TTL 的下限
+    DNS_STALE_SECONDS = float(os.getenv("DNS_STALE_SECONDS", "600"))  # 解析失败时旧结果的最长继续使用时间
+    
+    # 注册表覆盖文件（JSON，如 mock_upstream.py 生成的模拟上游），设置后不再扫描 free_api_test
+    UPSTREAM_OVERLAY = os.getenv("UPSTREAM_OVERLAY")
+    
+    # 初始权重种子文件（free_api_test/smoke_test_all.py 生成的 smoke_matrix.json 中的 weights）
+    SEED_WEIGHTS_FILE = os.getenv("SEED_WEIGHTS_FILE")
+    
+    # 网络路径矩阵文件（free_api_test/network_matrix.py 生成），按其中的 use_proxy 决定各上游是否走代理
+    NETWORK_MATRIX_FILE = os.getenv("NETWORK_MATRIX_FILE")
+    
     # 并发配置
     MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "5"))
+    ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "120"))  # 排队等待并发名额的最长时间（秒）
+    
+    # 自适应并发上限（可选）：按上游延迟和超时在 [MIN, MAX] 之间调整，初始值为 MAX_CONCURRENT_REQUESTS
+    ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "false").lower() in ("1", "true", "yes")
+    ADAPTIVE_CONCURRENCY_MIN = int(os.getenv("ADAPTIVE_CONCURRENCY_MIN", "2"))
+    ADAPTIVE_CONCURRENCY_MAX = int(os.getenv("ADAPTIVE_CONCURRENCY_MAX", "50"))
+    ADAPTIVE_CONCURRENCY_TOLERANCE = float(os.getenv("ADAPTIVE_CONCURRENCY_TOLERANCE", "1.5"))  # 可接受的延迟上升倍数
+    ADAPTIVE_CONCURRENCY_WINDOW = int(os.getenv("ADAPTIVE_CONCURRENCY_WINDOW", "10"))  # 每多少个上游请求调整一次
+    
+    # 准入优先级类别：名称:权重:预留名额:排队上限，逗号分隔；权重决定排队时的放行比例
+    ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "interactive:4:1:20,batch:1:0:10")
+    ADMISSION_DEFAULT_CLASS = os.getenv("ADMISSION_DEFAULT_CLASS", "interactive")
+    ADMISSION_PRIORITY_HEADER = os.getenv("ADMISSION_PRIORITY_HEADER", "X-Priority")
+    # 客户端密钥（Authorization: Bearer 后的值）到类别的映射：密钥=类别，逗号分隔；优先于请求头
+    ADMISSION_CLIENT_CLASSES = os.getenv("ADMISSION_CLIENT_CLASSES", "")
+    
+    # 相同请求合并：同时在途的相同请求只调用一次上游；成功结果在完成后保留的窗口秒数（0 表示只合并在途请求）
+    COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+    COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "1"))
+    
+    # 近似重复缓存（可选）：低温度请求按 SimHash 汉明距离复用相似提示词的回复
+    SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "false").lower() in ("1", "true", "yes")
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+    SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))  # 条目有效期（秒）
+    SEMANTIC_CACHE_MAX_DISTANCE = int(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "3"))  # 64 位指纹的最大汉明距离
+    SEMANTIC_CACHE_MAX_TEMPERATURE = float(os.getenv("SEMANTIC_CACHE_MAX_TEMPERATURE", "0.3"))
+    
+    # 请求体限制
+    MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(4 * 1024 * 1024)))
+    MAX_REQUEST_MESSAGES = int(os.getenv("MAX_REQUEST_MESSAGES", "1000"))
+    
+    # token 估算与上下文窗口
+    TOKEN_ESTIMATOR_CACHE_SIZE = 4096  # 消息 token 估算缓存条数
+    MIN_COMPLETION_TOKENS = 256        # 客户端未指定 max_tokens 时，上下文窗口至少需预留的输出 token 数
+    
+    # 对话历史压缩（可选，超出上下文预算时裁剪中间历史）
+    COMPACT_HISTORY = os.getenv("COMPACT_HISTORY", "false").lower() in ("1", "true", "yes")
+    COMPACT_MAX_PROMPT_TOKENS = int(os.getenv("COMPACT_MAX_PROMPT_TOKENS", "0"))  # 全局 prompt 预算，0 表示仅按上游上下文窗口
+    COMPACT_KEEP_RECENT = int(os.getenv("COMPACT_KEEP_RECENT", "6"))  # 始终保留的最近消息条数
     
     # 重试配置
     MAX_RETRIES = 3
@@ -58,6 +113,26 @@ class Config:
     # API 失败处理
     MAX_CONSECUTIVE_FAILURES = 3
     
+    # 上游 HTTP 错误分类处理
+    RATE_LIMIT_DEFAULT_COOLDOWN = 60  # 429 未返回 Retry-After 时的默认冷却（秒）
+    CLIENT_ERROR_STATUS_CODES = {400, 413, 422}  # 请求本身无效，直接返回客户端不重试
+    # 各类错误按比例降低当前权重（对普通权重和特别权重均生效），权重不低于 FAILOVER_MIN_WEIGHT；
+    # 之后每次成功恢复原权重的 1/10，直到回到惩罚前的权重
+    FAILOVER_WEIGHT_PENALTIES = {
+        "rate_limited": 0.1,  # 429：配额耗尽，冷却后即可恢复
+        "auth_failed": 0.9,   # 401/403：密钥失效，已直接停用
+        "client_error": 0.0,  # 400：请求本身问题，不惩罚上游
+        "server_error": 0.2,  # 5xx：上游故障
+        "other_4xx": 0.3,     # 其他 4xx（如 404 模型不存在）
+    }
+    FAILOVER_MIN_WEIGHT = 1
+
+    # 上游状态快照（重启后恢复权重/熔断/延迟/限流用量）
+    STATE_SNAPSHOT_FILE = "upstream_state.json"  # 位于缓存目录下
+    STATE_SNAPSHOT_INTERVAL = int(os.getenv("STATE_SNAPSHOT_INTERVAL", "30"))  # 保存间隔（秒），0 表示禁用
+    STATE_SNAPSHOT_MAX_AGE = 24 * 3600  # 超过此时长的快照不再恢复（秒）
+    STATE_SNAPSHOT_TRUST_MINUTES = int(os.getenv("STATE_SNAPSHOT_TRUST_MINUTES", "10"))  # 最近多少分钟内成功过的上游跳过启动探测
+
     # 权重配置
     SPECIAL_WEIGHT_THRESHOLD = 100  # 权重大于此值时，下次请求必然选中
     MIN_AUTO_DECREASE_WEIGHT = 50   # 自动减少权重的下限
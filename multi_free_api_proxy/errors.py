@@ -12,6 +12,12 @@ class ErrorType(Enum):
     API_ERROR = "api_error"
     CONCURRENT_LIMIT = "concurrent_limit"
     PROXY_ERROR = "proxy_error"
+    RATE_LIMITED = "rate_limited"
+    AUTH_FAILED = "auth_failed"
+    UPSTREAM_CLIENT_ERROR = "upstream_client_error"
+    REQUEST_TOO_LARGE = "request_too_large"
+    INVALID_REQUEST = "invalid_request"
+    CONTEXT_LENGTH_EXCEEDED = "context_length_exceeded"
     UNKNOWN = "unknown"
 
 class APIError(Exception):
@@ -50,3 +56,40 @@ class FormatError(APIError):
     """格式错误 - 上游返回格式不正确"""
     def __init__(self, message: str = "Invalid response format"):
         super().__init__(ErrorType.API_ERROR, message)
+
+class RateLimitedError(APIError):
+    """限流错误 - 所有可用上游均已达到配额"""
+    def __init__(self, message: str = "All upstream APIs are rate limited", retry_after: float = 0):
+        self.retry_after = retry_after
+        super().__init__(ErrorType.RATE_LIMITED, message)
+
+class UpstreamClientError(APIError):
+    """上游判定请求本身无效（400 等），直接返回给客户端，不重试"""
+    def __init__(self, message: str = "Invalid request", status_code: int = 400, api_name: str = ""):
+        self.status_code = status_code
+        self.api_name = api_name
+        super().__init__(ErrorType.UPSTREAM_CLIENT_ERROR, message)
+
+class RequestTooLargeError(APIError):
+    """请求体超过大小限制"""
+    def __init__(self, message: str = "Request body too large"):
+        super().__init__(ErrorType.REQUEST_TOO_LARGE, message)
+
+class InvalidRequestError(APIError):
+    """请求体格式无效"""
+    def __init__(self, message: str = "Invalid request body"):
+        super().__init__(ErrorType.INVALID_REQUEST, message)
+
+class ContextLengthError(APIError):
+    """请求超出所有可用上游的上下文窗口"""
+    def __init__(self, message: str = "Prompt exceeds context window", prompt_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        super().__init__(ErrorType.CONTEXT_LENGTH_EXCEEDED, message)
+
+class LoadShedError(APIError):
+    """准入阶段提前拒绝：排队已满、租户超过公平份额或预计等待过长"""
+    def __init__(self, message: str = "Request shed", reason: str = "", priority_class: str = "", retry_after: float = 0):
+        self.reason = reason
+        self.priority_class = priority_class
+        self.retry_after = retry_after
+        super().__init__(ErrorType.CONCURRENT_LIMIT, message)
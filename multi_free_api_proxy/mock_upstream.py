@@ -0,0 +1,293 @@
+"""
+本地模拟上游（离线压测用）
+在一个端口上模拟多个 OpenAI 兼容的上游，每个上游可配置：
+- 延迟分布（fixed / uniform / lognormal）
+- 错误率：500、429（带 Retry-After）、返回 HTML、空响应体
+- 输出 token 数和生成速度（SSE 流式按速度逐个发送）
+
+同时可生成注册表覆盖文件，设置 UPSTREAM_OVERLAY 后代理只加载这些模拟上游：
+
+    python mock_upstream.py --providers 3 --overlay mock_overlay.json --seed 42
+    UPSTREAM_OVERLAY=mock_overlay.json python multi_free_api_proxy_v3_optimized.py
+
+上游地址：http://127.0.0.1:<port>/<名称>/v1/chat/completions
+统计信息：GET /stats
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+# 内置的上游画像：依次循环分配给 mock1、mock2 ...
+DEFAULT_PROFILES = [
+    {
+        "name": "fast",
+        "latency": {"dist": "lognormal", "median_ms": 300, "p99_ms": 1200},
+        "tokens_per_second": 80,
+        "output_tokens": 60,
+        "errors": {"500": 0.01},
+    },
+    {
+        "name": "slow",
+        "latency": {"dist": "lognormal", "median_ms": 1500, "p99_ms": 8000},
+        "tokens_per_second": 25,
+        "output_tokens": 120,
+        "errors": {"500": 0.02, "empty": 0.01},
+    },
+    {
+        "name": "flaky",
+        "latency": {"dist": "uniform", "min_ms": 200, "max_ms": 2000},
+        "tokens_per_second": 50,
+        "output_tokens": 80,
+        "errors": {"429": 0.10, "500": 0.05, "html": 0.02},
+        "retry_after": 5,
+    },
+]
+
+OUTCOMES = ("ok", "500", "429", "html", "empty")
+# lognormal 分布中 p99 对应的标准正态分位数
+_Z99 = 2.3263
+
+
+class MockProvider:
+    """单个模拟上游"""
+
+    def __init__(self, name: str, profile: Dict, seed: int):
+        self.name = name
+        self.profile = profile
+        self.model = profile.get("model", f"{name}-model")
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.stats = {outcome: 0 for outcome in OUTCOMES}
+        self._stats_lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """按配置的分布采样首包延迟（秒）"""
+        latency = self.profile.get("latency") or {}
+        dist = latency.get("dist", "fixed")
+        with self._rng_lock:
+            if dist == "uniform":
+                ms = self.rng.uniform(latency.get("min_ms", 0), latency.get("max_ms", 1000))
+            elif dist == "lognormal":
+                median = max(1.0, latency.get("median_ms", 500))
+                p99 = max(median, latency.get("p99_ms", median * 4))
+                sigma = math.log(p99 / median) / _Z99
+                ms = self.rng.lognormvariate(math.log(median), sigma)
+            else:
+                ms = latency.get("ms", 500)
+        return max(0.0, ms) / 1000.0
+
+    def sample_outcome(self) -> str:
+        """按错误率决定本次请求的结果"""
+        errors = self.profile.get("errors") or {}
+        with self._rng_lock:
+            r = self.rng.random()
+        cumulative = 0.0
+        for outcome in OUTCOMES[1:]:
+            cumulative += float(errors.get(outcome, 0))
+            if r < cumulative:
+                return outcome
+        return "ok"
+
+    def record(self, outcome: str):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            return dict(self.stats, profile=self.profile.get("name"))
+
+
+def _completion_text(tokens: int) -> List[str]:
+    """生成指定 token 数的回复片段（每个片段约等于一个 token）"""
+    words = ["mock", " response", " token", " from", " the", " local", " upstream", "."]
+    return [words[i % len(words)] for i in range(tokens)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    providers: Dict[str, MockProvider] = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Dict = None):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _provider(self):
+        parts = self.path.strip("/").split("/", 1)
+        provider = self.providers.get(parts[0])
+        return provider, ("/" + parts[1]) if len(parts) > 1 else "/"
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._send_json(200, {"status": "ok", "providers": list(self.providers)})
+        if self.path == "/stats":
+            return self._send_json(200, {name: p.get_stats() for name, p in self.providers.items()})
+
+        provider, path = self._provider()
+        if provider and path == "/v1/models":
+            return self._send_json(200, {"object": "list", "data": [{"id": provider.model, "object": "model"}]})
+        self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        provider, path = self._provider()
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not provider or path != "/v1/chat/completions":
+            return self._send_json(404, {"error": {"message": "not found"}})
+        try:
+            data = json.loads(raw or b"{}")
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "invalid json"}})
+
+        outcome = provider.sample_outcome()
+        provider.record(outcome)
+        time.sleep(provider.sample_latency())
+
+        if outcome == "500":
+            return self._send_json(500, {"error": {"message": "mock internal error"}})
+        if outcome == "429":
+            retry_after = provider.profile.get("retry_after", 10)
+            return self._send_json(429, {"error": {"message": "mock rate limited"}}, {"Retry-After": retry_after})
+        if outcome == "html":
+            raw = b"<html><body>mock gateway error</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            return self.wfile.write(raw)
+        if outcome == "empty":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        tokens = int(data.get("max_tokens") or provider.profile.get("output_tokens", 50))
+        tokens = min(tokens, provider.profile.get("output_tokens", 50))
+        if data.get("stream"):
+            return self._stream(provider, tokens)
+
+        # 非流式：按生成速度计算剩余耗时
+        tps = provider.profile.get("tokens_per_second", 50)
+        time.sleep(tokens / tps if tps > 0 else 0)
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 4 for m in data.get("messages", []))
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": provider.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(_completion_text(tokens))},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                      "total_tokens": prompt_tokens + tokens},
+        })
+
+    def _stream(self, provider: MockProvider, tokens: int):
+        """SSE 流式响应：按 tokens_per_second 逐个发送"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        tps = provider.profile.get("tokens_per_second", 50)
+        interval = 1.0 / tps if tps > 0 else 0
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        pieces = _completion_text(tokens)
+        try:
+            for i, piece in enumerate(pieces):
+                chunk = {
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "model": provider.model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": piece},
+                        "finish_reason": "stop" if i == len(pieces) - 1 else None,
+                    }],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def build_providers(count: int, profiles: List[Dict], seed: int) -> Dict[str, MockProvider]:
+    providers = {}
+    for i in range(count):
+        name = f"mock{i + 1}"
+        providers[name] = MockProvider(name, profiles[i % len(profiles)], seed + i)
+    return providers
+
+
+def write_overlay(path: str, providers: Dict[str, MockProvider], host: str, port: int):
+    """生成代理使用的注册表覆盖文件（格式同 free_api_test/freeN/config.py 的字段）"""
+    overlay = {}
+    for name, provider in providers.items():
+        overlay[name] = {
+            "API_KEY": "mock-key",
+            "BASE_URL": f"http://{host}:{port}/{name}",
+            "MODEL_NAME": provider.model,
+            "DEFAULT_WEIGHT": provider.profile.get("weight", 10),
+            "LIMIT": provider.profile.get("limit", {}),
+            "CONTEXT_WINDOW": provider.profile.get("context_window", 32768),
+        }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(overlay, f, indent=2, ensure_ascii=False)
+    print(f"[模拟上游] 已生成注册表覆盖文件: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟上游（离线压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5900)
+    parser.add_argument("--providers", type=int, default=3, help="模拟上游数量")
+    parser.add_argument("--profiles", help="上游画像 JSON 文件（列表，循环分配），默认使用内置画像")
+    parser.add_argument("--overlay", help="生成注册表覆盖文件的路径")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（相同种子得到相同的延迟/错误序列）")
+    args = parser.parse_args()
+
+    profiles = DEFAULT_PROFILES
+    if args.profiles:
+        with open(args.profiles, "r", encoding="utf-8") as f:
+            profiles = json.load(f)
+
+    providers = build_providers(args.providers, profiles, args.seed)
+    MockHandler.providers = providers
+    if args.overlay:
+        write_overlay(args.overlay, providers, args.host, args.port)
+
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"[模拟上游] 监听 http://{args.host}:{args.port}")
+    for name, provider in providers.items():
+        print(f"[模拟上游] {name}: {provider.profile.get('name')} -> http://{args.host}:{args.port}/{name}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[模拟上游] 已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,10 +12,14 @@ import socket
 import requests
 import importlib.util
 import random
+import atexit
+import signal
 from pathlib import Path
+from types import SimpleNamespace
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 from flask import Flask, request, jsonify, render_template
+from werkzeug.exceptions import RequestEntityTooLarge
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -39,11 +43,52 @@ _load_env()
 # 导入本地模块
 from config import get_config
 from app_state import AppState
-from errors import ErrorType, APIError, TimeoutError, UpstreamError, ConcurrentLimitError, NoAvailableAPIError, FormatError
+from errors import ErrorType, APIError, TimeoutError, UpstreamError, ConcurrentLimitError, NoAvailableAPIError, FormatError, RateLimitedError, LoadShedError, UpstreamClientError, RequestTooLargeError, InvalidRequestError, ContextLengthError
+from token_estimator import lookup_context_window, fits_context_window
+from response_normalizer import compile_normalizer
+from request_body import check_content_length, parse_chat_request
+from state_snapshot import SnapshotStore, SnapshotWriter
+from upstream_http import UpstreamClients
+from request_coalescer import RequestCoalescer, canonical_key
+from semantic_cache import SemanticCache
+from admission import AdmissionController, client_identity, parse_classes, parse_client_classes
+from concurrency_limiter import GradientLimiter
+
+# 守护进程子进程辅助位于项目根目录（daemon_child.py）
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from daemon_child import has_inherited_socket, serve_app
 
 # 初始化配置和状态
 config = get_config()
 app_state = AppState(config)
+snapshot_store = SnapshotStore(Path(config.get_cache_dir()) / config.STATE_SNAPSHOT_FILE)
+coalescer = RequestCoalescer(window_seconds=config.COALESCE_WINDOW_SECONDS,
+                             default_temperature=config.DEFAULT_TEMPERATURE)
+admission = AdmissionController(
+    config.MAX_CONCURRENT_REQUESTS,
+    parse_classes(config.ADMISSION_CLASSES),
+    config.ADMISSION_DEFAULT_CLASS,
+    client_classes=parse_client_classes(config.ADMISSION_CLIENT_CLASSES),
+    max_wait=config.ADMISSION_MAX_WAIT
+)
+concurrency_limiter = GradientLimiter(
+    config.MAX_CONCURRENT_REQUESTS,
+    min_limit=config.ADAPTIVE_CONCURRENCY_MIN,
+    max_limit=config.ADAPTIVE_CONCURRENCY_MAX,
+    tolerance=config.ADAPTIVE_CONCURRENCY_TOLERANCE,
+    window=config.ADAPTIVE_CONCURRENCY_WINDOW
+) if config.ADAPTIVE_CONCURRENCY else None
+if concurrency_limiter is not None:
+    admission.set_limit(concurrency_limiter.limit)
+semantic_cache = SemanticCache(
+    max_entries=config.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.SEMANTIC_CACHE_TTL,
+    max_distance=config.SEMANTIC_CACHE_MAX_DISTANCE,
+    max_temperature=config.SEMANTIC_CACHE_MAX_TEMPERATURE,
+    default_temperature=config.DEFAULT_TEMPERATURE
+) if config.SEMANTIC_CACHE else None
+# 网络路径矩阵给出的各上游代理决定（load_api_configs 时读取）
+network_use_proxy = {}
 
 def update_call_stats(success=True, is_timeout=False):
     """更新调用统计"""
@@ -81,10 +126,20 @@ def update_call_stats(success=True, is_timeout=False):
 
 # 创建 Flask 应用
 app = Flask(__name__, template_folder='templates', static_folder='static')
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_REQUEST_BODY_BYTES
 
-# 配置 requests 会话
+# 配置 requests 会话（本地独立服务使用）
 session = requests.Session()
 
+# 上游 HTTP 客户端：每个上游独立连接池，共享 DNS 缓存和 TLS 会话
+upstream_clients = UpstreamClients(
+    enabled=config.UPSTREAM_CONNECTION_CACHE,
+    pool_maxsize=config.UPSTREAM_POOL_MAXSIZE,
+    dns_ttl=config.DNS_CACHE_TTL,
+    dns_min_ttl=config.DNS_CACHE_MIN_TTL,
+    dns_stale_seconds=config.DNS_STALE_SECONDS
+)
+
 class FileChangeHandler(FileSystemEventHandler):
     """监控文件变化"""
     def on_modified(self, event):
@@ -117,8 +172,114 @@ def load_env():
                     key, value = line.split("=", 1)
                     os.environ[key.strip()] = value.strip()
 
+def load_network_matrix(matrix_path):
+    """读取网络路径矩阵中各上游的代理决定（network_matrix.json 的 use_proxy 字段）"""
+    try:
+        with open(matrix_path, "r", encoding="utf-8") as f:
+            decisions = json.load(f).get("use_proxy") or {}
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"[配置] 读取网络路径矩阵失败，使用配置文件中的 USE_PROXY: {e}")
+        return {}
+    decisions = {name: value for name, value in decisions.items() if isinstance(value, bool)}
+    print(f"[配置] 使用网络路径矩阵: {matrix_path} (走代理: {sorted(n for n, v in decisions.items() if v)})")
+    return decisions
+
+def register_api_config(api_name, config_module, require_env_key=True):
+    """从上游配置（config.py 模块或覆盖文件中的对象）构建并注册 API 配置"""
+    api_key = getattr(config_module, "API_KEY", None)
+    base_url = getattr(config_module, "BASE_URL", None)
+    model_name = getattr(config_module, "MODEL_NAME", None)
+    use_proxy = getattr(config_module, "USE_PROXY", False)
+    use_sdk = getattr(config_module, "USE_SDK", False)
+    available_models = getattr(config_module, "AVAILABLE_MODELS", [])
+    max_tokens = getattr(config_module, "MAX_TOKENS", config.DEFAULT_MAX_TOKENS)
+    default_weight = getattr(config_module, "DEFAULT_WEIGHT", 10)
+    endpoint = getattr(config_module, "ENDPOINT", "/v1/chat/completions")
+    limit = getattr(config_module, "LIMIT", {})
+    context_window = lookup_context_window(model_name, getattr(config_module, "CONTEXT_WINDOW", None))
+    response_format = getattr(config_module, "RESPONSE_FORMAT", {
+        "content_fields": ["content"],
+        "merge_fields": False,
+        "use_reasoning_as_fallback": False
+    })
+
+    if not base_url or not model_name:
+        print(f"[跳过] {api_name}: 配置不完整")
+        return
+
+    if require_env_key:
+        env_key = f"{api_name.upper()}_API_KEY"
+        env_api_key = os.getenv(env_key)
+        if not env_api_key:
+            print(f"[跳过] {api_name}: 环境变量 {env_key} 未配置")
+            return
+
+        api_key = env_api_key
+
+    if api_name in network_use_proxy:
+        use_proxy = network_use_proxy[api_name]
+
+    api_config = {
+        "name": api_name,
+        "api_key": api_key,
+        "base_url": base_url,
+        "model": model_name,
+        "available_models": available_models,
+        "max_tokens": max_tokens,
+        "context_window": context_window,
+        "default_weight": default_weight,
+        "use_proxy": use_proxy,
+        "endpoint": endpoint,
+        "response_format": response_format,
+        "limit": limit,
+        "available": False,
+        "last_test_time": None,
+        "last_test_result": None,
+        "success_count": 0,
+        "failure_count": 0,
+        "consecutive_failures": 0
+    }
+
+    if use_sdk:
+        api_config["use_sdk"] = True
+
+    # 验证API配置
+    is_valid, error_msg = validate_api_config(api_name, api_config)
+    if not is_valid:
+        print(f"[跳过] {api_name}: 配置验证失败 - {error_msg}")
+        return
+
+    app_state.add_api(api_name, api_config)
+    app_state.rate_limits.configure(api_name, limit)
+    app_state.set_response_normalizer(api_name, compile_normalizer(response_format))
+    print(f"[加载] {api_name}: {model_name} @ {base_url}")
+
+def load_overlay_api_configs(overlay_path):
+    """从注册表覆盖文件加载上游（如 mock_upstream.py 生成的模拟上游），替代 free_api_test 目录"""
+    print(f"[配置] 使用注册表覆盖文件: {overlay_path}")
+    try:
+        with open(overlay_path, "r", encoding="utf-8") as f:
+            overlay = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[错误] 读取覆盖文件失败: {e}")
+        return
+
+    for api_name, fields in sorted(overlay.items()):
+        if isinstance(fields, dict):
+            register_api_config(api_name, SimpleNamespace(**fields), require_env_key=False)
+
 def load_api_configs():
     """从free_api_test目录自动加载API配置"""
+    global network_use_proxy
+    network_use_proxy = load_network_matrix(config.NETWORK_MATRIX_FILE) if config.NETWORK_MATRIX_FILE else {}
+
+    if config.UPSTREAM_OVERLAY:
+        load_overlay_api_configs(config.UPSTREAM_OVERLAY)
+        print(f"[配置] 已加载 {len(app_state.get_all_apis())} 个API配置")
+        validate_all_apis_before_startup()
+        init_default_weights()
+        return
+
     script_dir = Path(__file__).parent
     free_api_dir = script_dir.parent / "free_api_test"
 
@@ -148,66 +309,7 @@ def load_api_configs():
             config_module = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(config_module)
 
-            api_key = getattr(config_module, "API_KEY", None)
-            base_url = getattr(config_module, "BASE_URL", None)
-            model_name = getattr(config_module, "MODEL_NAME", None)
-            use_proxy = getattr(config_module, "USE_PROXY", False)
-            use_sdk = getattr(config_module, "USE_SDK", False)
-            available_models = getattr(config_module, "AVAILABLE_MODELS", [])
-            max_tokens = getattr(config_module, "MAX_TOKENS", config.DEFAULT_MAX_TOKENS)
-            default_weight = getattr(config_module, "DEFAULT_WEIGHT", 10)
-            endpoint = getattr(config_module, "ENDPOINT", "/v1/chat/completions")
-            response_format = getattr(config_module, "RESPONSE_FORMAT", {
-                "content_fields": ["content"],
-                "merge_fields": False,
-                "use_reasoning_as_fallback": False
-            })
-
-            if not base_url or not model_name:
-                print(f"[跳过] {api_name}: 配置不完整")
-                continue
-
-            env_key = f"{api_name.upper()}_API_KEY"
-            env_api_key = os.getenv(env_key)
-            if not env_api_key:
-                print(f"[跳过] {api_name}: 环境变量 {env_key} 未配置")
-                continue
-
-            api_key = env_api_key
-
-            if api_name == "free1":
-                use_proxy = True
-
-            api_config = {
-                "name": api_name,
-                "api_key": api_key,
-                "base_url": base_url,
-                "model": model_name,
-                "available_models": available_models,
-                "max_tokens": max_tokens,
-                "default_weight": default_weight,
-                "use_proxy": use_proxy,
-                "endpoint": endpoint,
-                "response_format": response_format,
-                "available": False,
-                "last_test_time": None,
-                "last_test_result": None,
-                "success_count": 0,
-                "failure_count": 0,
-                "consecutive_failures": 0
-            }
-
-            if use_sdk:
-                api_config["use_sdk"] = True
-
-            # 验证API配置
-            is_valid, error_msg = validate_api_config(api_name, api_config)
-            if not is_valid:
-                print(f"[跳过] {api_name}: 配置验证失败 - {error_msg}")
-                continue
-
-            app_state.add_api(api_name, api_config)
-            print(f"[加载] {api_name}: {model_name} @ {base_url}")
+            register_api_config(api_name, config_module)
 
         except Exception as e:
             print(f"[错误] 加载 {api_name} 配置失败: {e}")
@@ -255,11 +357,25 @@ def validate_all_apis_before_startup():
         print("[警告] 部分API配置无效，这些API将不会被加载")
     print()
 
+def load_seed_weights(seed_path):
+    """读取冒烟测试生成的建议权重（smoke_matrix.json 的 weights 字段）"""
+    try:
+        with open(seed_path, "r", encoding="utf-8") as f:
+            seed = json.load(f).get("weights") or {}
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"[权重] 读取权重种子文件失败，使用默认权重: {e}")
+        return {}
+    return {name: weight for name, weight in seed.items() if isinstance(weight, int) and weight > 0}
+
 def init_default_weights():
-    """初始化默认权重"""
+    """初始化默认权重（配置了 SEED_WEIGHTS_FILE 时优先使用冒烟测试的建议权重）"""
+    seed = load_seed_weights(config.SEED_WEIGHTS_FILE) if config.SEED_WEIGHTS_FILE else {}
     weights = {}
     for api_name, api_config in app_state.get_all_apis().items():
-        weights[api_name] = api_config.get("default_weight", 10)
+        weights[api_name] = seed.get(api_name, api_config.get("default_weight", 10))
+        api_config.pop("penalty_base_weight", None)
+    if seed:
+        print(f"[权重] 使用权重种子文件: {config.SEED_WEIGHTS_FILE}")
     app_state.init_weights(weights)
     print(f"[权重] 默认权重已初始化: {weights}")
 
@@ -358,13 +474,15 @@ def test_api_startup(api_name):
             "max_tokens": 10
         }
 
-        response = requests.post(url, headers=headers, json=payload, proxies=proxies, timeout=30)
+        probe_start = time.time()
+        response = upstream_clients.get(api_name).post(url, headers=headers, json=payload, proxies=proxies, timeout=30)
         api_config["last_test_time"] = datetime.now().isoformat()
 
         if response.status_code == 200:
             api_config["available"] = True
             api_config["last_test_result"] = "success"
             api_config["success_count"] += 1
+            app_state.record_api_latency(api_name, time.time() - probe_start)
             print(f"[启动测试] {api_name} 可用")
             return True
         else:
@@ -395,11 +513,16 @@ def test_api_startup(api_name):
         print(f"[启动测试] {api_name} 测试失败: {e}")
         return False
 
-def test_all_apis_startup():
-    """启动时测试所有API"""
+def test_all_apis_startup(trusted_apis=None):
+    """启动时测试所有API
+    
+    Args:
+        trusted_apis: 快照中最近确认健康的 API，直接加入可用列表，不再探测
+    """
     print("\n[启动测试] 开始测试所有API...")
 
     app_state.clear_available_apis()
+    trusted_apis = set(trusted_apis or [])
     
     total_apis = len(app_state.get_all_apis())
     successful_apis = []
@@ -408,7 +531,11 @@ def test_all_apis_startup():
     for api_name in app_state.get_all_apis():
         api_config = app_state.get_api(api_name)
         if api_config and api_config.get("api_key"):
-            if test_api_startup(api_name):
+            if api_name in trusted_apis:
+                app_state.add_available_api(api_name)
+                successful_apis.append(api_name)
+                print(f"[启动测试] {api_name} 最近已确认可用（快照），跳过探测")
+            elif test_api_startup(api_name):
                 app_state.add_available_api(api_name)
                 successful_apis.append(api_name)
             else:
@@ -432,8 +559,52 @@ def test_all_apis_startup():
     if not available:
         print(f"[警告] 没有可用的API！服务将启动但无法处理请求")
 
-def get_next_available_api():
-    """获取下一个可用的API（基于权重选择）"""
+def resolve_max_tokens(api_name, prompt_tokens, requested_max_tokens=None):
+    """计算发送给上游的 max_tokens
+
+    客户端指定时原样使用；未指定时使用上游默认值，并按上下文窗口剩余空间截断
+    """
+    api_config = app_state.get_api(api_name) or {}
+    if requested_max_tokens:
+        return requested_max_tokens
+
+    max_tokens = api_config.get("max_tokens", config.DEFAULT_MAX_TOKENS)
+    context_window = api_config.get("context_window", 0)
+    if context_window:
+        max_tokens = min(max_tokens, max(0, context_window - prompt_tokens))
+    return max_tokens
+
+def compact_messages_for_api(api_name, messages, requested_max_tokens=None):
+    """按上游上下文窗口（及全局预算）压缩对话历史
+
+    Returns:
+        (压缩后的消息列表, 压缩统计)
+    """
+    api_config = app_state.get_api(api_name) or {}
+    budgets = []
+    context_window = api_config.get("context_window", 0)
+    if context_window:
+        reserved = requested_max_tokens or api_config.get("max_tokens", config.DEFAULT_MAX_TOKENS)
+        budgets.append(max(context_window - reserved, context_window // 2))
+    if config.COMPACT_MAX_PROMPT_TOKENS:
+        budgets.append(config.COMPACT_MAX_PROMPT_TOKENS)
+    if not budgets:
+        return messages, {"compacted": False}
+    return app_state.prompt_compactor.compact(messages, min(budgets))
+
+def api_fits_context(api_name, prompt_tokens, requested_max_tokens=None):
+    """检查上游的上下文窗口能否放下 prompt + max_tokens"""
+    api_config = app_state.get_api(api_name) or {}
+    context_window = api_config.get("context_window", 0)
+    needed = requested_max_tokens or config.MIN_COMPLETION_TOKENS
+    return fits_context_window(context_window, prompt_tokens, needed)
+
+def get_next_available_api(estimated_tokens=0, prompt_tokens=0, requested_max_tokens=None):
+    """获取下一个可用的API（基于权重选择）
+
+    estimated_tokens: 本次请求预估的 token 数，用于跳过 TPM 配额不足的上游
+    prompt_tokens / requested_max_tokens: 用于跳过上下文窗口放不下的上游
+    """
     # 清理过期的黑名单记录
     app_state.cleanup_failed_apis()
 
@@ -452,6 +623,22 @@ def get_next_available_api():
     else:
         print(f"[选择] 可用 API 数量: {len(filtered_list)}/{len(available_list)}")
 
+    # 过滤掉上下文窗口放不下本次请求的 API
+    filtered_list = [api_name for api_name in filtered_list
+                     if api_fits_context(api_name, prompt_tokens, requested_max_tokens)]
+
+    if not filtered_list:
+        print(f"[上下文] 没有上下文窗口足够的 API (prompt 约 {prompt_tokens} tokens)")
+        return None
+
+    # 过滤掉已达到限流配额或处于 Retry-After 冷却中的 API
+    filtered_list = [api_name for api_name in filtered_list
+                     if app_state.rate_limits.can_dispatch(api_name, estimated_tokens)]
+
+    if not filtered_list:
+        print(f"[限流] 所有可用的 API 均已达到限流配额")
+        return None
+
     # 检查是否有特别权重的API
     special_weight_apis = []
     for api_name in filtered_list:
@@ -509,6 +696,7 @@ def mark_api_success(api_name):
     
     api_config["consecutive_failures"] = 0
     api_config["success_count"] += 1
+    restore_penalized_weight(api_name, api_config)
     
     if api_name not in app_state.get_available_apis() and api_config.get("api_key"):
         app_state.add_available_api(api_name)
@@ -525,6 +713,83 @@ def decrease_api_weight(api_name, reduction=1):
             app_state.set_weight(api_name, new_weight)
             print(f"[权重] {api_name} 权重自动减少: {current_weight} -> {new_weight} (减少: {reduction})")
 
+def apply_failover_penalty(api_name, decision):
+    """按错误类型按比例降低权重（普通权重同样生效），记录惩罚前的权重以便成功后恢复"""
+    ratio = config.FAILOVER_WEIGHT_PENALTIES.get(decision, 0)
+    api_config = app_state.get_api(api_name)
+    if not ratio or not api_config:
+        return
+
+    current_weight = app_state.get_weight(api_name, 10)
+    new_weight = max(config.FAILOVER_MIN_WEIGHT, int(current_weight * (1 - ratio)))
+    if new_weight >= current_weight:
+        return
+    api_config.setdefault("penalty_base_weight", current_weight)
+    app_state.set_weight(api_name, new_weight)
+    print(f"[权重] {api_name} 因 {decision} 降低权重: {current_weight} -> {new_weight}")
+
+def restore_penalized_weight(api_name, api_config):
+    """成功后逐步恢复被故障惩罚降低的权重"""
+    base_weight = api_config.get("penalty_base_weight")
+    if base_weight is None:
+        return
+
+    current_weight = app_state.get_weight(api_name, 10)
+    new_weight = min(base_weight, current_weight + max(1, base_weight // 10))
+    app_state.set_weight(api_name, new_weight)
+    if new_weight >= base_weight:
+        del api_config["penalty_base_weight"]
+        print(f"[权重] {api_name} 权重已恢复: {new_weight}")
+
+def classify_upstream_status(status_code):
+    """按上游 HTTP 状态码划分故障转移决策类型"""
+    if status_code == 429:
+        return "rate_limited"
+    if status_code in (401, 403):
+        return "auth_failed"
+    if status_code in config.CLIENT_ERROR_STATUS_CODES:
+        return "client_error"
+    if isinstance(status_code, int) and 500 <= status_code < 600:
+        return "server_error"
+    return "other_4xx"
+
+def disable_api_key(api_name, status_code):
+    """上游拒绝密钥（401/403）：停用该 API 并告警"""
+    app_state.remove_available_api(api_name)
+    api_config = app_state.get_api(api_name)
+    if api_config:
+        api_config["available"] = False
+        api_config["last_test_result"] = f"auth failed: HTTP {status_code}"
+
+    message = f"{api_name} 密钥被上游拒绝 (HTTP {status_code})，已停用，请检查 {api_name.upper()}_API_KEY"
+    app_state.set_error(ErrorType.AUTH_FAILED.value, message)
+    print(f"[告警] {message}")
+
+def extract_upstream_error_message(response):
+    """从上游错误响应中提取错误信息"""
+    if response is None:
+        return "Upstream rejected the request"
+    try:
+        body = response.json()
+    except ValueError:
+        return response.text[:500] or f"HTTP {response.status_code}"
+
+    error_info = body.get("error") if isinstance(body, dict) else None
+    if isinstance(error_info, dict):
+        return error_info.get("message", str(error_info))
+    if error_info:
+        return str(error_info)
+    return str(body)[:500]
+
+def record_upstream_attempt(started, dropped=False):
+    """自适应并发上限采样：每次上游调用记录一次耗时（不含重试等待），超时、连接失败和 5xx 视为过载"""
+    if concurrency_limiter is None:
+        return
+    new_limit = concurrency_limiter.record(time.time() - started, dropped, in_flight=admission.in_use())
+    if new_limit != admission.limit:
+        print(f"[并发] 自适应上限调整: {admission.limit} -> {new_limit}")
+        admission.set_limit(new_limit)
+
 # ==================== 路由定义 ====================
 
 @app.route('/debug', methods=['GET'])
@@ -534,6 +799,31 @@ def debug_page():
         return "Debug mode not enabled", 403
     return render_template('debug.html')
 
+def execute_coalesced(data, message_id, call_id, ticket):
+    """合并同时在途的相同请求，返回 (result, retry_count, used_api_name, 是否复用了其他请求的结果)"""
+    if not config.COALESCE_REQUESTS or not coalescer.eligible(data):
+        return execute_with_free_api(data, message_id, call_id) + (False,)
+
+    flight, leader = coalescer.join(canonical_key(data))
+    if leader:
+        try:
+            outcome = execute_with_free_api(data, message_id, call_id)
+        except BaseException as e:
+            coalescer.complete(flight, error=e)
+            raise
+        coalescer.complete(flight, result=outcome)
+        return outcome + (False,)
+
+    print(f"[{call_id}] 与进行中的相同请求合并，等待其结果")
+    # 等待期间不占用并发名额；结果已就绪，名额已满时不再占用（不超过上限）
+    admission.pause(ticket)
+    app_state.decrement_active_requests()
+    try:
+        return flight.wait(coalescer.max_wait) + (True,)
+    finally:
+        if admission.resume(ticket):
+            app_state.increment_active_requests()
+
 @app.route('/v1/chat/completions', methods=['POST'])
 def chat_completions():
     """兼容 OpenAI API 格式的聊天完成端点"""
@@ -548,37 +838,85 @@ def chat_completions():
             print(f"[错误] 重新加载失败: {e}")
             return jsonify({"error": f"Configuration reload failed: {str(e)}"}), 500
 
-    # 并发控制
-    max_wait_time = 120
-    wait_start = time.time()
-
-    while True:
-        if app_state.get_active_requests() < config.MAX_CONCURRENT_REQUESTS:
-            app_state.increment_active_requests()
-            break
+    # 准入检查：按 Content-Length 快速拒绝超大请求（不读取请求体、不占用并发名额）
+    try:
+        check_content_length(request.content_length, config.MAX_REQUEST_BODY_BYTES)
+    except RequestTooLargeError as e:
+        print(f"[请求体] 拒绝超大请求: {str(e)}")
+        return jsonify({
+            "error": {
+                "message": str(e),
+                "type": "request_too_large",
+                "limit": config.MAX_REQUEST_BODY_BYTES
+            }
+        }), 413
 
-        elapsed = time.time() - wait_start
-        if elapsed > max_wait_time:
-            print(f"[并发] 等待超时 (已等待 {elapsed:.1f}s)")
-            app_state.set_error(ErrorType.CONCURRENT_LIMIT.value, 
-                              f"Concurrent limit exceeded: {app_state.get_active_requests()}/{config.MAX_CONCURRENT_REQUESTS}")
-            return jsonify({
-                "error": "Server too busy - concurrent request limit exceeded",
-                "current": app_state.get_active_requests(),
-                "limit": config.MAX_CONCURRENT_REQUESTS
-            }), 503
+    # 并发控制：按优先级类别加权公平排队，超出份额的请求提前拒绝
+    client_key, tenant = client_identity(request.headers.get("Authorization"), request.remote_addr)
+    priority_class = admission.classify(client_key, request.headers.get(config.ADMISSION_PRIORITY_HEADER))
+    try:
+        ticket = admission.acquire(priority_class, tenant)
+    except LoadShedError as e:
+        retry_after = max(1, int(e.retry_after + 0.999))
+        print(f"[并发] 提前拒绝 ({e.priority_class}/{tenant}): {e.reason}")
+        app_state.set_error(ErrorType.CONCURRENT_LIMIT.value, str(e))
+        response = jsonify({
+            "error": {
+                "message": "Server too busy - request shed by admission control. Please retry later.",
+                "type": "load_shed",
+                "reason": e.reason,
+                "priority_class": e.priority_class,
+                "retry_after": retry_after
+            }
+        })
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+    except ConcurrentLimitError as e:
+        print(f"[并发] 等待超时 ({priority_class}/{tenant}): {str(e)}")
+        app_state.set_error(ErrorType.CONCURRENT_LIMIT.value, str(e))
+        return jsonify({
+            "error": "Server too busy - concurrent request limit exceeded",
+            "current": app_state.get_active_requests(),
+            "limit": admission.limit
+        }), 503
+    app_state.increment_active_requests()
 
-        time.sleep(0.1)
+    message_id = str(time.time())
+    call_id = generate_call_id()
 
     try:
-        data = request.get_json()
-        message_id = str(time.time())
-        call_id = generate_call_id()
+        # 按块读取并增量解析请求体，超过大小/条数限制时尽早拒绝
+        try:
+            data = parse_chat_request(
+                request.stream,
+                request.content_length,
+                config.MAX_REQUEST_BODY_BYTES,
+                config.MAX_REQUEST_MESSAGES
+            )
+        except RequestEntityTooLarge:
+            # 分块传输没有 Content-Length，超限时 werkzeug（MAX_CONTENT_LENGTH）先于解析器中止读取
+            raise RequestTooLargeError(
+                f"Request body exceeds limit of {config.MAX_REQUEST_BODY_BYTES} bytes"
+            )
 
         print(f"[{call_id}] 收到请求 (ID: {message_id})")
 
+        # 近似重复缓存：低温度请求复用相似提示词的回复；客户端带 no-cache 时跳过
+        if semantic_cache is not None:
+            if "no-cache" in (request.headers.get("Cache-Control") or "").lower():
+                semantic_cache.note_bypass(data)
+            else:
+                cached = semantic_cache.lookup(data)
+                if cached is not None:
+                    result, distance = cached
+                    print(f"[{call_id}] 近似重复缓存命中 (汉明距离: {distance})")
+                    update_call_stats(success=True)
+                    response = jsonify(result)
+                    response.headers["X-Semantic-Cache"] = f"hit; distance={distance}"
+                    return response, 200
+
         try:
-            result, retry_count, used_api_name = execute_with_free_api(data, message_id, call_id)
+            result, retry_count, used_api_name, coalesced = execute_coalesced(data, message_id, call_id, ticket)
         except NoAvailableAPIError as e:
             print(f"[{call_id}] 没有可用的上游API: {str(e)}")
             available_apis = app_state.get_available_apis()
@@ -592,14 +930,79 @@ def chat_completions():
                 }
             }), 503
 
-        print(f"[{call_id}] 请求成功 (API: {used_api_name}, 重试: {retry_count})")
+        print(f"[{call_id}] 请求成功 (API: {used_api_name}, 重试: {retry_count}{', 合并' if coalesced else ''})")
 
         update_call_stats(success=True)
         
         if retry_count > 0:
             update_call_stats(success=True, is_timeout=False)
 
-        return jsonify(result), 200
+        if semantic_cache is not None and not coalesced:
+            semantic_cache.store(data, result)
+
+        response = jsonify(result)
+        if coalesced:
+            response.headers["X-Coalesced"] = "true"
+        return response, 200
+
+    except RequestTooLargeError as e:
+        print(f"[{call_id}] 请求体超限: {str(e)}")
+        return jsonify({
+            "error": {
+                "message": str(e),
+                "type": "request_too_large",
+                "limit": config.MAX_REQUEST_BODY_BYTES
+            }
+        }), 413
+
+    except InvalidRequestError as e:
+        print(f"[{call_id}] 请求体无效: {str(e)}")
+        return jsonify({
+            "error": {
+                "message": str(e),
+                "type": "invalid_request_error"
+            }
+        }), 400
+
+    except UpstreamClientError as e:
+        print(f"[{call_id}] 请求被上游拒绝 ({e.api_name}, HTTP {e.status_code}): {str(e)}")
+        app_state.set_error(ErrorType.UPSTREAM_CLIENT_ERROR.value, str(e))
+        update_call_stats(success=False)
+        return jsonify({
+            "error": {
+                "message": str(e),
+                "type": "invalid_request_error",
+                "upstream_status": e.status_code
+            }
+        }), e.status_code
+
+    except ContextLengthError as e:
+        print(f"[{call_id}] 超出上下文窗口: {str(e)}")
+        app_state.set_error(ErrorType.CONTEXT_LENGTH_EXCEEDED.value, str(e))
+        update_call_stats(success=False)
+        return jsonify({
+            "error": {
+                "message": str(e),
+                "type": "invalid_request_error",
+                "code": "context_length_exceeded",
+                "prompt_tokens": e.prompt_tokens
+            }
+        }), 400
+
+    except RateLimitedError as e:
+        print(f"[{call_id}] 限流: {str(e)}")
+        app_state.set_error(ErrorType.RATE_LIMITED.value, str(e))
+        update_call_stats(success=False)
+        retry_after = max(1, int(e.retry_after + 0.999))
+        response = jsonify({
+            "error": {
+                "message": "All upstream APIs are rate limited. Please retry later.",
+                "type": "rate_limited",
+                "retry_after": retry_after
+            }
+        })
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
 
     except TimeoutError as e:
         print(f"[{call_id}] 超时: {str(e)}")
@@ -635,8 +1038,10 @@ def chat_completions():
         return jsonify({"error": str(e)}), 500
 
     finally:
-        app_state.decrement_active_requests()
-        print(f"[{call_id}] 请求完成 (当前: {app_state.get_active_requests()}/{config.MAX_CONCURRENT_REQUESTS})")
+        if ticket.holding:
+            app_state.decrement_active_requests()
+        admission.release(ticket)
+        print(f"[{call_id}] 请求完成 (当前: {app_state.get_active_requests()}/{admission.limit})")
 
 @app.route('/v1/models', methods=['GET'])
 def list_models():
@@ -657,8 +1062,8 @@ def list_models():
 
 @app.route('/health', methods=['GET'])
 def health():
-    """健康检查"""
-    return jsonify({"status": "ok"})
+    """健康检查（守护进程热备切换时按 pid 区分新旧子进程）"""
+    return jsonify({"status": "ok", "pid": os.getpid()})
 
 @app.route('/health/upstream', methods=['GET'])
 def health_upstream():
@@ -714,12 +1119,77 @@ def debug_apis():
         "available_apis": app_state.get_available_apis()
     })
 
+@app.route('/debug/rate_limits', methods=['GET'])
+def debug_rate_limits():
+    """获取所有API的限流状态"""
+    return jsonify({
+        "rate_limits": app_state.rate_limits.get_all_status()
+    })
+
+@app.route('/debug/tokens', methods=['GET'])
+def debug_tokens():
+    """获取 token 估算缓存统计和各API上下文窗口"""
+    return jsonify({
+        "estimator": app_state.token_estimator.get_stats(),
+        "context_windows": {
+            api_name: api_config.get("context_window", 0)
+            for api_name, api_config in app_state.get_all_apis().items()
+        }
+    })
+
+@app.route('/debug/compaction', methods=['GET'])
+def debug_compaction():
+    """获取对话历史压缩统计"""
+    return jsonify({
+        "enabled": config.COMPACT_HISTORY,
+        "max_prompt_tokens": config.COMPACT_MAX_PROMPT_TOKENS,
+        "stats": app_state.prompt_compactor.get_stats()
+    })
+
+@app.route('/debug/failover', methods=['GET'])
+def debug_failover():
+    """获取故障转移决策统计"""
+    return jsonify(app_state.get_failover_stats())
+
+@app.route('/debug/snapshot', methods=['GET'])
+def debug_snapshot():
+    """获取上游健康统计和状态快照信息"""
+    return jsonify({
+        "health": app_state.get_health_stats(),
+        "snapshot_file": str(snapshot_store.path),
+        "last_saved_at": snapshot_store.last_saved_at,
+        "last_error": snapshot_store.last_error,
+        "interval": config.STATE_SNAPSHOT_INTERVAL
+    })
+
+@app.route('/debug/coalescing', methods=['GET'])
+def debug_coalescing():
+    """获取相同请求合并统计"""
+    stats = coalescer.get_stats()
+    stats["enabled"] = config.COALESCE_REQUESTS
+    return jsonify(stats)
+
+@app.route('/debug/semantic_cache', methods=['GET'])
+def debug_semantic_cache():
+    """获取近似重复缓存统计（命中距离分布、近似命中相似度、淘汰次数）"""
+    if semantic_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(semantic_cache.get_stats(), enabled=True))
+
+@app.route('/debug/network', methods=['GET'])
+def debug_network():
+    """获取 DNS 缓存与 TLS 会话复用统计"""
+    return jsonify(upstream_clients.get_stats())
+
 @app.route('/debug/concurrency', methods=['GET'])
 def debug_concurrency():
-    """获取并发状态"""
+    """获取并发状态（静态配置、当前生效的上限和自适应调整记录）"""
     return jsonify({
         "active_requests": app_state.get_active_requests(),
         "max_concurrent": config.MAX_CONCURRENT_REQUESTS,
+        "effective_limit": admission.limit,
+        "adaptive": dict(concurrency_limiter.get_stats(), enabled=True) if concurrency_limiter is not None else {"enabled": False},
+        "admission": admission.get_stats(),
         "last_error": app_state.get_error(),
         "call_history": app_state.get_history()
     })
@@ -780,6 +1250,8 @@ def set_api_weight():
             return jsonify({"success": False, "error": "Weight must be non-negative integer"}), 400
 
         app_state.set_weight(api_name, weight)
+        # 手动设置的权重不再被故障惩罚的恢复逻辑覆盖
+        app_state.get_api(api_name).pop("penalty_base_weight", None)
         return jsonify({"success": True, "message": f"Weight set to {weight}"})
 
     except Exception as e:
@@ -1025,12 +1497,41 @@ def execute_with_free_api(data, message_id, call_id=None):
     def _log_upstream_success(api_name):
         print(f"[{datetime.now().strftime('%H:%M:%S')}] [{call_id}] > {api_name} OK")
 
+    # 本地估算 prompt token 数（按消息哈希缓存），用于上下文窗口检查和 TPM 限流
+    prompt_tokens = app_state.token_estimator.estimate_messages(data.get("messages", []))
+    requested_max_tokens = data.get("max_tokens")
+    estimated_tokens = prompt_tokens + (requested_max_tokens or config.DEFAULT_MAX_TOKENS)
+
+    # 启用历史压缩时，只要受保护的头尾消息放得下即可选择该上游
+    selection_prompt_tokens = prompt_tokens
+    if config.COMPACT_HISTORY:
+        selection_prompt_tokens = app_state.prompt_compactor.minimum_tokens(data.get("messages", []))
+
     for attempt in range(config.MAX_RETRIES):
-        api_name = get_next_available_api()
+        api_name = get_next_available_api(estimated_tokens, selection_prompt_tokens, requested_max_tokens)
 
         if not api_name:
+            available_list = app_state.get_available_apis()
+            if available_list and not any(api_fits_context(name, selection_prompt_tokens, requested_max_tokens)
+                                          for name in available_list):
+                raise ContextLengthError(
+                    f"Prompt (~{prompt_tokens} tokens) plus max_tokens exceeds the context window of all available APIs",
+                    prompt_tokens=prompt_tokens
+                )
+            if available_list:
+                retry_after = app_state.rate_limits.min_wait_time(available_list, estimated_tokens)
+                raise RateLimitedError("All available Free APIs are rate limited", retry_after=retry_after)
             raise NoAvailableAPIError("No available Free API")
 
+        # 发送前获取限流配额（并发请求可能已抢先用完）
+        if not app_state.rate_limits.acquire(api_name, estimated_tokens):
+            _log(f"限流配额不足，切换到下一个 API", api_name)
+            last_error = RateLimitedError(
+                f"{api_name} rate limited",
+                retry_after=app_state.rate_limits.min_wait_time([api_name], estimated_tokens)
+            )
+            continue
+
         api_config = app_state.get_api(api_name)
 
         # 路由到独立服务（free8）
@@ -1049,12 +1550,18 @@ def execute_with_free_api(data, message_id, call_id=None):
 
                 # 发送聊天请求到独立服务
                 current_timeout = config.TIMEOUT_RETRY if attempt > 0 else config.TIMEOUT_BASE
-                response = session.post(
-                    service_url,
-                    json=data,
-                    headers={'Content-Type': 'application/json'},
-                    timeout=current_timeout
-                )
+                request_start = time.time()
+                try:
+                    response = session.post(
+                        service_url,
+                        json=data,
+                        headers={'Content-Type': 'application/json'},
+                        timeout=current_timeout
+                    )
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                    record_upstream_attempt(request_start, dropped=True)
+                    raise
+                record_upstream_attempt(request_start, dropped=response.status_code >= 500)
                 response.raise_for_status()
 
                 content_type = response.headers.get('Content-Type', '')
@@ -1100,6 +1607,8 @@ def execute_with_free_api(data, message_id, call_id=None):
                     decrease_api_weight(api_name, reduction=50)
                     raise FormatError(f"Invalid response from {api_name}: {error_msg}")
 
+                result = app_state.get_response_normalizer(api_name).normalize(result)
+
                 _log(f"独立服务成功", api_name)
                 _log_upstream_success(api_name)
 
@@ -1147,21 +1656,39 @@ def execute_with_free_api(data, message_id, call_id=None):
             current_timeout = config.TIMEOUT_RETRY if attempt > 0 else config.TIMEOUT_BASE
             _log(f"发送到 API (尝试 {attempt + 1}/{config.MAX_RETRIES})", api_name)
 
+            # 可选：按该上游的上下文窗口压缩过长的对话历史
+            messages = data.get("messages", [])
+            attempt_prompt_tokens = prompt_tokens
+            if config.COMPACT_HISTORY:
+                messages, compaction = compact_messages_for_api(api_name, messages, requested_max_tokens)
+                if compaction.get("compacted"):
+                    attempt_prompt_tokens = compaction["compacted_tokens"]
+                    _log(f"历史压缩: 省略 {compaction['messages_dropped']} 条消息, "
+                         f"节省 {compaction['tokens_saved']} tokens / {compaction['bytes_saved']} 字节"
+                         f"{' (缓存命中)' if compaction['cache_hit'] else ''}", api_name)
+
             request_data = {
                 "model": api_config.get("model"),
-                "messages": data.get("messages", []),
+                "messages": messages,
                 "temperature": data.get("temperature", config.DEFAULT_TEMPERATURE),
-                "max_tokens": data.get("max_tokens", api_config.get("max_tokens", config.DEFAULT_MAX_TOKENS)),
+                "max_tokens": resolve_max_tokens(api_name, attempt_prompt_tokens, requested_max_tokens),
                 "top_p": data.get("top_p", config.DEFAULT_TOP_P),
             }
 
-            response = session.post(
-                url,
-                json=request_data,
-                headers=headers,
-                proxies=proxies,
-                timeout=current_timeout
-            )
+            request_start = time.time()
+            try:
+                response = upstream_clients.get(api_name).post(
+                    url,
+                    json=request_data,
+                    headers=headers,
+                    proxies=proxies,
+                    timeout=current_timeout
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                # 超时和连接失败视为上游过载，计入自适应并发上限
+                record_upstream_attempt(request_start, dropped=True)
+                raise
+            record_upstream_attempt(request_start, dropped=response.status_code >= 500)
             response.raise_for_status()
 
             content_type = response.headers.get('Content-Type', '')
@@ -1208,11 +1735,19 @@ def execute_with_free_api(data, message_id, call_id=None):
                 decrease_api_weight(api_name, reduction=50)
                 raise FormatError(f"Invalid response from {api_name}: {error_msg}")
 
+            # 按 RESPONSE_FORMAT 归一化 content（字段优先级/合并/回退）
+            result = app_state.get_response_normalizer(api_name).normalize(result)
+
+            usage = result.get("usage") or {}
+            if isinstance(usage, dict) and usage.get("total_tokens"):
+                app_state.rate_limits.reconcile(api_name, estimated_tokens, usage["total_tokens"])
+
             used_model = api_config.get("model", "unknown")
             app_state.set_last_used_model(api_name, used_model)
 
             mark_api_success(api_name)
             decrease_api_weight(api_name)
+            app_state.record_api_latency(api_name, time.time() - request_start)
             used_api_name = api_name
 
             _log_upstream_success(api_name)
@@ -1223,6 +1758,7 @@ def execute_with_free_api(data, message_id, call_id=None):
             last_error = e
             _log(f"超时 (尝试 {attempt + 1}/{config.MAX_RETRIES})", api_name)
             _log_upstream_error(api_name, "TIMEOUT", str(e)[:80])
+            app_state.record_failover(api_name, "timeout")
             mark_api_failure(api_name)
 
             if attempt < config.MAX_RETRIES - 1:
@@ -1235,6 +1771,7 @@ def execute_with_free_api(data, message_id, call_id=None):
             last_error = e
             _log(f"连接错误 (尝试 {attempt + 1}/{config.MAX_RETRIES})", api_name)
             _log_upstream_error(api_name, "CONNECTION_ERROR", str(e)[:80])
+            app_state.record_failover(api_name, "connection_error")
             mark_api_failure(api_name)
 
             if attempt < config.MAX_RETRIES - 1:
@@ -1245,24 +1782,59 @@ def execute_with_free_api(data, message_id, call_id=None):
 
         except requests.exceptions.HTTPError as e:
             last_error = e
-            status_code = e.response.status_code if hasattr(e, 'response') else 'unknown'
-            _log(f"HTTP错误 {status_code} (尝试 {attempt + 1}/{config.MAX_RETRIES})", api_name)
+            response = e.response
+            status_code = response.status_code if response is not None else 'unknown'
+            decision = classify_upstream_status(status_code)
+            _log(f"HTTP错误 {status_code} -> {decision} (尝试 {attempt + 1}/{config.MAX_RETRIES})", api_name)
             _log_upstream_error(api_name, f"HTTP {status_code}", str(e)[:100])
-            mark_api_failure(api_name)
+            app_state.record_failover(api_name, decision)
 
-            if 500 <= status_code < 600 and attempt < config.MAX_RETRIES - 1:
-                retry_count += 1
-                wait_time = 2 ** attempt
-                _log(f"{wait_time}秒后重试...", api_name)
-                time.sleep(wait_time)
+            apply_failover_penalty(api_name, decision)
+
+            if decision == "client_error":
+                # 400：请求本身无效，换上游也不会成功，直接返回客户端
+                raise UpstreamClientError(
+                    extract_upstream_error_message(response),
+                    status_code=status_code,
+                    api_name=api_name
+                )
+
+            if decision == "rate_limited":
+                # 429：配额耗尽不代表上游故障，按 Retry-After 冷却后立即切换，不计入连续失败
+                cooldown = app_state.rate_limits.apply_retry_after(
+                    api_name,
+                    response.headers.get("Retry-After") if response is not None else None,
+                    default_seconds=config.RATE_LIMIT_DEFAULT_COOLDOWN
+                )
+                last_error = RateLimitedError(f"{api_name} returned 429", retry_after=cooldown)
+            elif decision == "auth_failed":
+                # 401/403：密钥失效，停用并告警，立即切换
+                disable_api_key(api_name, status_code)
+            elif decision == "server_error":
+                mark_api_failure(api_name)
+                if status_code == 503 and response is not None:
+                    app_state.rate_limits.apply_retry_after(api_name, response.headers.get("Retry-After"))
+                if attempt < config.MAX_RETRIES - 1:
+                    retry_count += 1
+                    wait_time = 2 ** attempt
+                    _log(f"{wait_time}秒后重试...", api_name)
+                    time.sleep(wait_time)
+                continue
             else:
-                break
+                # 其他 4xx（如 404 模型不存在）：临时拉黑后立即切换
+                mark_api_failure(api_name)
+                app_state.mark_api_failed_temporarily(api_name)
+
+            if attempt < config.MAX_RETRIES - 1:
+                retry_count += 1
+                _log(f"立即尝试下一个 API...", api_name)
 
         except FormatError as e:
             # 格式错误：快速切换到下一个 API，不等待
             last_error = e
             _log(f"格式错误 - 快速切换到下一个 API: {str(e)}", api_name)
             _log_upstream_error(api_name, "FORMAT_ERROR", str(e)[:80])
+            app_state.record_failover(api_name, "format_error")
             mark_api_failure(api_name)
 
             if attempt < config.MAX_RETRIES - 1:
@@ -1287,28 +1859,69 @@ def start_file_watcher():
     observer.start()
     return observer
 
+def restore_state_snapshot():
+    """从缓存目录恢复上游状态快照，返回可跳过启动探测的 API"""
+    if config.STATE_SNAPSHOT_INTERVAL <= 0:
+        return []
+    snapshot = snapshot_store.load(config.STATE_SNAPSHOT_MAX_AGE)
+    if not snapshot:
+        return []
+    trusted = app_state.restore_snapshot(snapshot, config.STATE_SNAPSHOT_TRUST_MINUTES * 60)
+    print(f"[快照] 已恢复上游状态 ({len(snapshot.get('apis', {}))} 个API), 跳过探测: {trusted}")
+    print(f"[权重] 恢复后权重: {app_state.get_all_weights()}")
+    return trusted
+
+def start_snapshot_writer():
+    """启动定期快照，进程退出时再保存一次"""
+    if config.STATE_SNAPSHOT_INTERVAL <= 0:
+        return None
+    writer = SnapshotWriter(snapshot_store, app_state.export_snapshot, config.STATE_SNAPSHOT_INTERVAL)
+    writer.start()
+    atexit.register(writer.stop)
+    install_shutdown_handlers(writer)
+    return writer
+
+def install_shutdown_handlers(writer):
+    """收到 SIGTERM/SIGINT 时先保存最后一次快照再退出
+
+    守护进程用 terminate()（SIGTERM）停止代理，默认处理会直接结束进程，atexit 不会执行
+    """
+    def handle_shutdown(signum, frame):
+        print(f"\n[停止] 收到信号 {signum}，保存状态快照后退出")
+        writer.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, handle_shutdown)
+
 def main():
     """主函数"""
     load_env()
     load_api_configs()
-    test_all_apis_startup()
+    trusted_apis = restore_state_snapshot()
+    test_all_apis_startup(trusted_apis)
+    start_snapshot_writer()
 
     observer = start_file_watcher()
 
-    if is_port_in_use(config.PORT):
+    # 由守护进程管理时端口已由守护进程监听，不再检查占用
+    if not has_inherited_socket() and is_port_in_use(config.PORT):
         print(f"[错误] 端口 {config.PORT} 已被占用")
         sys.exit(1)
 
     print(f"[启动] 多Free API代理服务启动在端口 {config.PORT}")
     print(f"[启动] 可用API: {len(app_state.get_available_apis())}/{len(app_state.get_all_apis())}")
 
+    # 由守护进程管理时 serve_app 接管 SIGTERM：停止接受连接、等待进行中的请求后返回，快照由 atexit 保存
     try:
-        app.run(host=config.HOST, port=config.PORT, debug=False, threaded=True)
-    except KeyboardInterrupt:
+        serve_app(app, config.HOST, config.PORT)
+    except (KeyboardInterrupt, SystemExit):
         print("\n[停止] 服务正在停止...")
-        observer.stop()
-        observer.join()
-        print("[停止] 服务已停止")
+    observer.stop()
+    observer.join()
+    print("[停止] 服务已停止")
 
 if __name__ == "__main__":
     main()
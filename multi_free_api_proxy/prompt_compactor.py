@@ -0,0 +1,188 @@
+"""
+对话历史压缩
+多轮对话客户端每轮都会重发完整历史，超长时在发送前裁剪中间部分：
+保留开头的 system 消息、第一条 user 消息和最近若干条消息，
+省略的部分用一条说明合并进 system 消息；结果按历史内容哈希缓存
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from token_estimator import TokenEstimator, message_hash, TOKENS_REPLY_PRIMING
+
+OMITTED_NOTE = "[上下文压缩] 为适应上下文窗口，已省略中间 {count} 条历史消息。"
+TRUNCATED_MARK = "\n...[已截断 {chars} 字符]...\n"
+
+
+def _history_hash(messages: List[Dict]) -> str:
+    """按顺序串联各消息哈希，得到整段历史的哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        digest.update(message_hash(message).encode("ascii"))
+    return digest.hexdigest()
+
+
+def _message_bytes(messages: List[Dict]) -> int:
+    return len(json.dumps(messages, ensure_ascii=False).encode("utf-8"))
+
+
+class PromptCompactor:
+    """按 token 预算压缩对话历史（线程安全）"""
+
+    def __init__(self, estimator: TokenEstimator, keep_recent: int = 6, cache_size: int = 256):
+        self.estimator = estimator
+        self.keep_recent = keep_recent
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "compacted": 0,
+            "cache_hits": 0,
+            "tokens_saved": 0,
+            "bytes_saved": 0,
+            "messages_dropped": 0,
+        }
+
+    def _protected_indexes(self, messages: List[Dict]) -> Tuple[int, int]:
+        """返回 (头部保留结束位置, 尾部保留起始位置)，两者之间为可省略的中间部分"""
+        head_end = 0
+        while head_end < len(messages) and messages[head_end].get("role") == "system":
+            head_end += 1
+        # 第一条 user 消息通常是任务描述，一并保留
+        if head_end < len(messages) and messages[head_end].get("role") == "user":
+            head_end += 1
+
+        tail_start = max(head_end, len(messages) - self.keep_recent)
+        # 不要从 tool 结果开始保留（对应的 tool_calls 已被省略）
+        while tail_start < len(messages) - 1 and messages[tail_start].get("role") == "tool":
+            tail_start += 1
+        return head_end, tail_start
+
+    def minimum_tokens(self, messages: Optional[List[Dict]]) -> int:
+        """压缩后至少需要的 token 数（仅保留受保护的头尾消息）"""
+        if not messages:
+            return 0
+        head_end, tail_start = self._protected_indexes(messages)
+        kept = messages[:head_end] + messages[tail_start:]
+        return self.estimator.estimate_messages(kept)
+
+    def _with_note(self, head: List[Dict], dropped: int) -> List[Dict]:
+        """把省略说明合并到开头的 system 消息（兼容不允许中间 system 消息的上游）"""
+        note = OMITTED_NOTE.format(count=dropped)
+        head = list(head)
+        if head and head[0].get("role") == "system" and isinstance(head[0].get("content"), str):
+            head[0] = dict(head[0], content=f"{head[0]['content']}\n\n{note}")
+        else:
+            head.insert(0, {"role": "system", "content": note})
+        return head
+
+    def _truncate_largest(self, messages: List[Dict], excess_tokens: int) -> List[Dict]:
+        """丢弃中间消息后仍超预算时，截断最长的文本消息中段（不截断最后一条消息）"""
+        candidates = [
+            i for i, message in enumerate(messages[:-1])
+            if isinstance(message.get("content"), str)
+        ]
+        if not candidates:
+            return messages
+
+        index = max(candidates, key=lambda i: len(messages[i]["content"]))
+        content = messages[index]["content"]
+        # 按约 4 字符 / token 反推需截掉的字符数，多截 10% 留余量
+        cut_chars = min(len(content) - 200, int(excess_tokens * 4 * 1.1))
+        if cut_chars <= 0:
+            return messages
+
+        keep = (len(content) - cut_chars) // 2
+        truncated = content[:keep] + TRUNCATED_MARK.format(chars=cut_chars) + content[len(content) - keep:]
+        messages = list(messages)
+        messages[index] = dict(messages[index], content=truncated)
+        return messages
+
+    def _compact(self, messages: List[Dict], budget: int) -> Tuple[List[Dict], int]:
+        head_end, tail_start = self._protected_indexes(messages)
+        head = messages[:head_end]
+        middle = messages[head_end:tail_start]
+        tail = messages[tail_start:]
+
+        estimate = self.estimator.estimate_message
+        fixed_tokens = sum(estimate(m) for m in head + tail) + TOKENS_REPLY_PRIMING
+        note_tokens = estimate({"role": "system", "content": OMITTED_NOTE.format(count=len(middle))})
+
+        # 从最新往最旧保留中间消息，直到预算用完
+        kept_tokens = fixed_tokens + note_tokens
+        cut = len(middle)
+        while cut > 0 and kept_tokens + estimate(middle[cut - 1]) <= budget:
+            cut -= 1
+            kept_tokens += estimate(middle[cut])
+        # 保留部分不要以 tool 结果开头
+        while cut < len(middle) and middle[cut].get("role") == "tool":
+            cut += 1
+
+        dropped = cut
+        if dropped:
+            compacted = self._with_note(head, dropped) + middle[cut:] + tail
+        else:
+            compacted = messages
+        total = self.estimator.estimate_messages(compacted)
+        if total > budget:
+            compacted = self._truncate_largest(compacted, total - budget)
+        return compacted, dropped
+
+    def compact(self, messages: Optional[List[Dict]], budget: int) -> Tuple[List[Dict], Dict]:
+        """按 token 预算压缩历史，返回 (消息列表, 本次统计)"""
+        result = {"compacted": False, "original_tokens": 0, "compacted_tokens": 0,
+                  "tokens_saved": 0, "bytes_saved": 0, "messages_dropped": 0, "cache_hit": False}
+        if not messages or budget <= 0:
+            return messages, result
+
+        original_tokens = self.estimator.estimate_messages(messages)
+        result["original_tokens"] = original_tokens
+        result["compacted_tokens"] = original_tokens
+        with self._lock:
+            self.stats["requests"] += 1
+        if original_tokens <= budget:
+            return messages, result
+
+        key = (_history_hash(messages), budget)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+
+        if cached is not None:
+            changed, compacted, dropped, compacted_tokens, bytes_saved = cached
+            result["cache_hit"] = True
+            if not changed:
+                compacted = messages
+        else:
+            compacted, dropped = self._compact(messages, budget)
+            changed = compacted is not messages
+            compacted_tokens = self.estimator.estimate_messages(compacted)
+            bytes_saved = _message_bytes(messages) - _message_bytes(compacted)
+            with self._lock:
+                self._cache[key] = (changed, compacted, dropped, compacted_tokens, bytes_saved)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        result.update({
+            "compacted": changed,
+            "compacted_tokens": compacted_tokens,
+            "tokens_saved": original_tokens - compacted_tokens,
+            "bytes_saved": bytes_saved,
+            "messages_dropped": dropped,
+        })
+        if result["compacted"]:
+            with self._lock:
+                self.stats["compacted"] += 1
+                self.stats["tokens_saved"] += result["tokens_saved"]
+                self.stats["bytes_saved"] += bytes_saved
+                self.stats["messages_dropped"] += dropped
+        return compacted, result
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, cache_entries=len(self._cache), keep_recent=self.keep_recent)
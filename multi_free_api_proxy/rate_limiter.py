@@ -0,0 +1,281 @@
+"""
+上游限流管理
+按各上游 config.py 中声明的 LIMIT（rpm / tpm / daily）在发送前做令牌桶限流，
+并记录上游 429/503 返回的 Retry-After 冷却时间
+"""
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """解析 Retry-After 头，返回需要等待的秒数
+
+    支持两种格式：秒数（"30"）和 HTTP 日期（"Wed, 21 Oct 2015 07:28:00 GMT"）
+    """
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒补充 refill_rate 个令牌"""
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+            self.updated_at = now
+
+    def available(self, now: Optional[float] = None) -> float:
+        """当前可用令牌数"""
+        self._refill(now if now is not None else time.monotonic())
+        return self.tokens
+
+    def can_consume(self, amount: float, now: Optional[float] = None) -> bool:
+        """检查是否有足够令牌（单次需求超过容量时按容量计算，避免永远无法通过）"""
+        return self.available(now) >= min(amount, self.capacity)
+
+    def consume(self, amount: float, now: Optional[float] = None) -> bool:
+        """尝试消耗令牌，成功返回 True"""
+        if not self.can_consume(amount, now):
+            return False
+        self.tokens -= min(amount, self.capacity)
+        return True
+
+    def refund(self, amount: float):
+        """归还令牌（预留多于实际使用时）"""
+        self.tokens = min(self.capacity, self.tokens + max(0.0, amount))
+
+    def wait_time(self, amount: float, now: Optional[float] = None) -> float:
+        """距离可以消耗 amount 个令牌还需等待的秒数"""
+        missing = min(amount, self.capacity) - self.available(now)
+        if missing <= 0:
+            return 0.0
+        if self.refill_rate <= 0:
+            return float("inf")
+        return missing / self.refill_rate
+
+
+class UpstreamRateLimiter:
+    """单个上游的限流状态"""
+
+    def __init__(self, api_name: str, limit: Optional[Dict] = None):
+        limit = limit or {}
+        self.api_name = api_name
+        self.rpm = int(limit.get("rpm") or 0)
+        self.tpm = int(limit.get("tpm") or 0)
+        self.daily = int(limit.get("daily") or 0)
+
+        self.request_bucket = TokenBucket(self.rpm, self.rpm / 60.0) if self.rpm > 0 else None
+        self.token_bucket = TokenBucket(self.tpm, self.tpm / 60.0) if self.tpm > 0 else None
+
+        self.daily_date = datetime.now().strftime("%Y%m%d")
+        self.daily_count = 0
+        self.cooldown_until = 0.0
+        self.throttled_count = 0
+
+    def _roll_daily(self):
+        today = datetime.now().strftime("%Y%m%d")
+        if today != self.daily_date:
+            self.daily_date = today
+            self.daily_count = 0
+
+    def cooldown_remaining(self, now: Optional[float] = None) -> float:
+        """Retry-After 冷却剩余秒数"""
+        now = now if now is not None else time.monotonic()
+        return max(0.0, self.cooldown_until - now)
+
+    def can_dispatch(self, tokens: int = 0) -> bool:
+        """检查当前是否可以向该上游发送请求（不消耗令牌）"""
+        now = time.monotonic()
+        if self.cooldown_remaining(now) > 0:
+            return False
+
+        self._roll_daily()
+        if self.daily and self.daily_count >= self.daily:
+            return False
+        if self.request_bucket and not self.request_bucket.can_consume(1, now):
+            return False
+        if self.token_bucket and tokens and not self.token_bucket.can_consume(tokens, now):
+            return False
+        return True
+
+    def acquire(self, tokens: int = 0) -> bool:
+        """发送前获取配额，成功返回 True"""
+        if not self.can_dispatch(tokens):
+            self.throttled_count += 1
+            return False
+
+        now = time.monotonic()
+        if self.request_bucket:
+            self.request_bucket.consume(1, now)
+        if self.token_bucket and tokens:
+            self.token_bucket.consume(tokens, now)
+        self.daily_count += 1
+        return True
+
+    def reconcile(self, reserved_tokens: int, actual_tokens: int):
+        """按上游返回的实际 usage 修正 TPM 预留"""
+        if self.token_bucket and reserved_tokens > actual_tokens >= 0:
+            self.token_bucket.refund(reserved_tokens - actual_tokens)
+
+    def set_cooldown(self, seconds: float):
+        """设置冷却时间（不会缩短已有的冷却）"""
+        until = time.monotonic() + max(0.0, seconds)
+        if until > self.cooldown_until:
+            self.cooldown_until = until
+
+    def wait_time(self, tokens: int = 0) -> float:
+        """距离该上游可再次发送还需等待的秒数"""
+        now = time.monotonic()
+        waits = [self.cooldown_remaining(now)]
+        if self.request_bucket:
+            waits.append(self.request_bucket.wait_time(1, now))
+        if self.token_bucket and tokens:
+            waits.append(self.token_bucket.wait_time(tokens, now))
+        self._roll_daily()
+        if self.daily and self.daily_count >= self.daily:
+            tomorrow = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp() + 86400
+            waits.append(max(0.0, tomorrow - time.time()))
+        return max(waits)
+
+    def export_state(self) -> Dict:
+        """导出可跨进程恢复的状态（冷却时间转换为墙上时间）"""
+        now = time.monotonic()
+        self._roll_daily()
+        cooldown = self.cooldown_remaining(now)
+        return {
+            "daily_date": self.daily_date,
+            "daily_count": self.daily_count,
+            "cooldown_until": time.time() + cooldown if cooldown else 0,
+            "requests_available": self.request_bucket.available(now) if self.request_bucket else None,
+            "tokens_available": self.token_bucket.available(now) if self.token_bucket else None,
+            "saved_at": time.time(),
+        }
+
+    def restore_state(self, state: Dict):
+        """从快照恢复每日用量、冷却和令牌桶余量（令牌按离线时长补充）"""
+        now = time.monotonic()
+        if state.get("daily_date") == datetime.now().strftime("%Y%m%d"):
+            self.daily_date = state["daily_date"]
+            self.daily_count = int(state.get("daily_count") or 0)
+
+        cooldown_until = float(state.get("cooldown_until") or 0)
+        if cooldown_until > time.time():
+            self.set_cooldown(cooldown_until - time.time())
+
+        offline = max(0.0, time.time() - float(state.get("saved_at") or 0))
+        for bucket, key in ((self.request_bucket, "requests_available"), (self.token_bucket, "tokens_available")):
+            if bucket and state.get(key) is not None:
+                bucket.tokens = min(bucket.capacity, float(state[key]) + offline * bucket.refill_rate)
+                bucket.updated_at = now
+
+    def get_status(self) -> Dict:
+        """获取限流状态（用于调试接口）"""
+        now = time.monotonic()
+        self._roll_daily()
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "daily": self.daily,
+            "requests_available": round(self.request_bucket.available(now), 2) if self.request_bucket else None,
+            "tokens_available": round(self.token_bucket.available(now), 2) if self.token_bucket else None,
+            "daily_used": self.daily_count,
+            "cooldown_remaining": round(self.cooldown_remaining(now), 2),
+            "throttled_count": self.throttled_count,
+        }
+
+
+class RateLimitRegistry:
+    """所有上游的限流器集合（线程安全）"""
+
+    def __init__(self):
+        self._limiters: Dict[str, UpstreamRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, api_name: str, limit: Optional[Dict]):
+        """根据上游配置创建/替换限流器"""
+        with self._lock:
+            self._limiters[api_name] = UpstreamRateLimiter(api_name, limit)
+
+    def can_dispatch(self, api_name: str, tokens: int = 0) -> bool:
+        with self._lock:
+            limiter = self._limiters.get(api_name)
+            return limiter.can_dispatch(tokens) if limiter else True
+
+    def acquire(self, api_name: str, tokens: int = 0) -> bool:
+        with self._lock:
+            limiter = self._limiters.get(api_name)
+            return limiter.acquire(tokens) if limiter else True
+
+    def reconcile(self, api_name: str, reserved_tokens: int, actual_tokens: int):
+        with self._lock:
+            limiter = self._limiters.get(api_name)
+            if limiter:
+                limiter.reconcile(reserved_tokens, actual_tokens)
+
+    def apply_retry_after(self, api_name: str, retry_after, default_seconds: float = 0) -> float:
+        """按 Retry-After 头设置冷却，返回实际冷却秒数"""
+        seconds = parse_retry_after(retry_after)
+        if seconds is None:
+            seconds = default_seconds
+        if seconds <= 0:
+            return 0.0
+        with self._lock:
+            limiter = self._limiters.get(api_name)
+            if limiter is None:
+                limiter = UpstreamRateLimiter(api_name)
+                self._limiters[api_name] = limiter
+            limiter.set_cooldown(seconds)
+        print(f"[限流] {api_name} 进入冷却 {seconds:.1f} 秒")
+        return seconds
+
+    def min_wait_time(self, api_names: List[str], tokens: int = 0) -> float:
+        """给定上游中最早可用的等待秒数"""
+        with self._lock:
+            waits = [
+                self._limiters[name].wait_time(tokens) if name in self._limiters else 0.0
+                for name in api_names
+            ]
+        return min(waits) if waits else 0.0
+
+    def export_all(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: limiter.export_state() for name, limiter in self._limiters.items()}
+
+    def restore_all(self, states: Dict[str, Dict]):
+        """恢复已配置上游的限流状态（未配置的上游忽略）"""
+        with self._lock:
+            for name, state in (states or {}).items():
+                limiter = self._limiters.get(name)
+                if limiter and isinstance(state, dict):
+                    limiter.restore_state(state)
+
+    def get_all_status(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: limiter.get_status() for name, limiter in self._limiters.items()}
@@ -0,0 +1,182 @@
+"""
+请求体读取与增量解析
+按块读取请求体并限制总字节数，边读边解析顶层 JSON 对象，
+messages 数组逐条解析和校验，超限时尽早拒绝，避免把超大请求整体缓冲后再解析
+"""
+import codecs
+import json
+from typing import Dict, Optional
+
+from errors import RequestTooLargeError, InvalidRequestError
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+
+
+class StreamingJSONBodyParser:
+    """增量解析 chat completions 请求体
+
+    stream: 可 read(n) 的二进制流（如 flask.request.stream）
+    max_bytes: 允许读取的最大字节数
+    max_messages: messages 数组允许的最大条数（0 表示不限制）
+    """
+
+    def __init__(self, stream, max_bytes: int, max_messages: int = 0, chunk_size: int = 64 * 1024):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.chunk_size = chunk_size
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self.bytes_read = 0
+
+    # ==================== 缓冲区 ====================
+
+    def _fill(self, min_chars: int = 1) -> bool:
+        """继续读取，直到缓冲区新增至少 min_chars 个字符或到达流末尾"""
+        if self._eof:
+            return False
+
+        # 丢弃已解析的部分，保证缓冲区只保留未消费内容
+        if self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+        target = len(self._buffer) + min_chars
+        while len(self._buffer) < target:
+            chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self._buffer += self._decoder.decode(b"", final=True)
+                self._eof = True
+                break
+
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_bytes:
+                raise RequestTooLargeError(
+                    f"Request body exceeds limit of {self.max_bytes} bytes"
+                )
+            try:
+                self._buffer += self._decoder.decode(chunk)
+            except UnicodeDecodeError as e:
+                raise InvalidRequestError(f"Request body is not valid UTF-8: {e}")
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def _peek(self) -> str:
+        self._skip_whitespace()
+        if self._pos >= len(self._buffer):
+            raise InvalidRequestError("Unexpected end of request body")
+        return self._buffer[self._pos]
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise InvalidRequestError(
+                f"Invalid JSON: expected '{char}' at byte ~{self.bytes_read - len(self._buffer) + self._pos}"
+            )
+        self._pos += 1
+
+    def _decode_value(self):
+        """解析下一个 JSON 值；数据不完整时按倍数继续读取（摊还 O(n)）"""
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._eof:
+                    raise InvalidRequestError(f"Invalid JSON: {e.msg}")
+                self._fill(max(self.chunk_size, len(self._buffer) - self._pos))
+                continue
+
+            # 数字可能在块边界被截断（如 "0." + "5"），需确认后面紧跟分隔符
+            if not self._eof and (end >= len(self._buffer) or self._buffer[end] not in _DELIMITERS):
+                self._fill(self.chunk_size)
+                continue
+
+            self._pos = end
+            return value
+
+    # ==================== 解析 ====================
+
+    def _parse_messages(self) -> list:
+        self._expect("[")
+        messages = []
+        if self._peek() == "]":
+            self._pos += 1
+            return messages
+
+        while True:
+            message = self._decode_value()
+            if not isinstance(message, dict) or "role" not in message:
+                raise InvalidRequestError(f"messages[{len(messages)}] must be an object with a role")
+
+            messages.append(message)
+            if self.max_messages and len(messages) > self.max_messages:
+                raise RequestTooLargeError(
+                    f"Too many messages: limit is {self.max_messages}"
+                )
+
+            char = self._peek()
+            self._pos += 1
+            if char == "]":
+                return messages
+            if char != ",":
+                raise InvalidRequestError("Invalid JSON: expected ',' or ']' in messages")
+
+    def parse(self) -> Dict:
+        """解析整个请求体，返回顶层对象"""
+        self._fill(1)
+        self._expect("{")
+        result = {}
+
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                if self._peek() != '"':
+                    raise InvalidRequestError("Invalid JSON: expected property name")
+                key = self._decode_value()
+                self._expect(":")
+
+                if key == "messages":
+                    # 后续代码按数组下标访问 messages，其他类型直接拒绝
+                    if self._peek() != "[":
+                        raise InvalidRequestError("messages must be an array")
+                    result[key] = self._parse_messages()
+                else:
+                    result[key] = self._decode_value()
+
+                char = self._peek()
+                self._pos += 1
+                if char == "}":
+                    break
+                if char != ",":
+                    raise InvalidRequestError("Invalid JSON: expected ',' or '}'")
+
+        self._skip_whitespace()
+        if self._pos < len(self._buffer):
+            raise InvalidRequestError("Invalid JSON: unexpected data after request object")
+        return result
+
+
+def check_content_length(content_length: Optional[int], max_bytes: int):
+    """按 Content-Length 头快速拒绝超大请求（不读取请求体）"""
+    if content_length is not None and content_length > max_bytes:
+        raise RequestTooLargeError(
+            f"Request body of {content_length} bytes exceeds limit of {max_bytes} bytes"
+        )
+
+
+def parse_chat_request(stream, content_length: Optional[int], max_bytes: int, max_messages: int = 0) -> Dict:
+    """读取并增量解析 chat completions 请求体"""
+    check_content_length(content_length, max_bytes)
+    return StreamingJSONBodyParser(stream, max_bytes, max_messages).parse()
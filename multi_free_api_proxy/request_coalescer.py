@@ -0,0 +1,123 @@
+"""
+相同请求合并（single-flight）
+规范化后完全相同的请求同时在途时只向上游发送一次，结果分发给所有等待者；
+成功的结果在完成后保留一个短窗口（COALESCE_WINDOW_SECONDS），窗口内到达的重复请求直接复用。
+失败不保留，重复请求会重新向上游发送。
+只合并结果确定的请求（temperature 为 0 或指定了 seed），否则不同客户端会拿到同一个采样结果
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from errors import TimeoutError
+
+# 不影响上游结果的字段，不参与规范化
+IGNORED_FIELDS = ("stream", "user")
+
+
+def canonical_key(data: Dict) -> str:
+    """按字段排序序列化请求体后取哈希，字段顺序和空白不同的请求视为相同"""
+    canonical = {k: v for k, v in data.items() if k not in IGNORED_FIELDS}
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Flight:
+    """一次在途的上游调用"""
+
+    __slots__ = ("key", "done", "result", "error", "completed_at", "followers")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.completed_at = None
+        self.followers = 0
+
+    def wait(self, timeout: float) -> Any:
+        """等待领头请求完成，返回相同的结果或抛出相同的异常"""
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"Coalesced request waited more than {timeout:.0f}s")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class RequestCoalescer:
+    """相同请求合并器（线程安全）"""
+
+    def __init__(self, window_seconds: float = 1.0, max_wait: float = 300, default_temperature: float = 0.7):
+        self.window_seconds = window_seconds
+        self.max_wait = max_wait
+        self.default_temperature = default_temperature
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "leaders": 0,        # 实际发往上游的请求
+            "coalesced": 0,      # 合并到在途请求的重复请求
+            "window_hits": 0,    # 在完成后窗口内复用结果的重复请求
+            "shared_errors": 0,  # 随领头请求一起失败的重复请求
+            "not_deterministic": 0,  # temperature > 0 且未指定 seed，不参与合并
+        }
+
+    def eligible(self, data: Dict) -> bool:
+        """temperature 为 0 或指定了 seed 的请求才参与合并"""
+        if data.get("seed") is not None:
+            return True
+        try:
+            temperature = float(data.get("temperature", self.default_temperature))
+        except (TypeError, ValueError):
+            temperature = self.default_temperature
+        if temperature == 0:
+            return True
+        with self._lock:
+            self.stats["not_deterministic"] += 1
+        return False
+
+    def _purge_expired(self, now: float):
+        expired = [
+            key for key, flight in self._flights.items()
+            if flight.completed_at is not None and now - flight.completed_at > self.window_seconds
+        ]
+        for key in expired:
+            del self._flights[key]
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """加入相同请求的调用，返回 (flight, 是否为领头请求)；领头请求负责调用 complete()"""
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.stats["window_hits" if flight.done.is_set() else "coalesced"] += 1
+                return flight, False
+
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.stats["leaders"] += 1
+            return flight, True
+
+    def complete(self, flight: Flight, result: Any = None, error: Optional[BaseException] = None):
+        """记录领头请求的结果并唤醒等待者"""
+        flight.result = result
+        flight.error = error
+        flight.completed_at = time.time()
+        with self._lock:
+            if error is not None:
+                self.stats["shared_errors"] += flight.followers
+            # 失败的结果和不需要窗口时立即移除
+            if (error is not None or self.window_seconds <= 0) and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.done.set()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = sum(1 for f in self._flights.values() if not f.done.is_set())
+            stats["window_entries"] = len(self._flights) - stats["in_flight"]
+        stats["window_seconds"] = self.window_seconds
+        return stats
@@ -0,0 +1,83 @@
+"""
+响应格式归一化
+根据各上游 config.py 中的 RESPONSE_FORMAT，在加载配置时编译出归一化器，
+对上游响应单次遍历 choices，按字段优先级/合并/回退规则生成统一的 content，
+并去除配置的多余字段
+"""
+from typing import Dict, Optional
+
+DEFAULT_RESPONSE_FORMAT = {
+    "content_fields": ["content"],
+    "merge_fields": False,
+    "use_reasoning_as_fallback": False
+}
+
+REASONING_FIELD = "reasoning_content"
+
+
+class ResponseNormalizer:
+    """按 RESPONSE_FORMAT 编译的响应归一化器
+
+    RESPONSE_FORMAT 字段：
+    - content_fields: 内容字段优先级列表
+    - merge_fields: 是否合并所有非空内容字段
+    - field_separator: 合并时的分隔符
+    - use_reasoning_as_fallback: content 为空时使用 reasoning_content
+    - strip_fields: 归一化后从 message 中移除的字段（可选）
+    """
+
+    def __init__(self, response_format: Optional[Dict] = None):
+        response_format = response_format or DEFAULT_RESPONSE_FORMAT
+        self.content_fields = tuple(response_format.get("content_fields") or ["content"])
+        self.merge_fields = bool(response_format.get("merge_fields", False))
+        self.separator = response_format.get("field_separator", "\n\n")
+        self.use_reasoning_as_fallback = bool(response_format.get("use_reasoning_as_fallback", False))
+        self.strip_fields = frozenset(response_format.get("strip_fields") or ())
+
+        # 只有默认格式（仅 content、无回退、无剔除）时可以跳过处理
+        self.is_passthrough = (
+            self.content_fields == ("content",)
+            and not self.use_reasoning_as_fallback
+            and not self.strip_fields
+        )
+
+    def _extract_content(self, message: Dict) -> str:
+        """按配置从 message 中提取内容"""
+        if self.merge_fields:
+            parts = [message[f] for f in self.content_fields if isinstance(message.get(f), str) and message[f]]
+            content = self.separator.join(parts)
+        else:
+            content = ""
+            for field in self.content_fields:
+                value = message.get(field)
+                if isinstance(value, str) and value:
+                    content = value
+                    break
+
+        if not content and self.use_reasoning_as_fallback:
+            reasoning = message.get(REASONING_FIELD)
+            if isinstance(reasoning, str):
+                content = reasoning
+        return content
+
+    def _normalize_message(self, message: Dict):
+        content = self._extract_content(message)
+        if content or message.get("content") is None:
+            message["content"] = content
+        for field in self.strip_fields:
+            message.pop(field, None)
+
+    def normalize(self, result: Dict) -> Dict:
+        """归一化响应（原地修改并返回）"""
+        if self.is_passthrough:
+            return result
+        for choice in result.get("choices") or ():
+            message = choice.get("message")
+            if isinstance(message, dict):
+                self._normalize_message(message)
+        return result
+
+
+def compile_normalizer(response_format: Optional[Dict]) -> ResponseNormalizer:
+    """加载配置时编译归一化器"""
+    return ResponseNormalizer(response_format)
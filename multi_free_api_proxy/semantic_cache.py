@@ -0,0 +1,271 @@
+"""
+近似重复请求缓存（可选，完全离线）
+同一模板、只有空白或列表编号不同的提示词复用之前的回复：
+- 精确键：只合并空白、统一小写的原文，不改动数字（"4 * 9" 和 "17 * 23" 是不同的请求）
+- 指纹：再把行首的列表编号（"1." "2)" "3、"）统一为 0 后，按字符 4-gram 计算 64 位 SimHash
+- 近似命中要求正文中的数字（列表编号除外）完全相同，数字不同的提示词答案往往也不同
+- 索引：把 SimHash 切成 max_distance + 1 段，汉明距离不超过 max_distance 的两个指纹至少有一段完全相同，
+  按段查表即可找到全部候选，不需要遍历整个缓存
+- 只缓存低温度（temperature <= SEMANTIC_CACHE_MAX_TEMPERATURE）、n <= 1 的请求；
+  除 messages 外的参数（模型、max_tokens、tools 等）必须完全相同
+- LRU + TTL 淘汰；统计命中距离分布、近似命中的词集合 Jaccard 相似度，
+  以及命中后客户端用 Cache-Control: no-cache 重新请求的次数（回复不合适的信号）
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from token_estimator import _message_text
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 4
+# 参与范围键的字段之外不影响缓存的字段
+IGNORED_FIELDS = ("messages", "stream", "user")
+
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+_WORDS = re.compile(r"\w+")
+# 行首的列表编号，如 "1." "2)" "3、"（"3.14" 这样的小数不算）
+_LIST_NUMBER = re.compile(r"^([ \t]*)\d{1,3}[.)、](?!\d)", re.MULTILINE)
+
+
+def _conversation_text(messages: List[Dict]) -> str:
+    """按角色逐条拼接对话并统一小写，保留换行（识别列表编号需要行首）"""
+    parts = []
+    for message in messages:
+        text = _message_text(message) if isinstance(message, dict) else str(message)
+        parts.append(f"{message.get('role', '') if isinstance(message, dict) else ''}:\n{text}")
+    return "\n".join(parts).lower()
+
+
+def normalize_prompt(messages: List[Dict]) -> str:
+    """精确键使用的文本：只合并空白、统一小写，数字原样保留"""
+    return _WHITESPACE.sub(" ", _conversation_text(messages)).strip()
+
+
+def prompt_features(messages: List[Dict]) -> Tuple[str, str, Tuple[str, ...]]:
+    """返回 (精确键文本, 指纹文本, 正文数字)：指纹文本把列表编号统一为 0，正文数字不含列表编号"""
+    raw = _conversation_text(messages)
+    text = _WHITESPACE.sub(" ", raw).strip()
+    folded = _WHITESPACE.sub(" ", _LIST_NUMBER.sub(r"\g<1>0.", raw)).strip()
+    numbers = tuple(_DIGITS.findall(_LIST_NUMBER.sub(r"\g<1>", raw)))
+    return text, folded, numbers
+
+
+def simhash(text: str) -> int:
+    """字符 4-gram 的 64 位 SimHash（对 CJK 文本同样有效，不需要分词）"""
+    if len(text) <= SHINGLE_SIZE:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)]
+
+    values = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for shingle in set(shingles)
+    ]
+    # 每一位上超过半数的 shingle 哈希为 1 时，指纹该位为 1
+    half = len(values) / 2
+    fingerprint = 0
+    for bit in range(SIMHASH_BITS):
+        if sum((value >> bit) & 1 for value in values) > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def _word_jaccard(a: str, b: str) -> float:
+    words_a, words_b = set(_WORDS.findall(a)), set(_WORDS.findall(b))
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+class _Entry:
+    __slots__ = ("key", "scope", "fingerprint", "text", "numbers", "response", "created_at", "hits")
+
+    def __init__(self, key, scope, fingerprint, text, numbers, response):
+        self.key = key
+        self.scope = scope
+        self.fingerprint = fingerprint
+        self.text = text
+        self.numbers = numbers
+        self.response = response
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class SemanticCache:
+    """SimHash 近似重复缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = 2000, ttl_seconds: float = 3600, max_distance: int = 3,
+                 max_temperature: float = 0.3, default_temperature: float = 0.7):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.max_temperature = max_temperature
+        self.default_temperature = default_temperature
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._index: Dict[Tuple[str, int, int], set] = {}
+        self._recent_hits: "OrderedDict[str, float]" = OrderedDict()
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+        self.stats = {
+            "lookups": 0, "hits": 0, "exact_hits": 0, "misses": 0, "ineligible": 0, "stores": 0,
+            "evictions_lru": 0, "evictions_ttl": 0, "bypass_after_hit": 0,
+            "rejected_numbers": 0,  # 指纹相近但正文数字不同，不作为命中
+            "near_hit_jaccard_sum": 0.0,
+        }
+        self.distance_histogram = [0] * (max_distance + 1)
+
+    def eligible(self, data: Dict) -> bool:
+        """只缓存低温度、单个候选的请求"""
+        try:
+            temperature = float(data.get("temperature", self.default_temperature))
+            n = int(data.get("n", 1) or 1)
+        except (TypeError, ValueError):
+            return False
+        return temperature <= self.max_temperature and n <= 1 and bool(data.get("messages"))
+
+    @staticmethod
+    def _scope(data: Dict) -> str:
+        params = {k: v for k, v in data.items() if k not in IGNORED_FIELDS}
+        raw = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+
+    def _bands(self, fingerprint: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def _fingerprint(self, data: Dict) -> Tuple[str, str, int, str, Tuple[str, ...]]:
+        text, folded, numbers = prompt_features(data.get("messages") or [])
+        scope = self._scope(data)
+        fingerprint = simhash(folded)
+        key = hashlib.blake2b(f"{scope}\n{text}".encode("utf-8"), digest_size=16).hexdigest()
+        return key, scope, fingerprint, text, numbers
+
+    def _remove(self, entry: _Entry):
+        self._entries.pop(entry.key, None)
+        for i, band in enumerate(self._bands(entry.fingerprint)):
+            bucket = self._index.get((entry.scope, i, band))
+            if bucket is not None:
+                bucket.discard(entry.key)
+                if not bucket:
+                    del self._index[(entry.scope, i, band)]
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        if now - entry.created_at <= self.ttl_seconds:
+            return False
+        self._remove(entry)
+        self.stats["evictions_ttl"] += 1
+        return True
+
+    def _sweep(self, now: float):
+        """定期清理过期条目（LRU 顺序与创建时间无关，需要整表扫描，所以每分钟最多一次）"""
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for entry in [e for e in self._entries.values() if now - e.created_at > self.ttl_seconds]:
+            self._expired(entry, now)
+
+    def lookup(self, data: Dict) -> Optional[Tuple[Dict, int]]:
+        """查找近似重复的缓存回复，返回 (response, 汉明距离) 或 None"""
+        if not self.eligible(data):
+            with self._lock:
+                self.stats["ineligible"] += 1
+            return None
+
+        key, scope, fingerprint, text, numbers = self._fingerprint(data)
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._sweep(now)
+
+            best, best_distance = self._entries.get(key), 0
+            if best is not None and self._expired(best, now):
+                best = None
+            if best is None:
+                candidates = set()
+                for i, band in enumerate(self._bands(fingerprint)):
+                    candidates |= self._index.get((scope, i, band), set())
+                best_distance = self.max_distance + 1
+                for candidate_key in candidates:
+                    entry = self._entries[candidate_key]
+                    if self._expired(entry, now):
+                        continue
+                    if entry.numbers != numbers:
+                        self.stats["rejected_numbers"] += 1
+                        continue
+                    distance = bin(entry.fingerprint ^ fingerprint).count("1")
+                    if distance < best_distance:
+                        best, best_distance = entry, distance
+                if best_distance > self.max_distance:
+                    best = None
+
+            if best is None:
+                self.stats["misses"] += 1
+                return None
+
+            best.hits += 1
+            self._entries.move_to_end(best.key)
+            self.stats["hits"] += 1
+            self.distance_histogram[best_distance] += 1
+            if best.key == key:
+                self.stats["exact_hits"] += 1
+            else:
+                self.stats["near_hit_jaccard_sum"] += _word_jaccard(text, best.text)
+
+            self._recent_hits[key] = now
+            self._recent_hits.move_to_end(key)
+            while len(self._recent_hits) > self.max_entries:
+                self._recent_hits.popitem(last=False)
+            return best.response, best_distance
+
+    def note_bypass(self, data: Dict):
+        """客户端带 no-cache 重新请求：若刚命中过缓存，说明命中的回复可能不合适"""
+        if not self.eligible(data):
+            return
+        key = self._fingerprint(data)[0]
+        with self._lock:
+            hit_at = self._recent_hits.pop(key, None)
+            if hit_at is not None and time.time() - hit_at < 300:
+                self.stats["bypass_after_hit"] += 1
+
+    def store(self, data: Dict, response: Dict):
+        if not self.eligible(data):
+            return
+        key, scope, fingerprint, text, numbers = self._fingerprint(data)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._remove(old)
+            entry = _Entry(key, scope, fingerprint, text, numbers, response)
+            self._entries[key] = entry
+            for i, band in enumerate(self._bands(fingerprint)):
+                self._index.setdefault((scope, i, band), set()).add(key)
+            self.stats["stores"] += 1
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries.values()))
+                self._remove(oldest)
+                self.stats["evictions_lru"] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["distance_histogram"] = {str(d): c for d, c in enumerate(self.distance_histogram)}
+        near_hits = stats["hits"] - stats["exact_hits"]
+        stats["avg_near_hit_jaccard"] = round(stats.pop("near_hit_jaccard_sum") / near_hits, 3) if near_hits else None
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats.update({
+            "max_distance": self.max_distance,
+            "max_temperature": self.max_temperature,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+        })
+        return stats
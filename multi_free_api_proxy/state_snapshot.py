@@ -0,0 +1,87 @@
+"""
+上游状态快照
+定期（及退出时）把权重、熔断状态、延迟 EWMA 和限流用量写入缓存目录，
+守护进程重启代理后在启动时读回，避免从默认权重和全量探测重新开始
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+
+class SnapshotStore:
+    """快照文件读写（原子替换，读取失败时视为没有快照）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.last_saved_at = None
+        self.last_error = None
+
+    def save(self, snapshot: Dict) -> bool:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.last_saved_at = time.time()
+            self.last_error = None
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            self.last_error = str(e)
+            print(f"[快照] 保存失败: {e}")
+            return False
+
+    def load(self, max_age: float) -> Optional[Dict]:
+        """读取快照，超过 max_age 秒的快照不再使用"""
+        if not self.path.exists():
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[快照] 读取失败，忽略: {e}")
+            return None
+
+        age = time.time() - float(snapshot.get("saved_at") or 0)
+        if age > max_age:
+            print(f"[快照] 快照已过期 ({age / 60:.0f} 分钟前)，忽略")
+            return None
+        return snapshot
+
+
+class SnapshotWriter:
+    """后台定期保存快照"""
+
+    def __init__(self, store: SnapshotStore, export: Callable[[], Dict], interval: float):
+        self.store = store
+        self.export = export
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="state-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.save_now()
+
+    def save_now(self) -> bool:
+        try:
+            return self.store.save(self.export())
+        except Exception as e:
+            print(f"[快照] 导出状态失败: {e}")
+            return False
+
+    def stop(self):
+        """停止定期保存并写入最后一次快照（信号处理和 atexit 都会调用，只保存一次）"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self.save_now()
@@ -0,0 +1,49 @@
+"""
+测试超大请求体：带 Content-Length 和分块传输（没有 Content-Length）时都返回 413 JSON
+不需要上游，直接运行: python test_request_body.py
+"""
+import io
+import os
+
+os.environ["MAX_REQUEST_BODY_BYTES"] = "1024"
+
+import multi_free_api_proxy_v3_optimized as proxy
+
+LIMIT = proxy.config.MAX_REQUEST_BODY_BYTES
+BODY = ('{"model": "test", "messages": [{"role": "user", "content": "' + "x" * (LIMIT * 4) + '"}]}').encode("utf-8")
+
+failures = []
+
+
+def check(name, ok):
+    print(f"{'通过' if ok else '失败'}: {name}")
+    if not ok:
+        failures.append(name)
+
+
+def is_too_large(response):
+    body = response.get_json(silent=True) or {}
+    error = body.get("error") if isinstance(body.get("error"), dict) else {}
+    return response.status_code == 413 and error.get("type") == "request_too_large"
+
+
+client = proxy.app.test_client()
+
+response = client.post("/v1/chat/completions", data=BODY, content_type="application/json")
+check("带 Content-Length 的超大请求返回 413 JSON", is_too_large(response))
+
+response = client.post(
+    "/v1/chat/completions",
+    input_stream=io.BytesIO(BODY),
+    headers={"Content-Type": "application/json", "Transfer-Encoding": "chunked"},
+    # 与开发服务器解码分块传输后的环境一致：没有 Content-Length，输入流以 EOF 结束
+    environ_overrides={"wsgi.input_terminated": True},
+)
+check("分块传输的超大请求返回 413 JSON", is_too_large(response))
+print(f"  状态码: {response.status_code}, 响应: {response.get_data(as_text=True)[:200]}")
+
+print("-" * 50)
+if failures:
+    print(f"失败 {len(failures)} 项")
+    exit(1)
+print("全部通过")
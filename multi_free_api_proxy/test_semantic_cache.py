@@ -0,0 +1,43 @@
+"""
+测试近似重复缓存：数字不同的提示词不能互相命中，只有列表编号不同的提示词可以命中
+不需要上游，直接运行: python test_semantic_cache.py
+"""
+from semantic_cache import SemanticCache
+
+
+def chat(text):
+    return {"model": "test", "temperature": 0, "messages": [{"role": "user", "content": text}]}
+
+
+def answer(text):
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+failures = []
+
+
+def check(name, ok):
+    print(f"{'通过' if ok else '失败'}: {name}")
+    if not ok:
+        failures.append(name)
+
+
+cache = SemanticCache(max_distance=3, max_temperature=0.3)
+cache.store(chat("17 * 23"), answer("391"))
+check("数字不同的算式不命中 (4 * 9)", cache.lookup(chat("4 * 9")) is None)
+check("数字位数相同也不命中 (71 * 32)", cache.lookup(chat("71 * 32")) is None)
+check("只有空白和大小写不同时精确命中", (cache.lookup(chat("  17   *  23 ")) or (None, -1))[1] == 0)
+
+template = ("请把下面的句子翻译成英文，并保持原文的语气和格式不变：\n"
+            "{n}. 今天的天气非常好，我们一起去公园散步吧，顺便带上相机拍一些照片。")
+cache.store(chat(template.format(n=1)), answer("translated"))
+check("只有列表编号不同时近似命中", cache.lookup(chat(template.format(n=2))) is not None)
+check("正文数字不同的模板不命中",
+      cache.lookup(chat(template.format(n=1).replace("一起去", "3 个人一起去"))) is None)
+
+print("-" * 50)
+print(cache.get_stats())
+if failures:
+    print(f"失败 {len(failures)} 项")
+    exit(1)
+print("全部通过")
@@ -0,0 +1,52 @@
+"""
+测试状态快照：上游处于故障惩罚期间重启，恢复后的权重仍能在成功后逐步回到惩罚前的值
+不需要上游，直接运行: python test_state_snapshot.py
+"""
+import tempfile
+from pathlib import Path
+
+import multi_free_api_proxy_v3_optimized as proxy
+from state_snapshot import SnapshotStore
+
+failures = []
+
+
+def check(name, ok):
+    print(f"{'通过' if ok else '失败'}: {name}")
+    if not ok:
+        failures.append(name)
+
+
+app_state = proxy.app_state
+for api_name in list(app_state.get_all_apis()):
+    app_state.free_apis.pop(api_name)
+app_state.add_api("freeA", {"api_key": "sk-a", "default_weight": 50})
+app_state.add_api("freeB", {"api_key": "sk-b", "default_weight": 30})
+proxy.init_default_weights()
+
+proxy.apply_failover_penalty("freeA", "server_error")
+penalized = app_state.get_weight("freeA")
+check("5xx 后权重降低", penalized < 50)
+
+with tempfile.TemporaryDirectory() as tmp:
+    store = SnapshotStore(Path(tmp) / "state_snapshot.json")
+    check("快照保存成功", store.save(app_state.export_snapshot()))
+
+    # 模拟重启：重新初始化默认权重后从快照恢复
+    proxy.init_default_weights()
+    app_state.restore_snapshot(store.load(3600), trust_seconds=0)
+
+check("恢复后保留惩罚后的权重", app_state.get_weight("freeA") == penalized)
+check("恢复惩罚前的权重", app_state.get_api("freeA").get("penalty_base_weight") == 50)
+check("未受惩罚的上游没有惩罚前权重", "penalty_base_weight" not in app_state.get_api("freeB"))
+
+for _ in range(20):
+    proxy.restore_penalized_weight("freeA", app_state.get_api("freeA"))
+check("成功后权重恢复到 50", app_state.get_weight("freeA") == 50)
+check("恢复完成后清除惩罚前权重", "penalty_base_weight" not in app_state.get_api("freeA"))
+
+print("-" * 50)
+if failures:
+    print(f"失败 {len(failures)} 项")
+    exit(1)
+print("全部通过")
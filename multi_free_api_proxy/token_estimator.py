@@ -0,0 +1,134 @@
+"""
+本地 token 估算与上下文窗口管理
+不依赖 tokenizer，按字符类别快速估算 token 数，并按消息内容哈希缓存结果，
+多轮对话重复发送的历史消息只需计算一次
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# CJK 字符（中日韩统一表意文字、假名、韩文、全角标点）大约 1 字符 ≈ 1 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+# OpenAI 格式的每条消息固定开销和回复引导开销
+TOKENS_PER_MESSAGE = 4
+TOKENS_REPLY_PRIMING = 3
+
+# 常见模型的上下文窗口（按模型名小写子串匹配，越具体的放越前面）
+# 上游 config.py 中的 CONTEXT_WINDOW 优先；未知模型返回 0 表示不限制
+DEFAULT_CONTEXT_WINDOWS = [
+    ("gpt-3.5-turbo", 16385),
+    ("llama-3.3-70b", 131072),
+    ("llama3.1-8b", 8192),
+    ("gemini", 1048576),
+    ("deepseek-v3", 128000),
+    ("mistral-small", 32768),
+    ("command-a", 256000),
+]
+
+
+def estimate_text_tokens(text: str) -> int:
+    """估算一段文本的 token 数：CJK 按 1 字符 1 token，其余按 4 字符 1 token"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def _message_text(message: Dict) -> str:
+    """提取消息中参与计费的文本（content 及多模态 text 片段、工具调用参数）"""
+    parts = []
+    content = message.get("content")
+    if isinstance(content, str):
+        parts.append(content)
+    elif isinstance(content, list):
+        for part in content:
+            if isinstance(part, dict) and isinstance(part.get("text"), str):
+                parts.append(part["text"])
+
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {}) if isinstance(tool_call, dict) else {}
+        parts.append(str(function.get("name", "")))
+        parts.append(str(function.get("arguments", "")))
+
+    if message.get("name"):
+        parts.append(str(message["name"]))
+    return "".join(parts)
+
+
+def message_hash(message) -> str:
+    """计算消息内容哈希（与字段顺序无关）"""
+    raw = json.dumps(message, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TokenEstimator:
+    """带 LRU 缓存的 token 估算器（线程安全）"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def estimate_message(self, message) -> int:
+        """估算单条消息的 token 数（含固定开销），按内容哈希缓存"""
+        if not isinstance(message, dict):
+            return TOKENS_PER_MESSAGE
+
+        key = message_hash(message)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        tokens = TOKENS_PER_MESSAGE + estimate_text_tokens(_message_text(message))
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = tokens
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def estimate_messages(self, messages: Optional[List]) -> int:
+        """估算整段对话的 prompt token 数"""
+        if not messages:
+            return 0
+        return sum(self.estimate_message(message) for message in messages) + TOKENS_REPLY_PRIMING
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def lookup_context_window(model: str, configured: Optional[int] = None) -> int:
+    """获取模型上下文窗口：优先使用上游配置，其次按模型名匹配默认表，未知返回 0"""
+    if configured:
+        return int(configured)
+    model_lower = (model or "").lower()
+    for pattern, window in DEFAULT_CONTEXT_WINDOWS:
+        if pattern in model_lower:
+            return window
+    return 0
+
+
+def fits_context_window(context_window: int, prompt_tokens: int, max_tokens: int) -> bool:
+    """检查 prompt + max_tokens 是否能放入上下文窗口（窗口未知时视为可以）"""
+    if not context_window:
+        return True
+    return prompt_tokens + int(max_tokens or 0) <= context_window
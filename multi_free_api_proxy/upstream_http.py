@@ -0,0 +1,465 @@
+"""
+上游 HTTP 客户端
+每个上游一个 requests.Session，共享两层缓存：
+- DNS 缓存：按 TTL 缓存解析结果（安装了 dnspython 时使用记录自身的 TTL，否则使用 DNS_CACHE_TTL），
+  过了 TTL 的 80% 后在后台刷新；解析失败时在 DNS_STALE_SECONDS 内继续使用旧结果
+- TLS 会话复用：所有上游共用一个 SSLContext（CA 证书只在创建时加载一次），按主机名和端口保存 TLS 会话，
+  新连接带上会话做简化握手
+
+计数器（命中次数、节省的解析时间和握手时间）见 GET /debug/network
+"""
+import ipaddress
+import os
+import socket
+import ssl
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_CA_BUNDLE_PATH
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:
+    dns = None
+
+
+class NetworkStats:
+    """DNS 与 TLS 计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.dns = {
+            "lookups": 0, "hits": 0, "misses": 0, "refreshes": 0,
+            "stale_served": 0, "failures": 0, "resolve_ms": 0.0,
+        }
+        self.tls = {"handshakes": 0, "resumed": 0, "full_ms": 0.0, "resumed_ms": 0.0}
+
+    def add_dns(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.dns[key] += value
+
+    def record_handshake(self, elapsed_ms: float, resumed: bool):
+        with self._lock:
+            self.tls["handshakes"] += 1
+            if resumed:
+                self.tls["resumed"] += 1
+                self.tls["resumed_ms"] += elapsed_ms
+            else:
+                self.tls["full_ms"] += elapsed_ms
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            dns_stats = dict(self.dns)
+            tls_stats = dict(self.tls)
+
+        # 未命中时的平均解析耗时 × 命中次数 = 节省的解析时间（刷新和首次解析都计入平均值）
+        resolved = dns_stats["misses"] + dns_stats["refreshes"]
+        avg_resolve = dns_stats["resolve_ms"] / resolved if resolved else 0.0
+        dns_stats["avg_resolve_ms"] = round(avg_resolve, 1)
+        dns_stats["saved_ms"] = round(avg_resolve * dns_stats["hits"], 1)
+        dns_stats["resolve_ms"] = round(dns_stats["resolve_ms"], 1)
+
+        full = tls_stats["handshakes"] - tls_stats["resumed"]
+        avg_full = tls_stats["full_ms"] / full if full else 0.0
+        avg_resumed = tls_stats["resumed_ms"] / tls_stats["resumed"] if tls_stats["resumed"] else 0.0
+        tls_stats["avg_full_ms"] = round(avg_full, 1)
+        tls_stats["avg_resumed_ms"] = round(avg_resumed, 1)
+        tls_stats["saved_ms"] = round(max(0.0, avg_full - avg_resumed) * tls_stats["resumed"], 1) if full else 0.0
+        tls_stats["full_ms"] = round(tls_stats["full_ms"], 1)
+        tls_stats["resumed_ms"] = round(tls_stats["resumed_ms"], 1)
+        return {"dns": dns_stats, "tls": tls_stats}
+
+
+class _DNSEntry:
+    __slots__ = ("addresses", "resolved_at", "expires_at", "refresh_at")
+
+    def __init__(self, addresses: List[str], ttl: float, refresh_ratio: float):
+        now = time.time()
+        self.addresses = addresses
+        self.resolved_at = now
+        self.expires_at = now + ttl
+        self.refresh_at = now + ttl * refresh_ratio
+
+
+class DNSCache:
+    """带 TTL 和后台刷新的解析缓存（只缓存 IP 地址，端口由连接自己决定）"""
+
+    def __init__(self, stats: NetworkStats, default_ttl: float = 300, min_ttl: float = 10,
+                 stale_seconds: float = 600, refresh_ratio: float = 0.8):
+        self.stats = stats
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.stale_seconds = stale_seconds
+        self.refresh_ratio = refresh_ratio
+        self._entries: Dict[str, _DNSEntry] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _lookup(self, host: str) -> Tuple[List[str], float]:
+        """实际解析，返回 (地址列表, TTL)"""
+        if dns is not None:
+            addresses, ttls = [], []
+            for rdtype in ("A", "AAAA"):
+                try:
+                    answer = dns.resolver.resolve(host, rdtype, lifetime=5)
+                except dns.exception.DNSException:
+                    continue
+                addresses.extend(record.to_text() for record in answer)
+                ttls.append(answer.rrset.ttl)
+            if addresses:
+                return addresses, max(self.min_ttl, min(ttls))
+
+        # 没有 dnspython 或其解析不到（如 hosts 文件中的名称）时使用系统解析器
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        return addresses, self.default_ttl
+
+    def _resolve_now(self, host: str, refresh: bool) -> _DNSEntry:
+        start = time.perf_counter()
+        addresses, ttl = self._lookup(host)
+        elapsed = (time.perf_counter() - start) * 1000
+        entry = _DNSEntry(addresses, ttl, self.refresh_ratio)
+        with self._lock:
+            self._entries[host] = entry
+        if refresh:
+            self.stats.add_dns(refreshes=1, resolve_ms=elapsed)
+        else:
+            self.stats.add_dns(misses=1, resolve_ms=elapsed)
+        return entry
+
+    def _refresh_in_background(self, host: str):
+        with self._lock:
+            if host in self._refreshing:
+                return
+            self._refreshing.add(host)
+
+        def run():
+            try:
+                self._resolve_now(host, refresh=True)
+            except OSError:
+                self.stats.add_dns(failures=1)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(host)
+
+        threading.Thread(target=run, name=f"dns-refresh-{host}", daemon=True).start()
+
+    def resolve(self, host: str) -> List[str]:
+        """返回主机的 IP 地址列表，解析失败且没有可用旧结果时抛出 socket.gaierror"""
+        self.stats.add_dns(lookups=1)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(host)
+
+        if entry is not None and now < entry.expires_at:
+            self.stats.add_dns(hits=1)
+            if now >= entry.refresh_at:
+                self._refresh_in_background(host)
+            return entry.addresses
+
+        try:
+            return self._resolve_now(host, refresh=False).addresses
+        except OSError:
+            self.stats.add_dns(failures=1)
+            if entry is not None and now < entry.expires_at + self.stale_seconds:
+                self.stats.add_dns(stale_served=1)
+                return entry.addresses
+            raise
+
+    def invalidate(self, host: str):
+        with self._lock:
+            self._entries.pop(host, None)
+
+    def entries(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            return {
+                host: {"addresses": entry.addresses, "expires_in": round(entry.expires_at - now, 1)}
+                for host, entry in self._entries.items()
+            }
+
+
+SessionKey = Tuple[str, int]
+
+
+class TLSSessionStore:
+    """按 (主机名, 端口) 保存 TLS 会话；TLS 1.3 的会话票据在握手后才到达，所以也从仍然打开的连接上取"""
+
+    def __init__(self):
+        self._sessions: Dict[SessionKey, ssl.SSLSession] = {}
+        self._live: Dict[SessionKey, weakref.WeakSet] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: SessionKey) -> Optional[ssl.SSLSession]:
+        with self._lock:
+            session = self._sessions.get(key)
+            live = list(self._live.get(key, ()))
+        if session is not None:
+            return session
+        for sock in live:
+            session = sock.current_session()
+            if session is not None:
+                self.put(key, session)
+                return session
+        return None
+
+    def put(self, key: SessionKey, session: ssl.SSLSession):
+        with self._lock:
+            self._sessions[key] = session
+
+    def discard(self, key: SessionKey):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def track(self, key: SessionKey, sock):
+        with self._lock:
+            self._live.setdefault(key, weakref.WeakSet()).add(sock)
+
+    def hosts(self) -> List[str]:
+        with self._lock:
+            return sorted(f"{host}:{port}" for host, port in self._sessions)
+
+
+class ResumingSSLSocket(ssl.SSLSocket):
+    """关闭前把 TLS 会话存回会话表"""
+    session_key: Optional[SessionKey] = None
+
+    def current_session(self) -> Optional[ssl.SSLSession]:
+        if self._sslobj is None:
+            return None
+        session = self.session
+        if session is not None and (session.has_ticket or session.id):
+            return session
+        return None
+
+    def close(self):
+        if self.session_key is not None:
+            session = self.current_session()
+            if session is not None:
+                self.context.session_store.put(self.session_key, session)
+        super().close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """握手时自动带上该主机和端口上次的 TLS 会话，并记录握手耗时
+
+    wrap_socket 只拿得到主机名，目标端口由 CachedHTTPSConnection.connect() 通过线程局部变量 target 传入
+    """
+    sslsocket_class = ResumingSSLSocket
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        self.session_store = TLSSessionStore()
+        self.stats: Optional[NetworkStats] = None
+        self.target = threading.local()
+        self._ca_loaded = set()
+        self._ca_lock = threading.Lock()
+
+    def load_ca_once(self, path: str):
+        """加载 CA 证书文件或目录，同一路径只加载一次"""
+        if path in self._ca_loaded:
+            return
+        with self._ca_lock:
+            if path in self._ca_loaded:
+                return
+            if os.path.isdir(path):
+                self.load_verify_locations(capath=path)
+            else:
+                self.load_verify_locations(cafile=path)
+            self._ca_loaded.add(path)
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        key = None
+        if server_hostname and not server_side:
+            key = (server_hostname, getattr(self.target, "port", None) or 443)
+        if session is None and key is not None:
+            session = self.session_store.get(key)
+
+        start = time.perf_counter()
+        try:
+            ssl_sock = super().wrap_socket(
+                sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+                suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session
+            )
+        except ssl.SSLError:
+            # 会话可能已失效，下次重新完整握手
+            if session is not None:
+                self.session_store.discard(key)
+            raise
+
+        if key is not None:
+            ssl_sock.session_key = key
+            self.session_store.track(key, ssl_sock)
+            if self.stats is not None and do_handshake_on_connect:
+                self.stats.record_handshake((time.perf_counter() - start) * 1000, ssl_sock.session_reused)
+        return ssl_sock
+
+
+def _is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+
+class _CachedResolveMixin:
+    """建立 TCP 连接前通过 DNS 缓存解析，逐个尝试缓存的地址
+
+    dns_cache 由 _bind_pool_classes 生成的子类设置，每个 CachingAdapter 使用自己的 DNS 缓存
+    """
+    dns_cache: Optional[DNSCache] = None
+
+    def _new_conn(self):
+        host = self._dns_host
+        if self.dns_cache is None or _is_ip_literal(host):
+            return super()._new_conn()
+        try:
+            addresses = self.dns_cache.resolve(host)
+        except OSError:
+            # 交给 urllib3 自己解析，以便抛出它的标准异常
+            return super()._new_conn()
+
+        last_error = None
+        for address in addresses:
+            # TLS 的 SNI 和证书校验使用 self.host，替换 _dns_host 只影响 TCP 连接目标
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except Exception as e:
+                last_error = e
+            finally:
+                self._dns_host = host
+        self.dns_cache.invalidate(host)
+        raise last_error
+
+
+class CachedHTTPConnection(_CachedResolveMixin, HTTPConnection):
+    pass
+
+
+class CachedHTTPSConnection(_CachedResolveMixin, HTTPSConnection):
+    def connect(self):
+        # 把目标端口告诉 ResumingSSLContext，TLS 会话按 (主机名, 端口) 区分
+        target = getattr(self.ssl_context, "target", None)
+        if target is None:
+            return super().connect()
+        target.port = self.port
+        try:
+            return super().connect()
+        finally:
+            target.port = None
+
+
+def _bind_pool_classes(dns_cache: Optional[DNSCache]) -> Dict[str, type]:
+    """生成绑定到指定 DNS 缓存的连接池类
+
+    不能通过 pool_kwargs 传入：urllib3 用连接池参数构造 PoolKey，不认识的参数会报错
+    """
+    http_conn = type("CachedHTTPConnection", (CachedHTTPConnection,), {"dns_cache": dns_cache})
+    https_conn = type("CachedHTTPSConnection", (CachedHTTPSConnection,), {"dns_cache": dns_cache})
+    return {
+        "http": type("CachedHTTPConnectionPool", (HTTPConnectionPool,), {"ConnectionCls": http_conn}),
+        "https": type("CachedHTTPSConnectionPool", (HTTPSConnectionPool,), {"ConnectionCls": https_conn}),
+    }
+
+
+class CachingAdapter(HTTPAdapter):
+    """使用 DNS 缓存和共享 SSLContext 的连接池"""
+
+    def __init__(self, ssl_context: ssl.SSLContext, dns_cache: Optional[DNSCache] = None, **kwargs):
+        self.ssl_context = ssl_context
+        self.pool_classes = _bind_pool_classes(dns_cache)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault("ssl_context", self.ssl_context)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.pool_classes)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        created = proxy not in self.proxy_manager
+        proxy_kwargs.setdefault("ssl_context", self.ssl_context)
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        # SOCKS 代理的连接池自己建立到代理的连接，不能替换
+        if created and not proxy.lower().startswith("socks"):
+            manager.pool_classes_by_scheme = dict(self.pool_classes)
+        return manager
+
+    def cert_verify(self, conn, url, verify, cert):
+        """CA 证书（默认证书包或 REQUESTS_CA_BUNDLE 等指定的路径）只加载到共享 SSLContext 一次，不再随连接池传给 urllib3
+
+        否则 urllib3 每建立一个新连接都会对共享的 SSLContext 调用 load_verify_locations
+        """
+        super().cert_verify(conn, url, verify, cert)
+        ca_path = conn.ca_certs or conn.ca_cert_dir
+        if ca_path:
+            self.ssl_context.load_ca_once(ca_path)
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("ssl_context", None)
+        return state
+
+
+class UpstreamClients:
+    """每个上游一个 Session（独立连接池），DNS 缓存和 TLS 会话在所有上游间共享"""
+
+    def __init__(self, enabled: bool = True, pool_maxsize: int = 10, dns_ttl: float = 300,
+                 dns_min_ttl: float = 10, dns_stale_seconds: float = 600):
+        self.enabled = enabled
+        self.pool_maxsize = pool_maxsize
+        self.stats = NetworkStats()
+        self.dns_cache = DNSCache(self.stats, default_ttl=dns_ttl, min_ttl=dns_min_ttl,
+                                  stale_seconds=dns_stale_seconds)
+        self.ssl_context = ResumingSSLContext()
+        self.ssl_context.load_default_certs()
+        # 与 requests 默认使用的 CA 证书包一致
+        self.ssl_context.load_ca_once(DEFAULT_CA_BUNDLE_PATH)
+        self.ssl_context.stats = self.stats
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_name: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(api_name)
+            if session is None:
+                session = requests.Session()
+                if self.enabled:
+                    adapter = CachingAdapter(self.ssl_context, dns_cache=self.dns_cache,
+                                             pool_connections=4, pool_maxsize=self.pool_maxsize)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                self._sessions[api_name] = session
+            return session
+
+    def close(self, api_name: Optional[str] = None):
+        """关闭指定上游（或全部）的连接池，如重新加载配置后"""
+        with self._lock:
+            names = [api_name] if api_name else list(self._sessions)
+            sessions = [self._sessions.pop(name) for name in names if name in self._sessions]
+        for session in sessions:
+            session.close()
+
+    def get_stats(self) -> Dict:
+        stats = self.stats.snapshot()
+        stats["enabled"] = self.enabled
+        stats["dns_backend"] = "dnspython" if dns is not None else "system"
+        stats["dns"]["entries"] = self.dns_cache.entries()
+        stats["tls"]["cached_sessions"] = self.ssl_context.session_store.hosts()
+        with self._lock:
+            stats["upstreams"] = sorted(self._sessions)
+        return stats
@@ -4,6 +4,7 @@ import sys
 import time
 import uuid
 import threading
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 from flask import Flask, request, jsonify
@@ -19,6 +20,8 @@ WATCHED_FILES = {'.env', 'local_api_proxy_optimized.py'}
 DEBUG_MODE = False
 CACHE_DIR = None
 MAX_CACHE_FILES = 100  # 最大缓存文件数，防止磁盘空间耗尽
+MAX_CACHE_BYTES = 0  # 缓存总大小上限（字节），0 表示不限制
+MAX_CACHE_AGE = 0  # 缓存保留时长（秒），0 表示不限制
 
 class FileChangeHandler(FileSystemEventHandler):
     """文件监控处理器"""
@@ -35,24 +38,89 @@ def check_debug_mode():
     """检查调试模式"""
     return Path('DEBUG_MODE.txt').exists()
 
-def cleanup_cache(cache_dir, max_files=MAX_CACHE_FILES):
-    """清理缓存文件，防止占用过多磁盘空间"""
-    if not cache_dir or not Path(cache_dir).exists():
-        return
+class CacheRetention:
+    """缓存文件保留管理
     
-    try:
+    启动时（或缓存目录变化时）扫描一次目录，之后在内存中按写入顺序维护文件索引，
+    每次写入只需从队头淘汰超出数量/大小/时长限制的旧文件，不再每次 glob + 排序
+    """
+    
+    def __init__(self, max_files=MAX_CACHE_FILES, max_bytes=MAX_CACHE_BYTES, max_age=MAX_CACHE_AGE):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.cache_dir = None
+        self._entries = deque()  # (写入时间, 文件路径, 字节数)，从旧到新
+        self._total_bytes = 0
+        self._evicted = 0
+        self._lock = threading.Lock()
+    
+    def _load(self, cache_dir, skip=None):
+        """扫描已有缓存文件建立索引（每个目录只做一次），skip 为正在记录的新文件"""
+        self.cache_dir = cache_dir
+        self._entries.clear()
+        self._total_bytes = 0
         cache_path = Path(cache_dir)
-        cache_files = list(cache_path.glob("*.json"))
+        if not cache_path.exists():
+            return
         
-        if len(cache_files) > max_files:
-            # 按修改时间排序，删除最旧的文件
-            cache_files.sort(key=lambda x: x.stat().st_mtime)
-            for old_file in cache_files[:-max_files]:
-                old_file.unlink()
-                print(f"[缓存清理] 删除旧缓存文件: {old_file.name}")
-                
-    except Exception as e:
-        print(f"[缓存错误] 清理失败: {e}")
+        existing = []
+        for path in cache_path.glob("*.json"):
+            # 每日计数文件不参与淘汰
+            if path.name.startswith("CALLS_") or path == skip:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            existing.append((stat.st_mtime, path, stat.st_size))
+        existing.sort(key=lambda x: x[0])
+        self._entries.extend(existing)
+        self._total_bytes = sum(size for _, _, size in existing)
+        print(f"[缓存] 已索引 {len(existing)} 个缓存文件")
+    
+    def _over_limit(self, now):
+        if len(self._entries) > self.max_files > 0:
+            return True
+        if self.max_bytes and self._total_bytes > self.max_bytes:
+            return True
+        if self.max_age and self._entries and now - self._entries[0][0] > self.max_age:
+            return True
+        return False
+    
+    def record(self, cache_dir, path, size):
+        """记录新写入的文件并淘汰超限的旧文件"""
+        with self._lock:
+            if cache_dir != self.cache_dir:
+                self._load(cache_dir, skip=Path(path))
+            
+            now = time.time()
+            self._entries.append((now, Path(path), size))
+            self._total_bytes += size
+            
+            # 最新写入的文件始终保留
+            while len(self._entries) > 1 and self._over_limit(now):
+                _, old_file, old_size = self._entries.popleft()
+                self._total_bytes -= old_size
+                self._evicted += 1
+                try:
+                    old_file.unlink()
+                    print(f"[缓存清理] 删除旧缓存文件: {old_file.name}")
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"[缓存错误] 清理失败: {e}")
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                "files": len(self._entries),
+                "bytes": self._total_bytes,
+                "evicted": self._evicted,
+                "max_files": self.max_files,
+                "max_bytes": self.max_bytes,
+                "max_age_seconds": self.max_age
+            }
 
 def save_message_cache(message_type, message_id, data):
     """保存消息缓存"""
@@ -63,9 +131,6 @@ def save_message_cache(message_type, message_id, data):
         cache_path = Path(CACHE_DIR)
         cache_path.mkdir(parents=True, exist_ok=True)
         
-        # 定期清理缓存
-        cleanup_cache(CACHE_DIR)
-        
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
         filename = f"{timestamp}_{message_type}_{message_id}.json"
         filepath = cache_path / filename
@@ -77,6 +142,10 @@ def save_message_cache(message_type, message_id, data):
                 'message_id': message_id,
                 'data': data
             }, f, indent=2, ensure_ascii=False)
+            size = f.tell()
+        
+        # 记录到保留索引并淘汰超限的旧文件
+        cache_retention.record(CACHE_DIR, filepath, size)
         
         print(f"[缓存] 已保存 {message_type} 消息: {filename}")
         
@@ -113,6 +182,11 @@ if not API_KEY:
 
 DEBUG_MODE = check_debug_mode()
 CACHE_DIR = os.getenv("CACHE_DIR")
+cache_retention = CacheRetention(
+    max_files=int(os.getenv("MAX_CACHE_FILES", MAX_CACHE_FILES)),
+    max_bytes=int(float(os.getenv("MAX_CACHE_MB", "0")) * 1024 * 1024) or MAX_CACHE_BYTES,
+    max_age=float(os.getenv("MAX_CACHE_AGE_HOURS", "0")) * 3600 or MAX_CACHE_AGE
+)
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 
 @app.route('/v1/chat/completions', methods=['POST'])
@@ -250,13 +324,14 @@ def debug_stats():
         if counter_file.exists():
             with open(counter_file, 'r', encoding='utf-8') as f:
                 stats = json.load(f)
-            return jsonify(stats)
         else:
-            return jsonify({
+            stats = {
                 "date": today,
                 "count": 0,
                 "last_updated": None
-            })
+            }
+        stats["retention"] = cache_retention.get_stats()
+        return jsonify(stats)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -0,0 +1,156 @@
+"""
+客户端认证
+- IP 白名单：启动时把 ALLOWED_IPS 中的地址/网段编译为前缀树，按位查找
+- 访问密钥：只保存 SHA-256 哈希，按哈希查表后用 hmac.compare_digest 做常量时间比较，
+  每个密钥的元数据（名称、每小时限额）在加载时预先构建，请求时直接取用
+
+生成密钥哈希：python client_auth.py <token>
+"""
+import hashlib
+import hmac
+import ipaddress
+import sys
+from typing import Dict, List, Optional
+
+
+class CIDRAllowlist:
+    """IP 网段白名单（IPv4 / IPv6 各一棵二进制前缀树）"""
+
+    def __init__(self, entries: Optional[List[str]] = None):
+        self._roots = {4: {}, 6: {}}
+        self.entries = []
+        self.invalid = []
+        for entry in entries or []:
+            self.add(entry)
+
+    def add(self, entry: str) -> bool:
+        """添加单个地址或网段（如 192.168.1.0/24），无效条目记录后忽略"""
+        entry = entry.strip()
+        if not entry:
+            return False
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            self.invalid.append(entry)
+            return False
+
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            if "end" in node:
+                # 已被更短的网段覆盖
+                self.entries.append(str(network))
+                return True
+            bit = (bits >> (width - 1 - i)) & 1
+            node = node.setdefault(bit, {})
+        # 标记网段终点，更长的前缀无需再保存
+        node.clear()
+        node["end"] = True
+        self.entries.append(str(network))
+        return True
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def contains(self, ip: str) -> bool:
+        """检查 IP 是否落在任一网段内"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        # IPv4 映射的 IPv6 地址按 IPv4 处理
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        node = self._roots[address.version]
+        if not node:
+            return False
+        bits = int(address)
+        width = address.max_prefixlen
+        for i in range(width):
+            if "end" in node:
+                return True
+            node = node.get((bits >> (width - 1 - i)) & 1)
+            if node is None:
+                return False
+        return "end" in node
+
+
+class ClientKey:
+    """已注册的访问密钥"""
+
+    __slots__ = ("name", "key_hash", "quota_per_hour")
+
+    def __init__(self, name: str, key_hash: str, quota_per_hour: int = 0):
+        self.name = name
+        self.key_hash = key_hash
+        self.quota_per_hour = quota_per_hour
+
+    def to_dict(self) -> Dict:
+        return {"name": self.name, "quota_per_hour": self.quota_per_hour}
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class KeyStore:
+    """访问密钥表：SHA-256 哈希 -> ClientKey"""
+
+    def __init__(self):
+        self._keys: Dict[str, ClientKey] = {}
+        self.invalid = []
+
+    def __bool__(self):
+        return bool(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, name: str, key_hash: str, quota_per_hour: int = 0):
+        key_hash = key_hash.strip().lower()
+        self._keys[key_hash] = ClientKey(name, key_hash, quota_per_hour)
+
+    def add_plain(self, name: str, token: str, quota_per_hour: int = 0):
+        """添加明文密钥（如 SECRET_TOKEN），只保存其哈希"""
+        self.add(name, hash_token(token), quota_per_hour)
+
+    def load_spec(self, spec: str):
+        """解析 CLIENT_API_KEYS：名称:sha256哈希[:每小时限额]，多个用逗号分隔"""
+        for item in spec.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            parts = item.split(":")
+            if len(parts) not in (2, 3) or len(parts[1]) != 64:
+                self.invalid.append(parts[0])
+                continue
+            try:
+                int(parts[1], 16)
+                quota = int(parts[2]) if len(parts) == 3 and parts[2] else 0
+            except ValueError:
+                self.invalid.append(parts[0])
+                continue
+            self.add(parts[0], parts[1], quota)
+
+    def verify(self, token: Optional[str]) -> Optional[ClientKey]:
+        """校验令牌，成功返回对应的 ClientKey"""
+        if not token:
+            return None
+        presented = hash_token(token)
+        key = self._keys.get(presented)
+        # 查表命中后仍做一次常量时间比较，比较结果不依赖于哈希的公共前缀长度
+        if key is not None and hmac.compare_digest(presented, key.key_hash):
+            return key
+        return None
+
+    def list_keys(self) -> List[Dict]:
+        return [key.to_dict() for key in self._keys.values()]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python client_auth.py <token>")
+        sys.exit(1)
+    print(hash_token(sys.argv[1]))
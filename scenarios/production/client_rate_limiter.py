@@ -0,0 +1,161 @@
+"""
+客户端请求频率限制
+按客户端键（IP / 访问令牌）维护令牌桶，桶分散在多个分片中，每个分片一把锁，
+过期的桶通过最小堆按到期时间淘汰（每次请求只弹出已到期的堆顶，均摊 O(1)），
+检查结果可直接生成标准的 X-RateLimit-* 响应头
+"""
+import heapq
+import math
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+
+class RateLimitDecision:
+    """一次频率检查的结果"""
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: float, key: str = ""):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset  # 距离令牌桶恢复满额的秒数
+        self.key = key
+
+    @property
+    def retry_after(self) -> int:
+        """被拒绝时距离下一个可用令牌的秒数"""
+        return 0 if self.allowed else max(1, math.ceil(self.reset))
+
+    def headers(self) -> Dict[str, str]:
+        """生成 X-RateLimit-* 响应头"""
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "expires_at")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+        self.expires_at = now
+
+
+class _Shard:
+    """一个分片：键到令牌桶的映射 + 按到期时间排序的堆"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, _Bucket] = {}
+        self.expiry_heap: List[Tuple[float, str]] = []
+
+    def expire(self, now: float):
+        """弹出已到期的桶（堆中的过时条目惰性跳过）"""
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            bucket = self.buckets.get(key)
+            if bucket is not None and bucket.expires_at <= now:
+                del self.buckets[key]
+
+
+class ClientRateLimiter:
+    """分片加锁的令牌桶限流器（线程安全）
+
+    每个键的桶容量为 limit，每 window 秒补满；桶恢复满额后即可丢弃，
+    再次出现时重新创建为满桶，结果等价
+    """
+
+    def __init__(self, shards: int = 16):
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self.stats = {"allowed": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[zlib.crc32(key.encode("utf-8")) % len(self._shards)]
+
+    def _take(self, key: str, limit: int, window: float, now: float, cost: float = 1.0) -> RateLimitDecision:
+        rate = limit / window
+        shard = self._shard(key)
+        with shard.lock:
+            shard.expire(now)
+            bucket = shard.buckets.get(key)
+            if bucket is None:
+                bucket = _Bucket(float(limit), now)
+                shard.buckets[key] = bucket
+            else:
+                bucket.tokens = min(float(limit), bucket.tokens + (now - bucket.updated_at) * rate)
+                bucket.updated_at = now
+
+            allowed = bucket.tokens >= cost
+            if allowed:
+                bucket.tokens -= cost
+                reset = (limit - bucket.tokens) / rate
+            else:
+                reset = (cost - bucket.tokens) / rate
+
+            # 桶补满的时刻即可淘汰；只在到期时间推后时入堆，旧条目在弹出时跳过
+            full_at = now + (limit - bucket.tokens) / rate
+            if full_at > bucket.expires_at:
+                bucket.expires_at = full_at
+                heapq.heappush(shard.expiry_heap, (full_at, key))
+
+            return RateLimitDecision(allowed, limit, int(bucket.tokens), reset, key)
+
+    def _refund(self, key: str, limit: int, cost: float = 1.0):
+        shard = self._shard(key)
+        with shard.lock:
+            bucket = shard.buckets.get(key)
+            if bucket is not None:
+                bucket.tokens = min(float(limit), bucket.tokens + cost)
+
+    def check(self, rules: List[Tuple[str, int, float]]) -> Optional[RateLimitDecision]:
+        """按多条规则 (键, 次数上限, 窗口秒数) 检查一次请求
+
+        全部通过才计数；任一规则拒绝时归还已扣除的令牌。
+        返回最严格（剩余最少/被拒绝）的规则结果，没有规则时返回 None
+        """
+        now = time.monotonic()
+        taken = []
+        result = None
+        for key, limit, window in rules:
+            if not limit or limit <= 0:
+                continue
+            decision = self._take(key, int(limit), float(window), now)
+            if not decision.allowed:
+                for taken_key, taken_limit in taken:
+                    self._refund(taken_key, taken_limit)
+                result = decision
+                break
+            taken.append((key, int(limit)))
+            if result is None or decision.remaining < result.remaining:
+                result = decision
+
+        if result is not None:
+            with self._stats_lock:
+                self.stats["allowed" if result.allowed else "rejected"] += 1
+        return result
+
+    def snapshot(self, limit_keys: int = 100) -> Dict:
+        """当前状态（用于管理接口）"""
+        now = time.monotonic()
+        active = {}
+        total = 0
+        for shard in self._shards:
+            with shard.lock:
+                shard.expire(now)
+                total += len(shard.buckets)
+                for key, bucket in shard.buckets.items():
+                    if len(active) < limit_keys:
+                        active[key] = {"tokens": round(bucket.tokens, 2),
+                                       "full_in": round(max(0.0, bucket.expires_at - now), 1)}
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, active_keys=total, shards=len(self._shards), keys=active)
@@ -1,27 +1,34 @@
 import os
-import json
 import sys
 import time
 import uuid
 import hashlib
 import threading
 from pathlib import Path
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from datetime import datetime
+from flask import Flask, request, jsonify, g
 from functools import wraps
 import requests
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# 共享的调试消息捕获模块位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from message_capture import get_capture
+from client_rate_limiter import ClientRateLimiter
+from client_auth import CIDRAllowlist, KeyStore
+
 app = Flask(__name__)
 
 # 安全配置
 SECURITY_CONFIG = {
     'allowed_ips': [],
+    'allowlist': CIDRAllowlist(),
     'secret_token': None,
+    'key_store': KeyStore(),
     'enable_rate_limit': False,
     'max_requests_per_hour': 100,
-    'rate_limit_cache': {},
+    'max_requests_per_hour_per_token': 0,
     'request_logs': []
 }
 
@@ -30,68 +37,68 @@ RESTART_FLAG = False
 WATCHED_FILES = {'.env', '.env.production', 'secure_api_proxy.py'}
 DEBUG_MODE = False
 CACHE_DIR = None
+RATE_LIMIT_WINDOW = 3600  # 频率限制窗口（秒）
+rate_limiter = ClientRateLimiter()
 
 class SecurityMiddleware:
     """安全中间件"""
     
     @staticmethod
     def check_ip_whitelist():
-        """检查IP白名单"""
-        client_ip = request.remote_addr
-        allowed_ips = SECURITY_CONFIG['allowed_ips']
-        
-        if not allowed_ips:
+        """检查IP白名单（支持单个地址和 CIDR 网段）"""
+        allowlist = SECURITY_CONFIG['allowlist']
+        if not allowlist:
             return True  # 如果没有配置白名单，允许所有IP
-            
-        return client_ip in allowed_ips
+        
+        return allowlist.contains(request.remote_addr)
     
     @staticmethod
-    def check_token():
-        """检查访问令牌"""
-        token = request.headers.get('Authorization')
-        if not token:
-            return False
-        
-        # 移除 "Bearer " 前缀
+    def bearer_token():
+        """提取 Authorization 头中的令牌"""
+        token = request.headers.get('Authorization', '')
         if token.startswith('Bearer '):
             token = token[7:]
-        
-        secret_token = SECURITY_CONFIG['secret_token']
-        if not secret_token:
+        return token.strip()
+    
+    @staticmethod
+    def check_token():
+        """检查访问令牌，通过时把匹配的密钥记录到 g.client_key"""
+        g.client_key = None
+        key_store = SECURITY_CONFIG['key_store']
+        if not key_store:
             return True  # 如果没有配置token，跳过验证
         
-        # 简单的token验证（实际项目中应使用JWT等）
-        return token == secret_token
+        client_key = key_store.verify(SecurityMiddleware.bearer_token())
+        if client_key is None:
+            return False
+        g.client_key = client_key
+        return True
     
     @staticmethod
     def check_rate_limit():
-        """检查请求频率限制"""
-        if not SECURITY_CONFIG['enable_rate_limit']:
-            return True
+        """检查请求频率限制（按 IP，配置了每令牌限额时同时按令牌）
         
-        client_ip = request.remote_addr
-        now = datetime.now()
-        cache = SECURITY_CONFIG['rate_limit_cache']
-        
-        # 清理过期记录
-        expired_keys = [k for k, v in cache.items() 
-                       if now - v['first_request'] > timedelta(hours=1)]
-        for k in expired_keys:
-            del cache[k]
+        返回 RateLimitDecision，未启用时返回 None
+        """
+        if not SECURITY_CONFIG['enable_rate_limit']:
+            return None
         
-        # 检查当前IP的请求次数
-        if client_ip not in cache:
-            cache[client_ip] = {
-                'count': 1,
-                'first_request': now
-            }
-            return True
+        rules = [(f"ip:{request.remote_addr}", SECURITY_CONFIG['max_requests_per_hour'], RATE_LIMIT_WINDOW)]
         
-        if cache[client_ip]['count'] >= SECURITY_CONFIG['max_requests_per_hour']:
-            return False
+        client_key = g.get('client_key')
+        if client_key is not None:
+            # 已注册密钥：优先使用该密钥自己的限额
+            quota = client_key.quota_per_hour or SECURITY_CONFIG['max_requests_per_hour_per_token']
+            if quota:
+                rules.append((f"key:{client_key.name}", quota, RATE_LIMIT_WINDOW))
+        else:
+            token = SecurityMiddleware.bearer_token()
+            if token and SECURITY_CONFIG['max_requests_per_hour_per_token']:
+                # 只用令牌哈希作为键，避免在内存/管理接口中出现明文令牌
+                token_key = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+                rules.append((f"token:{token_key}", SECURITY_CONFIG['max_requests_per_hour_per_token'], RATE_LIMIT_WINDOW))
         
-        cache[client_ip]['count'] += 1
-        return True
+        return rate_limiter.check(rules)
 
 def require_auth(f):
     """身份验证装饰器"""
@@ -108,13 +115,28 @@ def require_auth(f):
             return jsonify({"error": "Invalid token"}), 401
         
         # 检查频率限制
-        if not SecurityMiddleware.check_rate_limit():
-            app.logger.warning(f'Rate limit exceeded for: {request.remote_addr}')
-            return jsonify({"error": "Rate limit exceeded"}), 429
+        decision = SecurityMiddleware.check_rate_limit()
+        if decision is not None:
+            g.rate_limit = decision
+            if not decision.allowed:
+                app.logger.warning(f'Rate limit exceeded for: {request.remote_addr} ({decision.key})')
+                return jsonify({
+                    "error": "Rate limit exceeded",
+                    "retry_after": decision.retry_after
+                }), 429
         
         return f(*args, **kwargs)
     return decorated_function
 
+@app.after_request
+def add_rate_limit_headers(response):
+    """为经过频率检查的请求附加 X-RateLimit-* 响应头"""
+    decision = g.get('rate_limit')
+    if decision is not None:
+        for key, value in decision.headers().items():
+            response.headers[key] = value
+    return response
+
 def load_security_config():
     """加载安全配置"""
     env_file = ".env.production" if os.path.exists(".env.production") else ".env"
@@ -132,12 +154,27 @@ def load_security_config():
     allowed_ips_str = os.getenv("ALLOWED_IPS", "")
     if allowed_ips_str:
         SECURITY_CONFIG['allowed_ips'] = [ip.strip() for ip in allowed_ips_str.split(",")]
+    # 预编译白名单，重新加载时整体替换
+    allowlist = CIDRAllowlist(SECURITY_CONFIG['allowed_ips'])
+    if allowlist.invalid:
+        print(f"[安全] 忽略无效的白名单条目: {', '.join(allowlist.invalid)}")
+    SECURITY_CONFIG['allowlist'] = allowlist
     
     SECURITY_CONFIG['secret_token'] = os.getenv("SECRET_TOKEN")
     
+    # 访问密钥：SECRET_TOKEN（明文，加载后只保留哈希）+ CLIENT_API_KEYS（哈希）
+    key_store = KeyStore()
+    if SECURITY_CONFIG['secret_token']:
+        key_store.add_plain("default", SECURITY_CONFIG['secret_token'])
+    key_store.load_spec(os.getenv("CLIENT_API_KEYS", ""))
+    if key_store.invalid:
+        print(f"[安全] 忽略格式错误的密钥: {', '.join(key_store.invalid)}")
+    SECURITY_CONFIG['key_store'] = key_store
+    
     if os.getenv("ENABLE_RATE_LIMIT", "").lower() == "true":
         SECURITY_CONFIG['enable_rate_limit'] = True
         SECURITY_CONFIG['max_requests_per_hour'] = int(os.getenv("MAX_REQUESTS_PER_HOUR", "100"))
+        SECURITY_CONFIG['max_requests_per_hour_per_token'] = int(os.getenv("MAX_REQUESTS_PER_HOUR_PER_TOKEN", "0"))
 
 # 文件监控
 class FileChangeHandler(FileSystemEventHandler):
@@ -157,24 +194,7 @@ def save_message_cache(message_type, message_id, data):
         return
     
     try:
-        cache_path = Path(CACHE_DIR)
-        cache_path.mkdir(parents=True, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-        filename = f"{timestamp}_{message_type}_{message_id}.json"
-        filepath = cache_path / filename
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump({
-                'timestamp': datetime.now().isoformat(),
-                'type': message_type,
-                'message_id': message_id,
-                'client_ip': request.remote_addr,
-                'data': data
-            }, f, indent=2, ensure_ascii=False)
-        
-        app.logger.debug(f'Cached {message_type} message: {filename}')
-        
+        get_capture(CACHE_DIR).capture(message_type, message_id, data, client_ip=request.remote_addr)
     except Exception as e:
         app.logger.error(f'Cache save failed: {e}')
 
@@ -302,14 +322,13 @@ def admin_stats():
         stats = {
             "security_config": {
                 "ip_whitelist_enabled": len(SECURITY_CONFIG['allowed_ips']) > 0,
-                "token_auth_enabled": SECURITY_CONFIG['secret_token'] is not None,
+                "token_auth_enabled": bool(SECURITY_CONFIG['key_store']),
+                "client_keys": SECURITY_CONFIG['key_store'].list_keys(),
                 "rate_limit_enabled": SECURITY_CONFIG['enable_rate_limit'],
-                "max_requests_per_hour": SECURITY_CONFIG['max_requests_per_hour']
-            },
-            "current_rate_limits": {
-                ip: {"count": data["count"], "first_request": data["first_request"].isoformat()}
-                for ip, data in SECURITY_CONFIG['rate_limit_cache'].items()
+                "max_requests_per_hour": SECURITY_CONFIG['max_requests_per_hour'],
+                "max_requests_per_hour_per_token": SECURITY_CONFIG['max_requests_per_hour_per_token']
             },
+            "current_rate_limits": rate_limiter.snapshot(),
             "debug_mode": DEBUG_MODE,
             "cache_configured": CACHE_DIR is not None
         }
@@ -338,7 +357,8 @@ if __name__ == '__main__':
     print(f"监听地址: http://{host}:{port}")
     print("安全配置:")
     print(f"  IP白名单: {SECURITY_CONFIG['allowed_ips'] if SECURITY_CONFIG['allowed_ips'] else '未配置'}")
-    print(f"  Token认证: {'已启用' if SECURITY_CONFIG['secret_token'] else '未启用'}")
+    key_count = len(SECURITY_CONFIG['key_store'])
+    print(f"  Token认证: {f'已启用（{key_count} 个密钥）' if key_count else '未启用'}")
     print(f"  频率限制: {'已启用' if SECURITY_CONFIG['enable_rate_limit'] else '未启用'}")
     print(f"  调试模式: {'已启用' if DEBUG_MODE else '已禁用'}")
     print("=" * 60)
@@ -2,17 +2,19 @@
 # 只需要把原文件的最后一行改一下就行
 
 import os
-import json
 import sys
 import time
 import uuid
 from pathlib import Path
-from datetime import datetime
 from flask import Flask, request, jsonify
 import requests
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# 共享的调试消息捕获模块位于仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent))
+from message_capture import get_capture
+
 app = Flask(__name__)
 
 # 全局变量用于重启控制
@@ -37,28 +39,12 @@ def check_debug_mode():
     return Path('DEBUG_MODE.txt').exists()
 
 def save_message_cache(message_type, message_id, data):
-    """保存消息到缓存目录"""
+    """保存消息到调试捕获（追加到 JSONL 分段，由后台线程写入）"""
     if not DEBUG_MODE or not CACHE_DIR:
         return
     
     try:
-        cache_path = Path(CACHE_DIR)
-        cache_path.mkdir(parents=True, exist_ok=True)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
-        filename = f"{timestamp}_{message_type}_{message_id}.json"
-        filepath = cache_path / filename
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump({
-                'timestamp': datetime.now().isoformat(),
-                'type': message_type,
-                'message_id': message_id,
-                'data': data
-            }, f, indent=2, ensure_ascii=False)
-        
-        print(f"[缓存] 已保存 {message_type} 消息: {filename}")
-        
+        get_capture(CACHE_DIR).capture(message_type, message_id, data)
     except Exception as e:
         print(f"[缓存错误] 保存消息失败: {e}")
 
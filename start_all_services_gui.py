@@ -9,11 +9,15 @@ import subprocess
 import threading
 import time
 import json
+import queue
+from collections import deque
 from pathlib import Path
 from tkinter import ttk, scrolledtext, Tk, StringVar, messagebox
 import tkinter as tk
 
 CONFIG_FILE = "gui_config.json"
+OUTPUT_DRAIN_INTERVAL_MS = 100  # 界面刷新间隔
+OUTPUT_DRAIN_BATCH = 500        # 每次刷新最多处理的输出行数
 
 
 class ServiceManagerGUI:
@@ -31,15 +35,17 @@ class ServiceManagerGUI:
         # 检查调试模式文件是否存在
         self.debug_mode = tk.BooleanVar(value=self.check_debug_mode_file())
         self.max_lines = 1000
-        self.output_buffers = {
-            "free8": [],
-            "main": []
-        }
+        # 读取线程只向队列投递 (服务ID, 文本, 标签)，由主线程定时批量刷新到界面
+        self.output_queue = queue.SimpleQueue()
+        # 每个服务的滚动缓冲（环形，超出 max_lines 自动丢弃最早的行）和尚未显示的行
+        self.scrollback = {}
+        self.pending_output = {}
 
         self.root.bind('<Unmap>', self.on_minimize)
         self.root.bind('<Map>', self.on_restore)
 
         self.create_widgets()
+        self.root.after(OUTPUT_DRAIN_INTERVAL_MS, self.drain_output)
 
     def load_config(self):
         config_path = Path(__file__).parent / CONFIG_FILE
@@ -181,29 +187,64 @@ class ServiceManagerGUI:
         self.service_widgets[service_id]['status_label'].pack(side=tk.LEFT, padx=10)
 
     def append_output(self, service_id, text, tag="info"):
-        """向指定服务的文本框追加输出"""
-        # 如果窗口最小化，将输出存入缓冲区
-        if self.is_minimized:
-            if service_id in self.output_buffers:
-                self.output_buffers[service_id].append((text, tag))
-                # 限制缓冲区大小，避免内存占用过高
-                if len(self.output_buffers[service_id]) > self.max_lines:
-                    self.output_buffers[service_id] = self.output_buffers[service_id][-self.max_lines:]
-            return
-
-        # 窗口可见时，直接更新文本框
-        if service_id in self.service_widgets:
-            text_widget = self.service_widgets[service_id]['text_widget']
+        """向指定服务追加一行输出（任意线程可调用，不直接操作界面）"""
+        self.output_queue.put((service_id, text, tag))
 
-            # 限制最大行数
-            line_count = int(text_widget.index('end-1c').split('.')[0])
-            if line_count >= self.max_lines:
-                # 删除最早的行
-                text_widget.delete(1.0, f"{line_count - self.max_lines + 100}.0")
-
-            text_widget.insert(tk.END, text + "\n", tag)
-            text_widget.see(tk.END)
-            text_widget.update_idletasks()  # 使用 update_idletasks 代替 update，更高效
+    def drain_output(self):
+        """定时从队列取出输出：写入滚动缓冲，窗口可见时批量刷新到文本框"""
+        try:
+            for _ in range(OUTPUT_DRAIN_BATCH):
+                try:
+                    service_id, text, tag = self.output_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if tag == "__status__":
+                    status, color = text
+                    self.update_service_status(service_id, status, color)
+                    continue
+                if service_id not in self.scrollback:
+                    self.scrollback[service_id] = deque(maxlen=self.max_lines)
+                    self.pending_output[service_id] = deque(maxlen=self.max_lines)
+                self.scrollback[service_id].append((text, tag))
+                self.pending_output[service_id].append((text, tag))
+
+            if not self.is_minimized:
+                for service_id, pending in self.pending_output.items():
+                    if pending:
+                        self.render_lines(service_id, list(pending))
+                        pending.clear()
+        finally:
+            # 队列仍有积压时尽快再处理下一批
+            delay = 1 if not self.output_queue.empty() else OUTPUT_DRAIN_INTERVAL_MS
+            self.root.after(delay, self.drain_output)
+
+    def render_lines(self, service_id, lines, replace=False):
+        """把多行输出一次性写入文本框（相同标签的连续行合并插入），并裁剪到 max_lines"""
+        if service_id not in self.service_widgets:
+            return
+        text_widget = self.service_widgets[service_id]['text_widget']
+        if replace:
+            text_widget.delete(1.0, tk.END)
+
+        chunk, chunk_tag = [], None
+        for text, tag in lines:
+            if tag != chunk_tag and chunk:
+                text_widget.insert(tk.END, "\n".join(chunk) + "\n", chunk_tag)
+                chunk = []
+            chunk_tag = tag
+            chunk.append(text)
+        if chunk:
+            text_widget.insert(tk.END, "\n".join(chunk) + "\n", chunk_tag)
+
+        # 末尾换行后还有一个空行，实际行数为 line_count - 1
+        line_count = int(text_widget.index('end-1c').split('.')[0])
+        if line_count - 1 > self.max_lines:
+            text_widget.delete(1.0, f"{line_count - self.max_lines}.0")
+        text_widget.see(tk.END)
+
+    def post_service_status(self, service_id, status, color="gray"):
+        """从后台线程更新服务状态（经队列交给主线程执行）"""
+        self.output_queue.put((service_id, (status, color), "__status__"))
 
     def update_service_status(self, service_id, status, color="gray"):
         """更新服务状态"""
@@ -263,7 +304,7 @@ class ServiceManagerGUI:
             return_code = process.poll()
             if return_code is not None:
                 self.append_output(service_id, f"[停止] 进程已退出，返回码: {return_code}", "warning")
-                self.update_service_status(service_id, "已停止", "gray")
+                self.post_service_status(service_id, "已停止", "gray")
                 if service_id in self.processes:
                     del self.processes[service_id]
 
@@ -334,26 +375,20 @@ class ServiceManagerGUI:
 
     def on_restore(self, event):
         """窗口恢复时的处理"""
+        if not self.is_minimized:
+            return
         self.is_minimized = False
         print("[优化] 窗口恢复，刷新缓冲区内容")
 
-        # 恢复缓冲区的内容
-        for service_id, buffer in self.output_buffers.items():
-            if buffer and service_id in self.service_widgets:
-                text_widget = self.service_widgets[service_id]['text_widget']
-
-                # 批量插入缓冲区内容
-                for text, tag in buffer:
-                    line_count = int(text_widget.index('end-1c').split('.')[0])
-                    if line_count >= self.max_lines:
-                        text_widget.delete(1.0, f"{line_count - self.max_lines + 100}.0")
-                    text_widget.insert(tk.END, text + "\n", tag)
-
-                text_widget.see(tk.END)
-                text_widget.update_idletasks()
-
-                # 清空缓冲区
-                self.output_buffers[service_id].clear()
+        # 最小化期间积累的输出较多时直接用滚动缓冲重绘，避免逐行追加
+        for service_id, pending in self.pending_output.items():
+            if not pending:
+                continue
+            if len(pending) >= self.max_lines:
+                self.render_lines(service_id, list(self.scrollback[service_id]), replace=True)
+            else:
+                self.render_lines(service_id, list(pending))
+            pending.clear()
 
     def on_closing(self):
         """窗口关闭时的处理"""